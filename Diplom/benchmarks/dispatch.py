@@ -0,0 +1,89 @@
+"""
+Микробенчмарк маршрутизации текстовых сообщений по шагу диалога.
+
+Сравнивает цепочку обработчиков с фильтром состояния (как было раньше)
+и один обработчик со словарём шаг -> функция (как в bot_handlers)
+при разном количестве шагов. Сообщение адресовано последнему шагу,
+то есть для цепочки фильтров это худший случай.
+
+Запуск из каталога Diplom:
+    python -m benchmarks.dispatch
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.filters import StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Chat, Message, Update, User
+
+TOKEN = "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+UID = 1
+ITERATIONS = 2000
+STEP_COUNTS = (5, 10, 20, 50)
+
+
+async def _noop(message: Message, state: FSMContext):
+    pass
+
+
+def filter_chain_router(steps):
+    router = Router()
+    for step in range(steps):
+        router.message.register(_noop, StateFilter(f"step{step}"))
+    return router
+
+
+def dispatch_table_router(steps):
+    router = Router()
+    handlers = {f"step{step}": _noop for step in range(steps)}
+
+    @router.message()
+    async def dispatch(message: Message, state: FSMContext):
+        handler = handlers.get(await state.get_state(), _noop)
+        await handler(message, state)
+
+    return router
+
+
+def make_update(update_id):
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(timezone.utc),
+            chat=Chat(id=UID, type="private"),
+            from_user=User(id=UID, is_bot=False, first_name="bench"),
+            text="text",
+        ),
+    )
+
+
+async def measure(router, steps):
+    bot = Bot(token=TOKEN)
+    dp = Dispatcher()
+    dp.include_router(router)
+    key = StorageKey(bot_id=bot.id, chat_id=UID, user_id=UID)
+    await dp.storage.set_state(key, f"step{steps - 1}")
+
+    updates = [make_update(i) for i in range(ITERATIONS)]
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    elapsed = time.perf_counter() - started
+    await bot.session.close()
+    return elapsed / ITERATIONS * 1e6
+
+
+async def main():
+    print(f"{'шагов':>6} | {'фильтры, мкс':>13} | {'словарь, мкс':>13}")
+    for steps in STEP_COUNTS:
+        chain = await measure(filter_chain_router(steps), steps)
+        table = await measure(dispatch_table_router(steps), steps)
+        print(f"{steps:>6} | {chain:>13.1f} | {table:>13.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
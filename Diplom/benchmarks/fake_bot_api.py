@@ -0,0 +1,127 @@
+"""
+Локальный поддельный Bot API с лимитами Telegram для проверки send_queue.
+
+Сервер отвечает на /bot<token>/<method> как api.telegram.org и возвращает 429
+с retry_after при превышении лимитов: не больше PER_CHAT_BURST запросов
+за PER_CHAT_BURST / PER_CHAT_RATE секунд в один чат и GLOBAL_RATE в секунду
+всего. Лимиты считаются скользящим окном — строже корзины токенов в очереди,
+поэтому часть 429 приходится и на очередь, и видно, что повторы их отрабатывают.
+
+Сценарий: CHATS чатов получают по PARTS сообщений (как handle_rules) сначала
+напрямую, затем через SendQueueMiddleware. Для каждого прогона печатаются
+число ответов 429, число ошибок у отправителя и время.
+
+Запуск из каталога Diplom:
+    python -m benchmarks.fake_bot_api [CHATS] [PARTS]
+"""
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+from aiohttp import web
+
+from benchmarks.fakes import TOKEN
+from send_queue import SendQueueMiddleware, post, priority, LOW
+
+HOST, PORT = "127.0.0.1", 8081
+GLOBAL_RATE = 30
+PER_CHAT_RATE = 1
+PER_CHAT_BURST = 3
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.global_times = []
+        self.chat_times = defaultdict(list)
+        self.rejected = 0
+        self.delivered = defaultdict(list)
+        self.message_id = 0
+
+    @staticmethod
+    def _recent(times, now, window=1.0):
+        while times and now - times[0] >= window:
+            times.pop(0)
+        return len(times)
+
+    async def handle(self, request):
+        method = request.match_info["method"].lower()
+        data = dict(await request.post())
+        now = time.monotonic()
+        chat_id = data.get("chat_id")
+        if chat_id is not None:
+            if (self._recent(self.global_times, now) >= GLOBAL_RATE
+                    or self._recent(self.chat_times[chat_id], now, PER_CHAT_BURST / PER_CHAT_RATE) >= PER_CHAT_BURST):
+                self.rejected += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                })
+            self.global_times.append(now)
+            self.chat_times[chat_id].append(now)
+        if method != "sendmessage":
+            return web.json_response({"ok": True, "result": True})
+        self.message_id += 1
+        self.delivered[chat_id].append(data["text"])
+        return web.json_response({"ok": True, "result": {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "text": data["text"],
+        }})
+
+
+async def _run(chats, parts, queued):
+    api = FakeBotAPI()
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://{HOST}:{PORT}"))
+    if queued:
+        session.middleware(SendQueueMiddleware(global_rate=GLOBAL_RATE, per_chat_rate=PER_CHAT_RATE,
+                                               per_chat_burst=PER_CHAT_BURST))
+    bot = Bot(token=TOKEN, session=session)
+
+    started = time.perf_counter()
+    with priority(LOW):
+        tasks = [
+            post(bot.send_message(chat_id, f"Часть {part + 1}"))
+            for chat_id in range(1, chats + 1)
+            for part in range(parts)
+        ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    failed = sum(isinstance(result, TelegramRetryAfter) for result in results)
+    messages = sum(len(texts) for texts in api.delivered.values())
+
+    await session.close()
+    await runner.cleanup()
+    return {
+        "mode": "queue" if queued else "direct",
+        "429": api.rejected,
+        "failed": failed,
+        "messages": messages,
+        "seconds": round(elapsed, 2),
+    }
+
+
+async def main():
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    parts = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    print(f"{chats} чатов x {parts} сообщений")
+    for queued in (False, True):
+        print(json.dumps(await _run(chats, parts, queued), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,240 @@
+"""
+Подставной пул соединений MySQL для нагрузочных тестов без сервера базы.
+
+FakePool повторяет ту часть интерфейса aiomysql.Pool, которой пользуется
+database: acquire/release, size/freesize, курсоры с execute/executemany,
+begin/commit/rollback. Запросы распознаются по реестру queries.QUERIES
+и выполняются над словарями в памяти; каждый запрос ждёт latency секунд,
+как при обращении к серверу по сети. Уникальный ключ booking_seats
+проверяется так же, как в MySQL (aiomysql.IntegrityError).
+"""
+import asyncio
+import re
+from datetime import date, datetime, timedelta
+
+import aiomysql
+
+from queries import QUERIES
+
+_IN_LIST = re.compile(r"IN \((?:%s,)*%s\)")
+_BY_SQL = {query.sql: name for name, query in QUERIES.items()}
+
+
+def _query_name(sql):
+    name = _BY_SQL.get(sql) or _BY_SQL.get(_IN_LIST.sub("IN ({in_list})", sql))
+    if name is None:
+        raise NotImplementedError(f"FakePool не знает запрос: {sql}")
+    return name
+
+
+def _to_time(value):
+    if isinstance(value, timedelta):
+        return value
+    hours, minutes = str(value).split(":")[:2]
+    return timedelta(hours=int(hours), minutes=int(minutes))
+
+
+def _to_date(value):
+    return value if isinstance(value, date) else datetime.strptime(value, "%Y-%m-%d").date()
+
+
+class FakeDatabase:
+    """Таблицы Users, UserInfo и booking_seats в памяти."""
+
+    def __init__(self):
+        self.users = {}
+        self.bookings = {}
+        self.seats = {}
+        self.next_id = 1
+        self.queries = 0
+
+    def _booking_row(self, booking_id):
+        b = self.bookings[booking_id]
+        return (booking_id, b["start_slot"], b["zone"], b["computers"], b["duration_minutes"])
+
+    def _select_ids(self, name, params):
+        if name.endswith("by_booking_id"):
+            return [int(params[0])] if int(params[0]) in self.bookings else []
+        if name.endswith(("user_bookings_by_ids", "user_booking_ids")):
+            *ids, uid = params
+            return [int(i) for i in ids if self.bookings.get(int(i), {}).get("user_id") == uid]
+        if name.endswith("by_booking_ids"):
+            return [int(i) for i in params if int(i) in self.bookings]
+        if name.endswith("by_uid"):
+            return [i for i, b in self.bookings.items() if b["user_id"] == params[0]]
+        if name.endswith("by_contact"):
+            return [i for i, b in self.bookings.items() if (b["phone"], b["nickname"]) == tuple(params)]
+        raise NotImplementedError(name)
+
+    def execute(self, name, params, undo):
+        """Выполняет запрос; возвращает (строки, rowcount, lastrowid)."""
+        self.queries += 1
+        params = tuple(params or ())
+        if name == "load_user":
+            user = self.users.get(params[0])
+            return ([user] if user else []), 0, None
+        if name == "register_user":
+            uid, phone, nickname = params
+            self.users[uid] = (nickname, phone)
+            undo.append(lambda: self.users.pop(uid, None))
+            return [], 1, None
+        if name == "load_occupancy_index":
+            return list(self.seats), 0, None
+        if name in ("fetch_user_bookings_by_uid", "fetch_user_bookings"):
+            selector = "by_uid" if name.endswith("by_uid") else "by_contact"
+            return [self._booking_row(i) for i in self._select_ids(selector, params)], 0, None
+        if name.startswith("seats_"):
+            ids = set(self._select_ids(name, params))
+            return [(booking_id, *seat) for seat, booking_id in self.seats.items() if booking_id in ids], 0, None
+        if name.startswith("delete_"):
+            ids = self._select_ids(name, params)
+            for booking_id in ids:
+                booking = self.bookings.pop(booking_id)
+                seats = {seat: b for seat, b in self.seats.items() if b == booking_id}
+                for seat in seats:
+                    del self.seats[seat]
+                undo.append(lambda i=booking_id, b=booking, s=seats: (self.bookings.__setitem__(i, b), self.seats.update(s)))
+            return [], len(ids), None
+        if name in ("insert_console_booking", "insert_computer_booking"):
+            if name == "insert_console_booking":
+                uid, nickname, phone, zone, booking_date, booking_time, minutes, start_slot = params
+                computers = None
+            else:
+                uid, nickname, phone, zone, _, booking_date, booking_time, computers, minutes, start_slot = params
+            booking_id = self.next_id
+            self.next_id += 1
+            self.bookings[booking_id] = {
+                "user_id": uid, "nickname": nickname, "phone": phone, "zone": zone,
+                "booking_date": _to_date(booking_date), "booking_time": _to_time(booking_time),
+                "computers": computers, "duration_minutes": minutes, "start_slot": start_slot,
+            }
+            undo.append(lambda: self.bookings.pop(booking_id, None))
+            return [], 1, booking_id
+        if name == "upcoming_reminders":
+            rows = sorted(
+                (b["start_slot"], i) for i, b in self.bookings.items()
+                if b["start_slot"] > params[0] and not b.get("reminder_sent")
+            )
+            return [(i, self.bookings[i]["user_id"], slot, self.bookings[i]["zone"], self.bookings[i]["computers"])
+                    for slot, i in rows], 0, None
+        if name == "claim_reminder":
+            booking = self.bookings.get(params[0])
+            if booking is None or booking.get("reminder_sent"):
+                return [], 0, None
+            booking["reminder_sent"] = True
+            undo.append(lambda: booking.pop("reminder_sent", None))
+            return [], 1, None
+        if name == "user_booking_at_seat":
+            slot_start, computer_id, uid, start_slot = params
+            booking_id = self.seats.get((slot_start, computer_id))
+            booking = self.bookings.get(booking_id, {})
+            if booking.get("user_id") != uid or booking.get("start_slot") != start_slot:
+                return [], 0, None
+            return [self._booking_row(booking_id)], 0, None
+        if name == "busy_computers":
+            start, end, *computers = params
+            busy = {cid for (slot, cid) in self.seats if start <= slot < end and cid in computers}
+            return [(cid,) for cid in sorted(busy)], 0, None
+        raise NotImplementedError(name)
+
+    def insert_seats(self, rows, undo):
+        self.queries += 1
+        keys = [(slot, computer_id) for _, computer_id, slot in rows]
+        if len(set(keys)) != len(keys) or any(key in self.seats for key in keys):
+            raise aiomysql.IntegrityError(1062, "Duplicate entry for key 'uq_booking_seats_slot'")
+        for (booking_id, _, _), key in zip(rows, keys):
+            self.seats[key] = booking_id
+        undo.append(lambda: [self.seats.pop(key, None) for key in keys])
+        return len(rows)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+        self.rowcount = 0
+        self.lastrowid = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql, params=None):
+        await asyncio.sleep(self.conn.pool.latency)
+        self.rows, self.rowcount, self.lastrowid = self.conn.pool.db.execute(_query_name(sql), params, self.conn.undo)
+
+    async def executemany(self, sql, rows):
+        await asyncio.sleep(self.conn.pool.latency)
+        if _query_name(sql) != "insert_booking_seats":
+            raise NotImplementedError(sql)
+        self.rowcount = self.conn.pool.db.insert_seats(list(rows), self.conn.undo)
+
+    async def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.undo = []
+        self.last_usage = asyncio.get_running_loop().time()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    async def begin(self):
+        self.undo = []
+
+    async def commit(self):
+        self.undo = []
+
+    async def rollback(self):
+        for action in reversed(self.undo):
+            action()
+        self.undo = []
+
+    async def ping(self, reconnect=True):
+        await asyncio.sleep(self.pool.latency)
+
+
+class FakePool:
+    """Пул на maxsize соединений с ожиданием свободного, как aiomysql.Pool."""
+
+    def __init__(self, db=None, maxsize=5, latency=0.002):
+        self.db = db or FakeDatabase()
+        self.maxsize = maxsize
+        self.latency = latency
+        self._free = []
+        self._size = 0
+        self._cond = asyncio.Condition()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def freesize(self):
+        return len(self._free)
+
+    async def acquire(self):
+        async with self._cond:
+            while not self._free and self._size >= self.maxsize:
+                await self._cond.wait()
+            if self._free:
+                return self._free.pop()
+            self._size += 1
+            return FakeConnection(self)
+
+    async def release(self, conn):
+        conn.last_usage = asyncio.get_running_loop().time()
+        async with self._cond:
+            self._free.append(conn)
+            self._cond.notify()
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
@@ -0,0 +1,82 @@
+"""
+Подставные объекты для бенчмарков: сессия Bot API без сети и
+конструкторы входящих обновлений.
+"""
+import asyncio
+import itertools
+from datetime import datetime, timezone
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageReplyMarkup, EditMessageText, SendMessage
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+TOKEN = "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+BOT_USER = User(id=123456, is_bot=True, first_name="bot")
+
+_ids = itertools.count(1)
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия, которая отвечает на запросы Bot API без обращения к сети и считает вызовы.
+    :param latency: Задержка ответа, с (имитация сетевого запроса).
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.calls = {}
+        self.latency = latency
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, (SendMessage, EditMessageText, EditMessageReplyMarkup)):
+            chat_id = getattr(method, "chat_id", None) or 0
+            return Message(
+                message_id=getattr(method, "message_id", None) or next(_ids),
+                date=datetime.now(timezone.utc),
+                chat=Chat(id=chat_id, type="private"),
+                from_user=BOT_USER,
+                text=getattr(method, "text", None) or "",
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def message_update(uid, text):
+    return Update(
+        update_id=next(_ids),
+        message=Message(
+            message_id=next(_ids),
+            date=datetime.now(timezone.utc),
+            chat=Chat(id=uid, type="private"),
+            from_user=User(id=uid, is_bot=False, first_name=f"user{uid}"),
+            text=text,
+        ),
+    )
+
+
+def callback_update(uid, data, message_id=1):
+    return Update(
+        update_id=next(_ids),
+        callback_query=CallbackQuery(
+            id=str(next(_ids)),
+            from_user=User(id=uid, is_bot=False, first_name=f"user{uid}"),
+            chat_instance=str(uid),
+            data=data,
+            message=Message(
+                message_id=message_id,
+                date=datetime.now(timezone.utc),
+                chat=Chat(id=uid, type="private"),
+                from_user=BOT_USER,
+                text="",
+            ),
+        ),
+    )
@@ -0,0 +1,97 @@
+"""
+Бенчмарк поиска свободного времени (occupancy.find_slots).
+
+Индекс занятости заполняется случайными бронями на неделю вперёд до доли
+занятости --fill, после чего для каждой зоны ищутся ближайшие старты для
+разного числа машин, подряд и вразброс. Для сравнения тот же поиск
+выполняется перебором: маска занятости каждого старта собирается
+occupied_mask заново.
+
+Запуск из каталога Diplom:
+    python -m benchmarks.find_slots [--fill 0.6] [--minutes 120] [--repeat 50]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import occupancy
+from zones import max_computers_per_zone, zone_computer_mapping
+
+DAYS = 7
+
+
+def _fill(rng, first_slot, last_slot, share):
+    """Случайные брони по 1–6 слотов, пока не занята доля share машино-слотов."""
+    total = (last_slot - first_slot) * sum(len(ids) for ids in zone_computer_mapping.values())
+    busy = 0
+    while busy < total * share:
+        zone = rng.choice(list(zone_computer_mapping))
+        computers = rng.sample(list(zone_computer_mapping[zone]), rng.randint(1, len(zone_computer_mapping[zone])))
+        slot = rng.randrange(first_slot, last_slot)
+        slots = rng.randint(1, 6)
+        before = sum(mask.bit_count() for mask in occupancy._index.values())
+        occupancy.occupy(slot, computers, slots * occupancy.SLOT_MINUTES)
+        busy += sum(mask.bit_count() for mask in occupancy._index.values()) - before
+
+
+def _find_by_slot(computer_ids, count, minutes, first_slot, last_slot, limit=5):
+    """Перебор стартов без масок окон: для сравнения с find_slots."""
+    found = []
+    for slot in range(first_slot, last_slot):
+        taken = occupancy.occupied_mask(slot, minutes)
+        free = [num for num in computer_ids if not taken >> (num - 1) & 1]
+        if len(free) >= count:
+            found.append((slot, free[:count]))
+            if len(found) >= limit:
+                break
+    return found
+
+
+def _cases():
+    for zone, ids in zone_computer_mapping.items():
+        for count in sorted({1, max_computers_per_zone[zone] // 2 or 1, max_computers_per_zone[zone]}):
+            yield zone, ids, count
+
+
+def _measure(search, minutes, first_slot, last_slot, repeat):
+    started = time.perf_counter()
+    results = 0
+    for _ in range(repeat):
+        for zone, ids, count in _cases():
+            results += len(search(ids, count, minutes, first_slot, last_slot))
+    return (time.perf_counter() - started) / repeat * 1e3, results // repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fill", type=float, default=0.6, help="доля занятых машино-слотов")
+    parser.add_argument("--minutes", type=int, default=120, help="длительность брони")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    first_slot = occupancy.slot_at(datetime.now()) + 1
+    last_slot = occupancy.slot_at(datetime.now() + timedelta(days=DAYS))
+    occupancy.clear()
+    _fill(random.Random(args.seed), first_slot, last_slot, args.fill)
+
+    # Все старты недели, а не первые limit: худший случай для поиска
+    full_scan = last_slot - first_slot
+    searches = [
+        ("find_slots", lambda *a: occupancy.find_slots(*a)),
+        ("find_slots, подряд", lambda *a: occupancy.find_slots(*a, adjacent=True)),
+        ("find_slots, вся неделя", lambda *a: occupancy.find_slots(*a, limit=full_scan)),
+        ("перебор стартов", _find_by_slot),
+        ("перебор, вся неделя", lambda *a: _find_by_slot(*a, limit=full_scan)),
+    ]
+    print(f"слотов в окне: {full_scan}, занятость {args.fill:.0%}, длительность {args.minutes} мин, "
+          f"запросов на прогон: {len(list(_cases()))}")
+    print(f"{'поиск':<24} | {'все зоны, мс':>12} | {'вариантов':>9}")
+    for name, search in searches:
+        elapsed, results = _measure(search, args.minutes, first_slot, last_slot, args.repeat)
+        print(f"{name:<24} | {elapsed:>12.2f} | {results:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Бенчмарк задержки обработчиков, строящих клавиатуры.
+
+Для каждого обработчика измеряется время обработки обновления, когда
+клавиатуры берутся из кэша keyboards, и когда кэш сбрасывается перед
+каждым обновлением (поведение до появления фабрики клавиатур).
+
+Запуск из каталога Diplom:
+    python -m benchmarks.keyboards
+"""
+import asyncio
+import logging
+import time
+from datetime import date
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import StorageKey
+
+import keyboards
+import occupancy
+from benchmarks.fakes import TOKEN, FakeSession, callback_update
+from bot_handlers import router
+from states import BookingStates
+
+UID = 1
+ITERATIONS = 2000
+
+
+def _clear_caches():
+    keyboards._week_calendar.cache_clear()
+    keyboards._time_grid.cache_clear()
+    keyboards.computer_picker.cache_clear()
+
+
+async def measure(dp, bot, key, data, state, update_data, cached):
+    updates = [callback_update(UID, update_data) for _ in range(ITERATIONS)]
+    elapsed = 0.0
+    for update in updates:
+        await dp.storage.set_data(key, data)
+        await dp.storage.set_state(key, state)
+        if not cached:
+            _clear_caches()
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        elapsed += time.perf_counter() - started
+    return elapsed / ITERATIONS * 1e6
+
+
+async def main():
+    logging.disable(logging.INFO)
+    bot = Bot(token=TOKEN, session=FakeSession())
+    dp = Dispatcher()
+    dp.include_router(router)
+    key = StorageKey(bot_id=bot.id, chat_id=UID, user_id=UID)
+    tomorrow = occupancy.slot_at(date.today()) + occupancy.SLOTS_PER_DAY
+
+    cases = [
+        (
+            "handle_date_selection",
+            {"selected_zone": "pro"},
+            BookingStates.awaiting_date,
+            f"date:{tomorrow}",
+        ),
+        (
+            "handle_computer_selection",
+            {"selected_zone": "pro", "number_of_computers": 1, "selected_computers": []},
+            BookingStates.awaiting_computer_selection,
+            "computer:9",
+        ),
+        (
+            "handle_back_to_computers",
+            {"selected_zone": "pro", "number_of_computers": 1},
+            BookingStates.awaiting_date,
+            "back_to_computers",
+        ),
+    ]
+
+    print(f"{'обработчик':<28} | {'без кэша, мкс':>14} | {'с кэшем, мкс':>13}")
+    for name, data, state, update_data in cases:
+        before = await measure(dp, bot, key, data, state, update_data, cached=False)
+        after = await measure(dp, bot, key, data, state, update_data, cached=True)
+        print(f"{name:<28} | {before:>14.1f} | {after:>13.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
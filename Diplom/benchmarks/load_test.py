@@ -0,0 +1,149 @@
+"""
+Нагрузочный тест роутера бота на синтетических обновлениях.
+
+USERS виртуальных пользователей одновременно проходят мастер бронирования
+(зона, число компьютеров, компьютеры, дата, время, длительность,
+подтверждение) через Dispatcher с bot_handlers.router и тем же набором
+middleware, что и в main.py (middlewares.setup_middlewares): ограничение
+частоты, трассировка, очередь пользователя и очередь исходящих запросов
+с лимитами Telegram (--no-send-queue отключает последнюю, чтобы мерить
+только обработчики и базу). Bot API подменён FakeSession, база — FakePool
+из benchmarks.fake_db с задержкой на запрос, локальный MySQL из DB_CONFIG
+(--mysql) или файл SQLite (--sqlite).
+
+Отчёт: пропускная способность, перцентили задержки обработчиков по шагам,
+запросы к базе на одну бронь, ожидание соединения в пуле, исход броней.
+
+Запуск из каталога Diplom:
+    python -m benchmarks.load_test [--users 500] [--latency 0.002] [--pool 5] [--mysql | --sqlite PATH]
+        [--no-send-queue]
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+from datetime import date
+
+from aiogram import Bot, Dispatcher
+
+import database
+import metrics
+import occupancy
+from benchmarks.fake_db import FakePool
+from benchmarks.fakes import TOKEN, FakeSession, callback_update, message_update
+from bot_handlers import router
+from middlewares import setup_middlewares
+from storage import TTLMemoryStorage
+from zones import zone_computer_mapping
+
+ZONE_WEIGHTS = {"izi": 4, "pro": 6, "bootkemp": 3, "ps4": 1, "ps5": 1}
+WIZARD_MESSAGE_ID = 1
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def _script(rng, day):
+    """Последовательность обновлений одного пользователя: (шаг, данные, это текст)."""
+    zone = rng.choices(list(ZONE_WEIGHTS), weights=list(ZONE_WEIGHTS.values()))[0]
+    steps = [("book", "book", False), ("zone", zone, False)]
+    if zone in ("izi", "pro", "bootkemp"):
+        count = rng.choice([1, 1, 1, 2, 3])
+        steps.append(("count", str(count), True))
+        for num in rng.sample(zone_computer_mapping[zone], count):
+            steps.append(("computer", f"computer:{num}", False))
+    slot = day + rng.randint(20, 45)
+    steps += [
+        ("date", f"date:{day}", False),
+        ("time", f"time:{slot}", False),
+        ("duration", f"duration:{rng.choice([30, 60, 60, 120, 180])}", False),
+        ("confirm", "confirm_booking", False),
+    ]
+    return steps
+
+
+async def _user(dp, bot, uid, steps, latencies):
+    for step, data, is_text in steps:
+        update = message_update(uid, data) if is_text else callback_update(uid, data, WIZARD_MESSAGE_ID)
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        latencies[step].append(time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.002, help="задержка FakePool на запрос, с")
+    parser.add_argument("--pool", type=int, default=database.POOL_MAXSIZE, help="размер FakePool")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mysql", action="store_true", help="использовать MySQL из DB_CONFIG")
+    parser.add_argument("--sqlite", metavar="PATH", help="использовать файл SQLite")
+    parser.add_argument("--no-send-queue", action="store_true", help="без лимитов Telegram на исходящие запросы")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    if args.mysql or args.sqlite:
+        from migrations import apply_migrations
+        if args.sqlite:
+            import sqlite_backend
+            database.DB_BACKEND = "sqlite"
+            database.set_db_pool(await sqlite_backend.create_pool(args.sqlite, args.pool))
+        else:
+            await database.create_db_pool()
+        await apply_migrations()
+        for uid in range(1, args.users + 1):
+            if not await database.check_user_in_db(uid):
+                await database.register_user(uid, f"+7999{uid:07d}", f"user{uid}")
+    else:
+        pool = FakePool(maxsize=args.pool, latency=args.latency)
+        for uid in range(1, args.users + 1):
+            pool.db.users[uid] = (f"user{uid}", f"+7999{uid:07d}")
+        database.set_db_pool(pool)
+    await database.load_occupancy_index()
+
+    session = FakeSession()
+    bot = Bot(token=TOKEN, session=session)
+    dp = Dispatcher(storage=TTLMemoryStorage())
+    setup_middlewares(dp, bot, send_queue=not args.no_send_queue)
+    dp.include_router(router)
+
+    rng = random.Random(args.seed)
+    tomorrow = occupancy.slot_at(date.today()) + occupancy.SLOTS_PER_DAY
+    scripts = {uid: _script(rng, tomorrow) for uid in range(1, args.users + 1)}
+    latencies = defaultdict(list)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_user(dp, bot, uid, steps, latencies) for uid, steps in scripts.items()))
+    elapsed = time.perf_counter() - started
+
+    updates = sum(len(steps) for steps in scripts.values())
+    outcomes = {labels[0]: int(count) for labels, count in metrics.bookings_reserved.values.items()}
+    query_counts = {labels[0]: series[2] for labels, series in metrics.db_query_seconds.values.items()}
+    acquire = metrics.db_pool_acquire_seconds.summary()
+    all_latencies = [value for values in latencies.values() for value in values]
+
+    print(f"пользователей: {args.users}, обновлений: {updates}, за {elapsed:.2f} с "
+          f"-> {updates / elapsed:.0f} обновлений/с")
+    print(f"{'шаг':<10} | {'p50, мс':>8} | {'p95, мс':>8} | {'p99, мс':>8}")
+    for step, values in list(latencies.items()) + [("всего", all_latencies)]:
+        print(f"{step:<10} | {_percentile(values, 50) * 1e3:8.2f} | "
+              f"{_percentile(values, 95) * 1e3:8.2f} | {_percentile(values, 99) * 1e3:8.2f}")
+    print(f"запросы к базе: {sum(query_counts.values())} ({query_counts})")
+    print(f"брони: {outcomes}, запросов на сохранённую бронь: "
+          f"{sum(query_counts.values()) / max(outcomes.get('success', 0), 1):.1f}")
+    print(f"ожидание пула: среднее {acquire['avg'] * 1e3:.2f} мс на {acquire['count']} выдач, "
+          f"таймаутов {int(sum(metrics.db_pool_acquire_timeouts.values.values()))}")
+    print(f"вызовы Bot API: {session.calls}")
+
+    if args.mysql or args.sqlite:
+        await database.close_db_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
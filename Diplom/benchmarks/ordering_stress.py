@@ -0,0 +1,131 @@
+"""
+Стресс-тест порядка обработки обновлений одного пользователя.
+
+USERS пользователей доходят до выбора компьютеров (нужно COUNT машин),
+после чего каждый одновременно отправляет TAPS нажатий computer:<n> —
+разные компьютеры вперемешку с повторами, как при быстрых нажатиях.
+Прогон выполняется без UserOrderingMiddleware и с ним; для каждого
+считается, у скольких пользователей выбрано больше COUNT компьютеров,
+меньше COUNT (потерянные выборы), есть повторы или выбор не совпадает
+с первыми COUNT разными нажатиями в порядке отправки.
+
+Bot API отвечает с задержкой --latency, поэтому обработчики уступают
+управление посреди шага, как в реальном боте.
+
+Запуск из каталога Diplom:
+    python -m benchmarks.ordering_stress [--users 300] [--count 3] [--taps 7] [--storage memory|sqlite]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import StorageKey
+
+import database
+from benchmarks.fake_db import FakePool
+from benchmarks.fakes import TOKEN, FakeSession, callback_update, message_update
+from bot_handlers import router
+from middlewares import UserOrderingMiddleware
+from storage import SQLiteStorage, TTLMemoryStorage
+from zones import zone_computer_mapping
+
+
+def _taps(rng, count, taps):
+    """Нажатия одного пользователя: разные компьютеры с повторами первых из них."""
+    distinct = rng.sample(zone_computer_mapping["pro"], min(taps, count + 2))
+    sequence = list(distinct)
+    while len(sequence) < taps:
+        sequence.insert(rng.randrange(1, len(sequence) + 1), rng.choice(distinct[:count]))
+    return sequence
+
+
+def _expected(sequence, count):
+    chosen = []
+    for num in sequence:
+        if num not in chosen:
+            chosen.append(num)
+    return chosen[:count]
+
+
+async def _user(dp, bot, uid, count, sequence):
+    for data in ("book", "pro"):
+        await dp.feed_update(bot, callback_update(uid, data))
+    await dp.feed_update(bot, message_update(uid, str(count)))
+    # Все нажатия уходят одновременно, как отдельные задачи поллинга
+    await asyncio.gather(*(dp.feed_update(bot, callback_update(uid, f"computer:{num}")) for num in sequence))
+
+
+async def _run(args, ordered):
+    pool = FakePool(latency=0.001)
+    for uid in range(1, args.users + 1):
+        pool.db.users[uid] = (f"user{uid}", f"+7999{uid:07d}")
+    database.set_db_pool(pool)
+
+    path = None
+    if args.storage == "sqlite":
+        fd, path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        storage = SQLiteStorage(path)
+    else:
+        storage = TTLMemoryStorage()
+    bot = Bot(token=TOKEN, session=FakeSession(latency=args.latency))
+    dp = Dispatcher(storage=storage)
+    if ordered:
+        dp.update.outer_middleware(UserOrderingMiddleware(max_pending=args.taps))
+    dp.include_router(router)
+
+    rng = random.Random(args.seed)
+    sequences = {uid: _taps(rng, args.count, args.taps) for uid in range(1, args.users + 1)}
+    started = time.perf_counter()
+    await asyncio.gather(*(_user(dp, bot, uid, args.count, seq) for uid, seq in sequences.items()))
+    elapsed = time.perf_counter() - started
+
+    result = {"over": 0, "lost": 0, "duplicated": 0, "misordered": 0}
+    for uid, sequence in sequences.items():
+        data = await storage.get_data(StorageKey(bot_id=bot.id, chat_id=uid, user_id=uid))
+        selected = data.get("selected_computers", [])
+        if len(selected) > args.count:
+            result["over"] += 1
+        elif len(selected) < args.count:
+            result["lost"] += 1
+        if len(set(selected)) != len(selected):
+            result["duplicated"] += 1
+        if selected != _expected(sequence, args.count):
+            result["misordered"] += 1
+    await storage.close()
+    # Роутер подключается к диспетчеру следующего прогона; в aiogram нет
+    # публичного способа отключить его
+    dp.sub_routers.remove(router)
+    router._parent_router = None
+    if path:
+        os.remove(path)
+    return result, elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--count", type=int, default=3, help="сколько компьютеров выбирает пользователь")
+    parser.add_argument("--taps", type=int, default=7, help="одновременных нажатий на пользователя")
+    parser.add_argument("--latency", type=float, default=0.005, help="задержка ответа Bot API, с")
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    print(f"пользователей: {args.users}, компьютеров: {args.count}, нажатий: {args.taps}, "
+          f"хранилище: {args.storage}")
+    print(f"{'режим':<10} | {'лишние':>6} | {'потери':>6} | {'повторы':>7} | {'порядок':>7} | {'время, с':>8}")
+    for ordered in (False, True):
+        result, elapsed = await _run(args, ordered)
+        print(f"{'очередь' if ordered else 'без':<10} | {result['over']:>6} | {result['lost']:>6} | "
+              f"{result['duplicated']:>7} | {result['misordered']:>7} | {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+"""
+Отправляет записанные обновления Telegram на локальный webhook-сервер
+и выводит задержку ответа (p50/p99).
+
+Файл обновлений — JSON Lines, по одному объекту Update в строке.
+Пример запуска из каталога Diplom (бот запущен с BOT_MODE = "webhook"):
+    python -m benchmarks.webhook_replay updates.jsonl --url http://127.0.0.1:8080/webhook
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from aiohttp import ClientSession
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def replay(updates, url, secret, concurrency):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def send(session, update):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(url, json=update, headers=headers) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(send(session, update) for update in updates))
+    elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("updates", help="файл JSON Lines с обновлениями")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default=None, help="значение WEBHOOK_SECRET")
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.updates, encoding="utf-8") as file:
+        updates = [json.loads(line) for line in file if line.strip()]
+
+    latencies, errors, elapsed = asyncio.run(replay(updates, args.url, args.secret, args.concurrency))
+    print(f"обновлений: {len(latencies)}, ошибок: {errors}, {len(latencies) / elapsed:.1f} обн/с")
+    print(
+        f"p50: {percentile(latencies, 50):.1f} мс, p99: {percentile(latencies, 99):.1f} мс, "
+        f"среднее: {statistics.mean(latencies):.1f} мс"
+    )
+
+
+if __name__ == "__main__":
+    main()
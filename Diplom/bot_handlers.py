@@ -1,58 +1,63 @@
-from datetime import datetime, timedelta
 from aiogram import F, Router
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import Command
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, ErrorEvent
+from aiogram.filters import Command, CommandObject, ExceptionTypeFilter
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.fsm.context import FSMContext
 from database import (
     execute_query,
     fetch_user_bookings,
     delete_booking,
     delete_all_user_bookings,
-    check_availability,
-    save_user_info,
+    reserve_booking,
+    ReservationStatus,
     check_user_in_db,
     register_user,
     get_user_from_db,
     fetch_user_bookings_by_uid,
     delete_all_bookings_by_uid,
-    delete_booking_by_id
+    cancel_user_bookings,
+    mark_checked_in,
+    DatabaseError
 )
-from utils import validate_phone, get_min_max_dates
+from utils import validate_phone, get_min_max_dates, format_duration, format_slot
 from config import DB_CONFIG
+import config
 import logging
 from rules import RULES_PARTS
+from zones import max_computers_per_zone, zone_computer_mapping, console_zones, booking_computers
+import occupancy
+from states import BookingStates
+from send_queue import post, priority, HIGH, LOW
+from tracing import name_handler
+import waitlist
+from queries import BookingRow
+from keyboards import (
+    main_menu_keyboard,
+    account_keyboard,
+    zone_keyboard,
+    confirm_keyboard,
+    back_to_zone_keyboard,
+    rules_back_keyboard,
+    week_calendar,
+    time_grid,
+    computer_picker,
+    cancel_picker,
+    found_slots_picker,
+    waitlist_join_keyboard,
+    duration_picker,
+    calendar_days,
+    first_time_slot,
+    DURATION_OPTIONS,
+    BUSY_CALLBACK
+)
 
 
 logging.basicConfig(level=logging.INFO)
 
 router = Router()
 
-user_data = {}
-user_step = {}
-
-max_computers_per_zone = {
-    "izi": 8,
-    "pro": 13,
-    "bootkemp": 5,
-    "ps4": 1,
-    "ps5": 1,
-}
-
-full_zone_names = {
-    "izi": "Изи-Лайн",
-    "pro": "Про-Лайн",
-    "bootkemp": "Буткемп",
-    "ps4": "PlayStation 4 зона",
-    "ps5": "PlayStation 5 зона",
-}
-
-zone_computer_mapping = {
-    "izi": range(1, 9),
-    "pro": range(9, 22),
-    "bootkemp": range(22, 27),
-    "ps4": [27],
-    "ps5": [28],
-}
-
+# Telegram ID администраторов клуба: им доступна отметка прихода /checkin
+ADMIN_IDS = frozenset(getattr(config, "ADMIN_IDS", ()))
 
 def validate_computers(zone, computer_numbers):
     """
@@ -65,70 +70,68 @@ def validate_computers(zone, computer_numbers):
     return True
 
 async def show_zone_selection(call_or_message):
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Изи-Лайн", callback_data="izi")],
-            [InlineKeyboardButton(text="Про-Лайн", callback_data="pro")],
-            [InlineKeyboardButton(text="Буткемп", callback_data="bootkemp")],
-            [InlineKeyboardButton(text="PS4", callback_data="ps4")],
-            [InlineKeyboardButton(text="PS5", callback_data="ps5")]
-        ]
-    )
+    keyboard = zone_keyboard
     if hasattr(call_or_message, 'message'):
         await call_or_message.message.answer("Выберите желаемую зону:", reply_markup=keyboard)
     else:
         await call_or_message.answer("Выберите желаемую зону:", reply_markup=keyboard)
 
-async def send_week_calendar(uid, message: Message):
+async def show_step(message: Message, state: FSMContext, text, reply_markup=None, message_id=None):
     """
-    Отправляет inline-клавиатуру с датами на ближайшую неделю.
+    Показывает шаг мастера бронирования, редактируя одно и то же сообщение
+    вместо отправки нового. Если сообщение изменить нельзя (удалено или
+    слишком старое), отправляет новое и запоминает его как сообщение мастера.
+    :param message: Сообщение с нажатой кнопкой (оно и редактируется).
+    :param message_id: ID сообщения мастера, если message — ответ пользователя текстом.
     """
-    now = datetime.now()
-    dates = [(now + timedelta(days=i)).strftime("%d.%m.%Y") for i in range(7)]
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-    for date in dates:
-        keyboard.inline_keyboard.append([InlineKeyboardButton(text=date, callback_data=f"date:{date}")])
-    
-    if user_data[uid].get("selected_zone") not in ["ps4", "ps5"]:
-        keyboard.inline_keyboard.append([InlineKeyboardButton(text="⬅ Назад", callback_data="back_to_computers")])
-    
-    await message.answer("Выберите дату для бронирования:", reply_markup=keyboard)
+    try:
+        if message_id is None:
+            await message.edit_text(text, reply_markup=reply_markup)
+        else:
+            await message.bot.edit_message_text(
+                text=text, chat_id=message.chat.id, message_id=message_id, reply_markup=reply_markup
+            )
+        return
+    except TelegramBadRequest as e:
+        if "message is not modified" in e.message:
+            return
+        logging.info(f"Не удалось изменить сообщение мастера: {e.message}")
+    sent = await message.answer(text, reply_markup=reply_markup)
+    await state.update_data(wizard_message_id=sent.message_id)
+
+async def show_week_calendar(message: Message, state: FSMContext, zone, text="Выберите дату для бронирования:"):
+    """
+    Показывает inline-клавиатуру с датами на ближайшую неделю.
+    """
+    await show_step(message, state, text, week_calendar(zone))
 
 def choosing_actions(uid):
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Забронировать", callback_data="book")],
-            [InlineKeyboardButton(text="Отменить бронь", callback_data="cancel_booking")],
-            [InlineKeyboardButton(text="Оплатить", callback_data="pay")],
-            [InlineKeyboardButton(text="Правила", callback_data="rules")]
-        ]
+    return main_menu_keyboard
+
+def confirmation_text(data):
+    minutes = data.get("duration_minutes") or occupancy.SLOT_MINUTES
+    return (
+        f"Вы выбрали время: {format_slot(data['booking_slot'], '%H:%M на %d.%m.%Y')}, "
+        f"длительность {format_duration(minutes)}. Подтвердите выбор."
     )
-    return keyboard
 
 
 @router.message(F.text.lower() == "/start")
-async def start(message: Message):
-    uid = message.from_user.id
-    if "nikname" in user_data.get(uid, {}):
-        greeting = f"Добро пожаловать обратно, {user_data[uid]['nikname']}!"
+async def start(message: Message, state: FSMContext):
+    data = await state.get_data()
+    if "nikname" in data:
+        greeting = f"Добро пожаловать обратно, {data['nikname']}!"
         await message.answer(greeting)
         await show_actions(message)
     else:
         greeting = "Здравствуйте! Вы уже пользовались этим ботом?"
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="Да", callback_data="yes")],
-                [InlineKeyboardButton(text="Нет", callback_data="no")]
-            ]
-        )
-        await message.answer(greeting, reply_markup=keyboard)
-        user_data[uid] = {}
-        user_step[uid] = "awaiting_account"
+        await message.answer(greeting, reply_markup=account_keyboard)
+        await state.set_data({})
+        await state.set_state(BookingStates.awaiting_account)
 
 
 @router.callback_query(F.data.in_({"yes", "no"}))
-async def handle_registration(call: CallbackQuery):
+async def handle_registration(call: CallbackQuery, state: FSMContext):
     uid = call.from_user.id
     logging.info(f"User {uid} selected: {call.data}")
     if call.data == "yes":
@@ -139,7 +142,7 @@ async def handle_registration(call: CallbackQuery):
             await show_actions(call.message)
         else:
             await call.message.answer("Вы не зарегистрированы. Пожалуйста, введите ваш номер телефона для регистрации:")
-            user_step[uid] = "awaiting_new_phone"
+            await state.set_state(BookingStates.awaiting_new_phone)
     elif call.data == "no":
         user_exists = await check_user_in_db(uid)
         logging.info(f"User {uid} exists in DB: {user_exists}")
@@ -148,97 +151,75 @@ async def handle_registration(call: CallbackQuery):
             await show_actions(call.message)
         else:
             await call.message.answer("Введите ваш номер телефона для регистрации:")
-            user_step[uid] = "awaiting_new_phone"
+            await state.set_state(BookingStates.awaiting_new_phone)
     await call.answer()
 
-@router.message(F.func(lambda m: user_step.get(m.from_user.id) == "awaiting_nickname"))
-async def get_nickname(message: Message):
-    uid = message.from_user.id
-    user_data[uid]["nikname"] = message.text.strip()
+async def get_nickname(message: Message, state: FSMContext):
+    await state.update_data(nikname=message.text.strip())
     await message.answer("Отлично! Теперь введите номер телефона:")
-    user_step[uid] = "awaiting_phone"
+    await state.set_state(BookingStates.awaiting_phone)
 
 
-@router.message(F.func(lambda m: user_step.get(m.from_user.id) == "awaiting_phone"))
-async def get_phone(message: Message):
-    uid = message.from_user.id
+async def get_phone(message: Message, state: FSMContext):
     phone_text = message.text.strip()
     if validate_phone(phone_text):
-        user_data[uid]["telefhone"] = phone_text
+        await state.update_data(telefhone=phone_text)
         await message.answer("Номер телефона сохранён.")
         await show_actions(message)
     else:
         await message.answer("Пожалуйста, введите корректный номер телефона.")
 
 
-@router.message(F.func(lambda m: user_step.get(m.from_user.id) == "awaiting_new_phone"))
-async def get_new_phone(message: Message):
-    uid = message.from_user.id
+async def get_new_phone(message: Message, state: FSMContext):
     phone_text = message.text.strip()
     if validate_phone(phone_text):
-        user_data[uid]["telefhone"] = phone_text
+        await state.update_data(telefhone=phone_text)
         await message.answer("Номер телефона сохранён. Теперь введите ваш никнейм:")
-        user_step[uid] = "awaiting_new_nickname"
+        await state.set_state(BookingStates.awaiting_new_nickname)
     else:
         await message.answer("Пожалуйста, введите корректный номер телефона.")
 
 
-@router.message(F.func(lambda m: user_step.get(m.from_user.id) == "awaiting_new_nickname"))
-async def get_new_nickname(message: Message):
+async def get_new_nickname(message: Message, state: FSMContext):
     uid = message.from_user.id
     nickname = message.text.strip()
-    user_data[uid]["nikname"] = nickname
-    phone_number = user_data[uid].get("telefhone", "")
+    data = await state.update_data(nikname=nickname)
+    phone_number = data.get("telefhone", "")
     if not phone_number:
         await message.answer("Ошибка: номер телефона не найден. Пожалуйста, начните регистрацию заново.")
         return
     await register_user(uid, phone_number, nickname)
     await message.answer(f"Никнейм '{nickname}' успешно сохранён!")
     await show_actions(message)
-    user_step[uid] = None
+    await state.set_state(None)
 
 @router.callback_query(F.data == "book")
-async def handle_book_button(call: CallbackQuery):
-    uid = call.from_user.id
+async def handle_book_button(call: CallbackQuery, state: FSMContext):
     await call.answer()
 
-    user_data[uid] = {}
-    user_step[uid] = "awaiting_zone"
-
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Изи-Лайн", callback_data="izi")],
-            [InlineKeyboardButton(text="Про-Лайн", callback_data="pro")],
-            [InlineKeyboardButton(text="Буткемп", callback_data="bootkemp")],
-            [InlineKeyboardButton(text="PS4", callback_data="ps4")],
-            [InlineKeyboardButton(text="PS5", callback_data="ps5")]
-        ]
-    )
+    await state.set_data({})
+    await state.set_state(BookingStates.awaiting_zone)
 
-    
-    await call.message.answer("Выберите желаемую зону:", reply_markup=keyboard)
+    await show_step(call.message, state, "Выберите желаемую зону:", zone_keyboard)
 
 @router.callback_query(F.data.in_(["izi", "pro", "bootkemp", "ps4", "ps5"]))
-async def handle_zone_selection(call: CallbackQuery):
-    uid = call.from_user.id
-    if user_step.get(uid) != "awaiting_zone":
+async def handle_zone_selection(call: CallbackQuery, state: FSMContext):
+    if await state.get_state() != BookingStates.awaiting_zone.state:
         await call.answer("Зона уже выбрана", show_alert=True)
         return
 
-    await call.message.edit_reply_markup(reply_markup=None)
-    await process_zone_selection(uid, call.data, call.message)
+    await process_zone_selection(state, call.data, call.message)
     await call.answer()
 
-@router.message(F.func(lambda m: user_step.get(m.from_user.id) == "awaiting_number_of_computers"))
-async def ask_for_computer_numbers(message: Message):
-    uid = message.from_user.id
+async def ask_for_computer_numbers(message: Message, state: FSMContext):
     try:
         input_text = message.text.strip()
         if not input_text.isdigit():
             await message.answer("Пожалуйста, введите целое число.")
             return
         count = int(input_text)
-        selected_zone = user_data[uid]["selected_zone"]
+        data = await state.get_data()
+        selected_zone = data["selected_zone"]
         max_computers = max_computers_per_zone[selected_zone]
         if count <= 0 or count > max_computers:
             await message.answer(
@@ -246,142 +227,161 @@ async def ask_for_computer_numbers(message: Message):
             )
             return
 
-        user_data[uid]["number_of_computers"] = count
-        user_data[uid]["selected_computers"] = []
-
-        valid_numbers = zone_computer_mapping[selected_zone]
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-        for num in valid_numbers:
-            keyboard.inline_keyboard.append([InlineKeyboardButton(text=str(num), callback_data=f"computer:{num}")])
-
-        keyboard.inline_keyboard.append([InlineKeyboardButton(text="⬅ Назад", callback_data="back_to_zone")])
+        await state.update_data(number_of_computers=count, selected_computers=[])
 
-        await message.answer("Выберите компьютеры для бронирования:", reply_markup=keyboard)
-        user_step[uid] = "awaiting_computer_selection"
+        keyboard = computer_picker(selected_zone, "back_to_zone")
+        await show_step(
+            message, state, f"Выберите компьютеры для бронирования ({count}):", keyboard,
+            message_id=data.get("wizard_message_id")
+        )
+        await state.set_state(BookingStates.awaiting_computer_selection)
     except ValueError:
         await message.answer("Произошла ошибка при обработке ввода.")
 
 @router.callback_query(F.data.startswith("computer:"))
-async def handle_computer_selection(call: CallbackQuery):
-    uid = call.from_user.id
-    if user_step.get(uid) != "awaiting_computer_selection":
+async def handle_computer_selection(call: CallbackQuery, state: FSMContext):
+    if await state.get_state() != BookingStates.awaiting_computer_selection.state:
         await call.answer("Этап уже завершён", show_alert=True)
         return
 
     computer_number = int(call.data.split(":")[1])
+    data = await state.get_data()
+    selected_computers = data["selected_computers"]
 
-    if computer_number in user_data[uid]["selected_computers"]:
+    if computer_number in selected_computers:
         await call.answer("⚠️ Компьютер уже выбран", show_alert=True)
         return
 
-    user_data[uid]["selected_computers"].append(computer_number)
+    selected_computers.append(computer_number)
+    await state.update_data(selected_computers=selected_computers)
     await call.answer(f"✅ Компьютер {computer_number} выбран.")
 
-    if len(user_data[uid]["selected_computers"]) >= user_data[uid]["number_of_computers"]:
-        
-        await call.message.answer("Компьютеры успешно выбраны. Пожалуйста, выберите дату бронирования.")
-        await send_week_calendar(uid, call.message)
-        user_step[uid] = "awaiting_date"
+    if len(selected_computers) >= data["number_of_computers"]:
+        if data.get("booking_slot") is not None:
+            # Повторный выбор после конфликта: дата, время и длительность уже известны
+            await show_step(call.message, state, confirmation_text(data), confirm_keyboard)
+            await state.set_state(BookingStates.awaiting_confirmation)
+            return
+
+        await show_week_calendar(
+            call.message, state, data["selected_zone"],
+            "Компьютеры успешно выбраны. Пожалуйста, выберите дату бронирования."
+        )
+        await state.set_state(BookingStates.awaiting_date)
 
 
 @router.callback_query(F.data.startswith("date:"))
-async def handle_date_selection(call: CallbackQuery):
-    uid = call.from_user.id
-    if user_step.get(uid) != "awaiting_date":
+async def handle_date_selection(call: CallbackQuery, state: FSMContext):
+    if await state.get_state() != BookingStates.awaiting_date.state:
         await call.answer("Этап уже пройден", show_alert=True)
         return
 
-    selected_date = call.data.split(":")[1]
-    user_data[uid]["booking_date"] = selected_date
-
-    
-
-    now = datetime.now()
-    times_list = []
-    start_hour = 0 if datetime.strptime(selected_date, "%d.%m.%Y").date() != now.date() else now.hour + 1
-    for hour in range(start_hour, 24):
-        for minute in [0, 30]:
-            time_string = f"{hour:02}:{minute:02}"
-            callback_data = f"time:{selected_date}:{time_string}"
-            times_list.append(InlineKeyboardButton(text=time_string, callback_data=callback_data))
+    day = call.data.split(":")[1]
+    if not day.isdigit():
+        await call.answer("Неверный формат данных.", show_alert=True)
+        return
 
-    markup = InlineKeyboardMarkup(inline_keyboard=[])
-    for i in range(0, len(times_list), 6):
-        markup.inline_keyboard.append(times_list[i:i + 6])
+    day = int(day)
+    if day not in calendar_days():
+        await call.answer("Эта дата недоступна, выберите другую.", show_alert=True)
+        return
+    data = await state.update_data(booking_day=day)
 
-    if user_data[uid].get("selected_zone") not in ["ps4", "ps5"]:
-        markup.inline_keyboard.append([InlineKeyboardButton(text="Назад к выбору даты", callback_data="back_to_date")])
+    zone = data.get("selected_zone")
+    computers = booking_computers(zone, data.get("selected_computers"))
+    markup = time_grid(day, zone, occupancy.busy_slots(day, computers))
 
-    await call.message.answer(f"Вы выбрали дату: {selected_date}. Выберите время:", reply_markup=markup)
-    user_step[uid] = "awaiting_time"
+    await show_step(call.message, state, f"Вы выбрали дату: {format_slot(day, '%d.%m.%Y')}. Выберите время:", markup)
+    await state.set_state(BookingStates.awaiting_time)
     await call.answer()
 
 @router.callback_query(F.data.startswith("time:"))
-async def handle_time_selection(call: CallbackQuery):
-    uid = call.from_user.id
-    if user_step.get(uid) != "awaiting_time":
+async def handle_time_selection(call: CallbackQuery, state: FSMContext):
+    if await state.get_state() != BookingStates.awaiting_time.state:
         await call.answer("Этап уже пройден", show_alert=True)
         return
 
-    parts = call.data.split(":")
-    if len(parts) < 4:
+    slot = call.data.split(":")[1]
+    if not slot.isdigit():
         await call.answer("Неверный формат данных.", show_alert=True)
         return
 
-    _, date, hours, minutes = parts
-    time = f"{hours}:{minutes}"
+    slot = int(slot)
+    # Слот должен быть из показанной сетки: выбранные сутки недели, не раньше её первого времени
+    day = occupancy.day_slot(slot)
+    data = await state.get_data()
+    if day not in calendar_days() or slot < first_time_slot(day) or data.get("booking_day", day) != day:
+        await call.answer("Это время недоступно, выберите другое.", show_alert=True)
+        return
 
-    try:
-        datetime.strptime(time, "%H:%M")
-    except ValueError:
-        await call.answer("Некорректное время.", show_alert=True)
+    # Длительность ограничена ближайшей занятой получасовкой выбранных машин
+    computers = booking_computers(data.get("selected_zone"), data.get("selected_computers"))
+    limit = max(DURATION_OPTIONS) // occupancy.SLOT_MINUTES
+    free_minutes = occupancy.free_slots_from(slot, computers, limit) * occupancy.SLOT_MINUTES
+    if not free_minutes:
+        await call.answer("Это время уже занято, выберите другое.", show_alert=True)
         return
+    await state.update_data(booking_slot=slot, booking_day=day, max_duration_minutes=free_minutes)
 
-    user_data[uid]["selected_time"] = time
-    user_data[uid]["booking_date"] = date
+    await show_step(
+        call.message, state, f"Вы выбрали время: {format_slot(slot, '%H:%M на %d.%m.%Y')}. Выберите длительность:",
+        duration_picker(free_minutes)
+    )
+    await state.set_state(BookingStates.awaiting_duration)
+    await call.answer()
 
-    
+@router.callback_query(F.data.startswith("duration:"))
+async def handle_duration_selection(call: CallbackQuery, state: FSMContext):
+    if await state.get_state() != BookingStates.awaiting_duration.state:
+        await call.answer("Этап уже пройден", show_alert=True)
+        return
 
-    booking_details = f"Вы выбрали время: {time} на {date}. Подтвердите выбор."
-    markup = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Подтвердить бронь", callback_data="confirm_booking")],
-        [InlineKeyboardButton(text="Отменить бронь", callback_data="cancel_booking")],
-    ])
+    minutes = call.data.split(":")[1]
+    minutes = int(minutes) if minutes.isdigit() else None
+    # Принимаются только варианты, показанные duration_picker для выбранного времени
+    data = await state.get_data()
+    if minutes not in DURATION_OPTIONS or minutes > data.get("max_duration_minutes", 0):
+        await call.answer("Некорректная длительность.", show_alert=True)
+        return
 
-    await call.message.answer(booking_details, reply_markup=markup)
-    user_step[uid] = "awaiting_confirmation"
+    data = await state.update_data(duration_minutes=minutes)
+    await show_step(call.message, state, confirmation_text(data), confirm_keyboard)
+    await state.set_state(BookingStates.awaiting_confirmation)
     await call.answer()
 
 @router.callback_query(F.data == "confirm_booking")
-async def confirm_booking(call: CallbackQuery):
+async def confirm_booking(call: CallbackQuery, state: FSMContext):
+    # Повторное нажатие после сохранения брони не должно сохранять её ещё раз
+    if await state.get_state() != BookingStates.awaiting_confirmation.state:
+        await call.answer("Этап уже пройден", show_alert=True)
+        return
+
     uid = call.from_user.id
     try:
-        if uid not in user_data:
-            logging.error(f"User {uid} not found in user_data during booking confirmation.")
+        data = await state.get_data()
+        if not data:
+            logging.error(f"User {uid} has no booking data during booking confirmation.")
             await call.message.answer("Произошла ошибка при сохранении данных.")
             return
 
-        data = user_data[uid]
-
         # Загружаем данные из БД
         user_db_data = await get_user_from_db(uid)
-        data["nikname"] = user_db_data.get("nickname")
-        data["telefhone"] = user_db_data.get("phone")
+        data["nikname"] = user_db_data.nickname if user_db_data else None
+        data["telefhone"] = user_db_data.phone if user_db_data else None
 
         required_fields = (
-            ["nikname", "telefhone", "selected_zone", "selected_time", "booking_date"]
+            ["nikname", "telefhone", "selected_zone", "booking_slot"]
             if data["selected_zone"] in ["ps4", "ps5"]
             else [
                 "nikname",
                 "telefhone",
                 "selected_zone",
                 "number_of_computers",
-                "selected_time",
-                "booking_date",
+                "booking_slot",
                 "selected_computers",
             ]
         )
-        missing_fields = [field for field in required_fields if not data.get(field)]
+        missing_fields = [field for field in required_fields if data.get(field) in (None, "", [])]
         
         if missing_fields:
             missing_fields_str = ", ".join(missing_fields)
@@ -391,21 +391,30 @@ async def confirm_booking(call: CallbackQuery):
             )
             return
         
-        if data["selected_zone"] not in ["ps4", "ps5"]:
-            computer_ids = data.get("selected_computers", [])
-            booking_date = data.get("booking_date")
-            booking_time = data.get("selected_time")
-            if not await check_availability(computer_ids, booking_date, booking_time):
-                logging.warning(f"User {uid} tried to book unavailable computers: {computer_ids}")
-                await call.message.answer(
-                    "Один или несколько выбранных компьютеров уже забронированы. Пожалуйста, выберите другие."
+        result = await reserve_booking(uid, data)
+        if result.status is ReservationStatus.CONFLICT:
+            logging.warning(f"User {uid} tried to book unavailable computers: {result.conflicts}")
+            with priority(HIGH):
+                await offer_free_alternatives(call.message, state, data, result.conflicts)
+            return
+        if result.status is ReservationStatus.ERROR:
+            with priority(HIGH):
+                await show_step(
+                    call.message, state,
+                    "❌ Не удалось сохранить бронирование. Пожалуйста, попробуйте снова.",
+                    confirm_keyboard
                 )
-                return
-        
-        await save_user_info(uid, data)
+            return
+
+        await state.update_data(nikname=data["nikname"], telefhone=data["telefhone"])
+        await state.set_state(None)
         logging.info(f"User {uid} successfully booked: {data}")
-        await call.message.answer("✅ Ваша бронь успешно сохранена!")
-        await show_actions(call.message)
+        with priority(HIGH):
+            await show_step(
+                call.message, state,
+                "✅ Ваша бронь успешно сохранена!\n\nВыберите желаемое действие:",
+                choosing_actions(uid)
+            )
     
     except Exception as e:
         logging.error(f"Error confirming booking for user {uid}: {e}")
@@ -413,26 +422,198 @@ async def confirm_booking(call: CallbackQuery):
     
     await call.answer()
 
+async def offer_free_alternatives(message: Message, state: FSMContext, data, conflicts):
+    """
+    После конфликта предлагает свободные варианты на то же время:
+    для зон с ПК — выбор компьютеров с отмеченными занятыми,
+    для консолей — сетку времени с отмеченными занятыми слотами.
+    """
+    zone = data["selected_zone"]
+    day = data["booking_day"]
+    minutes = data.get("duration_minutes") or occupancy.SLOT_MINUTES
+    busy = ", ".join(map(str, conflicts))
+    # Запрошенные места запоминаются для записи в лист ожидания (waitlist_join)
+    await state.update_data(waitlist_request=[
+        zone, data["booking_slot"], minutes, booking_computers(zone, data.get("selected_computers"))
+    ])
+
+    if zone in console_zones:
+        computers = booking_computers(zone, None)
+        await state.set_state(BookingStates.awaiting_time)
+        await show_step(
+            message, state,
+            "Это время уже забронировано. Выберите другое:",
+            time_grid(day, zone, occupancy.busy_slots(day, computers))
+        )
+    else:
+        await state.update_data(selected_computers=[])
+        await state.set_state(BookingStates.awaiting_computer_selection)
+        await show_step(
+            message, state,
+            f"Компьютеры {busy} уже забронированы на это время. Выберите другие:",
+            computer_picker(zone, "back_to_zone", occupancy.occupied_mask(data["booking_slot"], minutes))
+        )
+    await message.answer("Или дождитесь, пока это время освободится:", reply_markup=waitlist_join_keyboard)
+
+@router.callback_query(F.data == "waitlist_join")
+async def handle_waitlist_join(call: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    request = data.get("waitlist_request")
+    if not request:
+        await call.answer("Заявка устарела, выберите время заново.", show_alert=True)
+        return
+
+    zone, slot, minutes, computers = request
+    waiter = waitlist.join(call.from_user.id, zone, slot, minutes, computers)
+    if waiter is None:
+        await call.answer(f"Можно ждать не больше {waitlist.WAITLIST_PER_USER} вариантов одновременно.", show_alert=True)
+        return
+    await state.update_data(waitlist_request=None)
+    await call.message.edit_text(
+        f"🔔 Вы в листе ожидания на {format_slot(slot, '%H:%M %d.%m.%Y')}. Сообщим, как только время освободится."
+    )
+    await call.answer()
+
+@router.callback_query(F.data.startswith("waitlist:"))
+async def handle_waitlist_offer(call: CallbackQuery, state: FSMContext):
+    """Переход от предложения из листа ожидания к подтверждению брони."""
+    waiter_id = call.data.split(":")[1]
+    # Истёкшее или ещё не сделанное предложение места не удерживает
+    waiter = waitlist.offered(int(waiter_id), call.from_user.id) if waiter_id.isdigit() else None
+    if waiter is None:
+        await call.answer("Предложение больше не действует.", show_alert=True)
+        return
+
+    await show_prefilled_confirmation(call, state, waiter.zone, waiter.slot, waiter.computers, waiter.minutes)
+    await call.answer()
+
+@router.callback_query(F.data.startswith("waitlist_leave:"))
+async def handle_waitlist_leave(call: CallbackQuery):
+    waiter_id = call.data.split(":")[1]
+    waiter = waitlist.get(int(waiter_id)) if waiter_id.isdigit() else None
+    if waiter is not None and waiter.uid == call.from_user.id:
+        # Удержанные места сразу предлагаются следующему
+        waitlist.leave(waiter.id)
+        waitlist.offer_seats(waiter.seats())
+    await call.message.edit_text("Вы покинули лист ожидания.")
+    await call.answer()
+
+@router.callback_query(F.data == BUSY_CALLBACK)
+async def handle_busy_button(call: CallbackQuery):
+    await call.answer("Уже занято, выберите другой вариант.", show_alert=True)
+
+@router.message(Command("checkin"))
+async def handle_check_in(message: Message, state: FSMContext, command: CommandObject):
+    """
+    Отметка администратора о том, что клиент пришёл по брони: /checkin <номер брони>.
+    Отмеченная бронь не снимается как неявка (sweeper.NO_SHOW_GRACE_MINUTES).
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        await handle_any_message(message, state)
+        return
+    booking_id = (command.args or "").strip().lstrip("№")
+    if not booking_id.isdigit():
+        await message.answer("Использование: /checkin <номер брони>")
+        return
+    if await mark_checked_in(int(booking_id)):
+        await message.answer(f"✅ Приход по брони №{booking_id} отмечен.")
+    else:
+        await message.answer(f"Бронь №{booking_id} не найдена.")
+
+FIND_USAGE = (
+    "Поиск свободного времени на ближайшую неделю:\n"
+    "/find <зона> <число ПК> [длительность, мин] [рядом]\n"
+    f"Зоны: {', '.join(zone_computer_mapping)}. Например: /find pro 5 120 рядом"
+)
+
+def found_label(zone, slot, computers):
+    start = format_slot(slot, "%d.%m %H:%M")
+    return start if zone in console_zones else f"{start} | ПК: {', '.join(map(str, computers))}"
+
+@router.message(Command("find"))
+async def handle_find_slot(message: Message, state: FSMContext, command: CommandObject):
+    """
+    Ищет ближайшие старты, когда в зоне свободно нужное число машин
+    (с «рядом» — подряд в порядке zone_computer_mapping), по индексу
+    занятости без запросов к базе. Выбранный вариант сразу переходит
+    к подтверждению брони.
+    """
+    args = (command.args or "").lower().split()
+    adjacent = "рядом" in args
+    args = [arg for arg in args if arg != "рядом"]
+    if len(args) not in (2, 3) or args[0] not in zone_computer_mapping or not all(arg.isdigit() for arg in args[1:]):
+        await message.answer(FIND_USAGE)
+        return
+
+    zone, count = args[0], int(args[1])
+    minutes = int(args[2]) if len(args) == 3 else 60
+    if count <= 0 or count > max_computers_per_zone[zone]:
+        await message.answer(f"В зоне {zone} можно забронировать от 1 до {max_computers_per_zone[zone]} компьютеров.")
+        return
+    if minutes not in DURATION_OPTIONS:
+        await message.answer(f"Длительность должна быть одной из: {', '.join(map(str, DURATION_OPTIONS))} мин.")
+        return
+
+    min_date, max_date = get_min_max_dates()
+    found = occupancy.find_slots(
+        zone_computer_mapping[zone], count, minutes,
+        occupancy.slot_at(min_date) + 1, occupancy.slot_at(max_date), adjacent
+    )
+    if not found:
+        await message.answer("На ближайшую неделю подходящего свободного времени нет.")
+        return
+
+    await state.update_data(found_zone=zone, found_minutes=minutes, found_slots=found)
+    await state.set_state(BookingStates.choosing_found_slot)
+    await message.answer(
+        f"Ближайшее свободное время ({format_duration(minutes)}):",
+        reply_markup=found_slots_picker(tuple(found_label(zone, slot, computers) for slot, computers in found))
+    )
+
+@router.callback_query(F.data.startswith("found:"))
+async def handle_found_slot(call: CallbackQuery, state: FSMContext):
+    if await state.get_state() != BookingStates.choosing_found_slot.state:
+        await call.answer("Результаты поиска устарели, повторите /find", show_alert=True)
+        return
+
+    data = await state.get_data()
+    index = call.data.split(":")[1]
+    found = data.get("found_slots", [])
+    if not index.isdigit() or int(index) >= len(found):
+        await call.answer("Неверный формат данных.", show_alert=True)
+        return
+
+    slot, computers = found[int(index)]
+    await show_prefilled_confirmation(call, state, data["found_zone"], slot, computers, data["found_minutes"])
+    await call.answer()
+
+async def show_prefilled_confirmation(call: CallbackQuery, state: FSMContext, zone, slot, computers, minutes):
+    """Заполняет данные мастера готовым вариантом брони и переходит к подтверждению."""
+    data = await state.update_data(
+        selected_zone=zone, number_of_computers=len(computers), selected_computers=list(computers),
+        booking_day=occupancy.day_slot(slot), booking_slot=slot, duration_minutes=minutes,
+        wizard_message_id=call.message.message_id
+    )
+    await show_step(call.message, state, confirmation_text(data), confirm_keyboard)
+    await state.set_state(BookingStates.awaiting_confirmation)
+
 @router.callback_query(F.data == "cancellation")
-async def handle_cancellation(call: CallbackQuery):
-    uid = call.from_user.id
-    phone_number = user_data[uid].get("telefhone", "")
-    nickname = user_data[uid].get("nikname", "")
+async def handle_cancellation(call: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    phone_number = data.get("telefhone", "")
+    nickname = data.get("nikname", "")
     bookings = await fetch_user_bookings(phone_number, nickname)
     if not bookings:
         await call.message.answer("У вас нет активных броней.")
         return
     markup = InlineKeyboardMarkup()
     for booking in bookings:
-        try:
-            booking_id, date, time, zone, computers = booking
-            if computers is not None:
-                button_text = f"{date.strftime('%d.%m.%Y')}, {time}, Зона: {zone},  Компьютеры: {computers}"
-            else:
-                button_text = f"{date.strftime('%d.%m.%Y')}, {time}, {zone}"
-            markup.add(InlineKeyboardButton(text=button_text, callback_data=f"cancel_{booking_id}"))
-        except ValueError as e:
-            print(f"Ошибка обработки данных бронирования: {e}")
+        start = format_slot(booking.start_slot, "%d.%m.%Y, %H:%M")
+        if booking.computers is not None:
+            button_text = f"{start}, Зона: {booking.zone},  Компьютеры: {booking.computers}"
+        else:
+            button_text = f"{start}, {booking.zone}"
+        markup.add(InlineKeyboardButton(text=button_text, callback_data=f"cancel_{booking.id}"))
     markup.add(InlineKeyboardButton(text="Отменить все бронирования", callback_data="cancel_all"))
     await call.message.answer(
         "Выберите бронь для отмены или отмените все сразу:", reply_markup=markup
@@ -443,80 +624,121 @@ async def show_actions(message: Message):
     keyboard = choosing_actions(message.from_user.id)
     await message.answer("Выберите желаемое действие:", reply_markup=keyboard)
 
-@router.callback_query(F.data == "cancel_booking")
-async def handle_cancel_booking(call: CallbackQuery):
-    uid = call.from_user.id
-    user_step[uid] = "cancelling"
-
-    bookings = await fetch_user_bookings_by_uid(uid)
+def cancel_label(booking):
+    return (
+        f"№{booking.id} {format_slot(booking.start_slot)} "
+        f"({format_duration(booking.duration_minutes)}) | {booking.zone} | ПК: {booking.computers or 'N/A'}"
+    )
 
+async def show_cancel_picker(call: CallbackQuery, state: FSMContext, bookings, selected, notice=None):
+    """
+    Показывает список броней для отмены в сообщении мастера.
+    Список хранится в FSM (cancel_bookings — поля queries.BookingRow),
+    поэтому отметки и отмена не перечитывают базу.
+    """
+    header = f"{notice}\n\n" if notice else ""
+    await state.update_data(cancel_bookings=bookings, cancel_selected=selected)
     if not bookings:
-        await call.message.answer("У вас нет активных броней.")
+        await show_step(
+            call.message, state, f"{header}У вас нет активных броней.\n\nВыберите желаемое действие:",
+            choosing_actions(call.from_user.id)
+        )
         return
+    labels = [(booking[0], cancel_label(BookingRow(*booking))) for booking in bookings]
+    await show_step(
+        call.message, state, f"{header}Отметьте брони для отмены:", cancel_picker(labels, frozenset(selected))
+    )
 
-    markup = InlineKeyboardMarkup(inline_keyboard=[])
+@router.callback_query(F.data == "cancel_booking")
+async def handle_cancel_booking(call: CallbackQuery, state: FSMContext):
+    await state.set_state(BookingStates.cancelling)
+    bookings = [
+        [row.id, row.start_slot, row.zone, row.computers, row.duration_minutes]
+        for row in await fetch_user_bookings_by_uid(call.from_user.id)
+    ]
+    await show_cancel_picker(call, state, bookings, [])
+    await call.answer()
 
-    for booking in bookings:
-        booking_id, booking_date, booking_time, zone, computers = booking
-        button_text = f"{booking_date.strftime('%d.%m.%Y')} {booking_time} | {zone} | ПК: {computers or 'N/A'}"
-        markup.inline_keyboard.append([
-            InlineKeyboardButton(text=button_text, callback_data=f"cancel:{booking_id}")
-        ])
-
-    markup.inline_keyboard.append([
-        InlineKeyboardButton(text="Отменить все бронирования", callback_data="cancel_all")
-    ])
+@router.callback_query(F.data.startswith("cancel:"))
+async def handle_cancel_specific_booking(call: CallbackQuery, state: FSMContext):
+    """Отмечает бронь для отмены или снимает отметку."""
+    if await state.get_state() != BookingStates.cancelling.state:
+        await call.answer("Этап уже завершён", show_alert=True)
+        return
 
-    markup.inline_keyboard.append([
-        InlineKeyboardButton(text="Назад", callback_data="back_to_menu")
-    ])
+    booking_id = call.data.split(":")[1]
+    if not booking_id.isdigit():
+        await call.answer("Неверный формат данных.", show_alert=True)
+        return
 
-    
-    await call.message.answer("Выберите бронь для отмены:", reply_markup=markup)
+    booking_id = int(booking_id)
+    data = await state.get_data()
+    bookings = data.get("cancel_bookings", [])
+    selected = data.get("cancel_selected", [])
+    if booking_id not in (booking[0] for booking in bookings):
+        await call.answer("Бронь уже отменена", show_alert=True)
+        return
+    if booking_id in selected:
+        selected = [item for item in selected if item != booking_id]
+    else:
+        selected = selected + [booking_id]
+    await show_cancel_picker(call, state, bookings, selected)
+    await call.answer()
 
-@router.callback_query(F.data.startswith("cancel:"))
-async def handle_cancel_specific_booking(call: CallbackQuery):
-    uid = call.from_user.id
-    if user_step.get(uid) != "cancelling":
+@router.callback_query(F.data == "cancel_selected")
+async def handle_cancel_selected_bookings(call: CallbackQuery, state: FSMContext):
+    if await state.get_state() != BookingStates.cancelling.state:
         await call.answer("Этап уже завершён", show_alert=True)
         return
 
-    booking_id = call.data.split(":")[1]
-    await delete_booking_by_id(booking_id)
-    await call.message.answer("✅ Бронирование успешно отменено.")
-    await handle_cancel_booking(call)
+    data = await state.get_data()
+    selected = set(data.get("cancel_selected", []))
+    bookings = data.get("cancel_bookings", [])
+    cancelled = [BookingRow(*booking) for booking in bookings if booking[0] in selected]
+    if not cancelled:
+        await call.answer("Отметьте брони для отмены", show_alert=True)
+        return
+
+    count = await cancel_user_bookings(call.from_user.id, cancelled)
+    remaining = [booking for booking in bookings if booking[0] not in selected]
+    await show_cancel_picker(call, state, remaining, [], notice=f"✅ Отменено броней: {count}.")
+    await call.answer()
 
 @router.callback_query(F.data == "cancel_all")
-async def handle_cancel_all_bookings(call: CallbackQuery):
+async def handle_cancel_all_bookings(call: CallbackQuery, state: FSMContext):
     uid = call.from_user.id
-    if user_step.get(uid) != "cancelling":
+    if await state.get_state() != BookingStates.cancelling.state:
         await call.answer("Этап уже завершён", show_alert=True)
         return
 
     await delete_all_bookings_by_uid(uid)
-    await call.message.answer("✅ Все ваши бронирования успешно отменены.")
-    await show_actions(call.message)
+    await state.set_state(None)
+    await show_step(
+        call.message, state, "✅ Все ваши бронирования успешно отменены.\n\nВыберите желаемое действие:",
+        choosing_actions(uid)
+    )
+    await call.answer()
 
 # Возврат в главное меню
 @router.callback_query(F.data == "back_to_menu")
-async def handle_back_to_menu(call: CallbackQuery):
-    
-    await show_actions(call.message)
+async def handle_back_to_menu(call: CallbackQuery, state: FSMContext):
+    await show_step(call.message, state, "Выберите желаемое действие:", choosing_actions(call.from_user.id))
+    await call.answer()
 
 @router.callback_query(F.data == "back_to_date")
-async def handle_back_to_date(call: CallbackQuery):
-    uid = call.from_user.id
-
+async def handle_back_to_date(call: CallbackQuery, state: FSMContext):
     # Очищаем выбор времени
-    user_data[uid].pop("selected_time", None)
-    user_step[uid] = "awaiting_date"
-
-    await call.message.edit_reply_markup(reply_markup=None)
-    await send_week_calendar(uid, call.message)
+    data = await state.get_data()
+    data.pop("booking_slot", None)
+    data.pop("max_duration_minutes", None)
+    data.pop("duration_minutes", None)
+    await state.set_data(data)
+    await state.set_state(BookingStates.awaiting_date)
+
+    await show_week_calendar(call.message, state, data.get("selected_zone"))
     await call.answer()
 
-@router.message()
-async def handle_any_message(message: Message):
+async def handle_any_message(message: Message, state: FSMContext):
     uid = message.from_user.id
 
     user_exists = await check_user_in_db(uid)
@@ -529,80 +751,93 @@ async def handle_any_message(message: Message):
         await message.answer("Здравствуйте! Вы не зарегистрированы. Пожалуйста, используйте команду /start для регистрации.")
 
 @router.callback_query(F.data == "back_to_number")
-async def handle_back_to_number(call: CallbackQuery):
-    uid = call.from_user.id
-    user_step[uid] = "awaiting_number_of_computers"
-    
-    await ask_for_computer_numbers(call.message)
+async def handle_back_to_number(call: CallbackQuery, state: FSMContext):
+    await state.update_data(selected_computers=[], wizard_message_id=call.message.message_id)
+    await state.set_state(BookingStates.awaiting_number_of_computers)
+
+    await show_step(call.message, state, "Сколько компьютеров хотите забронировать?", back_to_zone_keyboard)
+    await call.answer()
 
 # Обработка возврата к выбору компьютеров
 @router.callback_query(F.data == "back_to_computers")
-async def handle_back_to_computers(call: CallbackQuery):
-    uid = call.from_user.id
-
+async def handle_back_to_computers(call: CallbackQuery, state: FSMContext):
     # Очищаем только данные, относящиеся к выбору даты и времени
-    user_data[uid].pop("booking_date", None)
-    user_data[uid].pop("selected_time", None)
-    user_data[uid]["selected_computers"] = []
-    user_step[uid] = "awaiting_computer_selection"
-
-    selected_zone = user_data[uid]["selected_zone"]
-    count = user_data[uid].get("number_of_computers", 1)
-    valid_numbers = zone_computer_mapping[selected_zone]
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=str(num), callback_data=f"computer:{num}")]
-        for num in valid_numbers
-    ])
-    keyboard.inline_keyboard.append([
-        InlineKeyboardButton(text="⬅ Назад", callback_data="back_to_number")
-    ])
-
-    await call.message.edit_reply_markup(reply_markup=None)
-    await call.message.answer("Выберите компьютеры для бронирования:", reply_markup=keyboard)
+    data = await state.get_data()
+    data.pop("booking_day", None)
+    data.pop("booking_slot", None)
+    data.pop("max_duration_minutes", None)
+    data.pop("duration_minutes", None)
+    data["selected_computers"] = []
+    await state.set_data(data)
+    await state.set_state(BookingStates.awaiting_computer_selection)
+
+    keyboard = computer_picker(data["selected_zone"], "back_to_number")
+
+    await show_step(call.message, state, "Выберите компьютеры для бронирования:", keyboard)
     await call.answer()
 
 @router.callback_query(F.data == "back_to_zone")
-async def handle_back_to_zone(call: CallbackQuery):
-    uid = call.from_user.id
-
+async def handle_back_to_zone(call: CallbackQuery, state: FSMContext):
     # Очищаем всё, что связано с выбором ПК, даты, времени и зоны
-    user_data[uid].pop("selected_zone", None)
-    user_data[uid].pop("number_of_computers", None)
-    user_data[uid].pop("selected_computers", None)
-    user_data[uid].pop("booking_date", None)
-    user_data[uid].pop("selected_time", None)
-    user_step[uid] = "awaiting_zone"
-
-    await call.message.edit_reply_markup(reply_markup=None)
-    await handle_book_button(call)
+    data = await state.get_data()
+    for key in ("selected_zone", "number_of_computers", "selected_computers", "booking_day", "booking_slot",
+                "max_duration_minutes", "duration_minutes"):
+        data.pop(key, None)
+    await state.set_data(data)
+    await state.set_state(BookingStates.awaiting_zone)
+
+    await show_step(call.message, state, "Выберите желаемую зону:", zone_keyboard)
     await call.answer()
 
 @router.callback_query(F.data == "rules")
 async def handle_rules(call: CallbackQuery):
     await call.answer()
 
-    for i, part in enumerate(RULES_PARTS):
-        if i == len(RULES_PARTS) - 1:
-            await call.message.answer(part, parse_mode="HTML", reply_markup=rules_back_keyboard)
-        else:
-            await call.message.answer(part, parse_mode="HTML")
-
-rules_back_keyboard = InlineKeyboardMarkup(
-    inline_keyboard=[
-        [InlineKeyboardButton(text="⬅ Назад в меню", callback_data="back_to_menu")]
-    ]
-)
+    # Части правил не ждут отправки: очередь отправит их по порядку и,
+    # если они ещё ждут лимита, склеит соседние в одно сообщение
+    with priority(LOW):
+        for i, part in enumerate(RULES_PARTS):
+            if i == len(RULES_PARTS) - 1:
+                post(call.message.answer(part, parse_mode="HTML", reply_markup=rules_back_keyboard))
+            else:
+                post(call.message.answer(part, parse_mode="HTML"))
 
-async def process_zone_selection(uid, zone, message):
-    user_data[uid]["selected_zone"] = zone
+async def process_zone_selection(state: FSMContext, zone, message):
+    # Число компьютеров приходит текстом, поэтому запоминаем, какое сообщение править дальше
+    await state.update_data(selected_zone=zone, wizard_message_id=message.message_id)
     if zone in ["ps4", "ps5"]:
-        await message.answer("Выберите дату для бронирования:")
-        await send_week_calendar(uid, message)
-        user_step[uid] = "awaiting_date"
+        await show_week_calendar(message, state, zone)
+        await state.set_state(BookingStates.awaiting_date)
     else:
-        await message.answer("Сколько компьютеров хотите забронировать?",
-                             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                                 [InlineKeyboardButton(text="⬅ Назад", callback_data="back_to_zone")]
-                             ]))
-        user_step[uid] = "awaiting_number_of_computers"
+        await show_step(message, state, "Сколько компьютеров хотите забронировать?", back_to_zone_keyboard)
+        await state.set_state(BookingStates.awaiting_number_of_computers)
+
+# Обработчики текстовых сообщений по текущему шагу диалога.
+# Сообщение попадает к нужному обработчику одним поиском в словаре
+# вместо последовательной проверки фильтра каждого шага.
+text_step_handlers = {
+    BookingStates.awaiting_nickname.state: get_nickname,
+    BookingStates.awaiting_phone.state: get_phone,
+    BookingStates.awaiting_new_phone.state: get_new_phone,
+    BookingStates.awaiting_new_nickname.state: get_new_nickname,
+    BookingStates.awaiting_number_of_computers.state: ask_for_computer_numbers,
+}
+
+@router.message()
+async def dispatch_text_step(message: Message, state: FSMContext):
+    handler = handle_any_message
+    if message.text is not None:
+        handler = text_step_handlers.get(await state.get_state(), handle_any_message)
+    name_handler(handler)
+    await handler(message, state)
+
+@router.errors(ExceptionTypeFilter(DatabaseError))
+async def handle_database_error(event: ErrorEvent):
+    """Сообщает пользователю, что база недоступна, вместо молчаливого сбоя."""
+    logging.error(f"Ошибка базы данных при обработке обновления {event.update.update_id}: {event.exception}")
+    text = "⚠ Сервис бронирования временно недоступен. Попробуйте через минуту."
+    if event.update.callback_query:
+        await event.update.callback_query.answer(text, show_alert=True)
+    elif event.update.message:
+        await event.update.message.answer(text)
+    return True
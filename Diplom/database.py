@@ -1,15 +1,171 @@
 import asyncio
-from datetime import datetime
+import random
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import timedelta
+from enum import Enum
+from typing import List, Optional
 import aiomysql
+import config
 from config import DB_CONFIG
 import logging
+import metrics
+import occupancy
+from queries import QUERIES, BookingRow
+from zones import booking_computers
 
 db_pool = None
 
+# Бэкенд базы: "mysql" (aiomysql) или "sqlite" (sqlite_backend, файл DB_CONFIG['path'])
+DB_BACKEND = DB_CONFIG.get('backend', 'mysql')
+# Настройки пула берутся из DB_CONFIG, значения по умолчанию совпадают с прежними
+POOL_MINSIZE = DB_CONFIG.get('pool_minsize', 1)
+POOL_MAXSIZE = DB_CONFIG.get('pool_maxsize', 5)
+# Сколько секунд ждать свободное соединение, прежде чем считать запрос неудачным
+ACQUIRE_TIMEOUT = DB_CONFIG.get('acquire_timeout', 5)
+# Соединения старше pool_recycle секунд переоткрываются (-1 — не переоткрывать)
+POOL_RECYCLE = DB_CONFIG.get('pool_recycle', 3600)
+# Соединение, простоявшее дольше pre_ping_idle секунд, проверяется ping перед выдачей
+PRE_PING_IDLE = DB_CONFIG.get('pre_ping_idle', 30)
+# Сколько раз выполнять запрос при временной ошибке и начальная пауза между попытками (с)
+QUERY_ATTEMPTS = DB_CONFIG.get('query_attempts', 3)
+RETRY_BACKOFF = DB_CONFIG.get('retry_backoff', 0.05)
+RETRY_BACKOFF_MAX = DB_CONFIG.get('retry_backoff_max', 1.0)
+
+# Коды MySQL, после которых запрос можно повторить:
+# too many connections, lock wait timeout, deadlock, нет связи с сервером
+TRANSIENT_ERROR_CODES = {1040, 1205, 1213, 2003, 2006, 2013}
+# Коды обрыва связи (server has gone away, lost connection): если обрыв случился
+# после отправки записи или COMMIT, неизвестно, выполнил ли её сервер
+CONNECTION_LOST_CODES = {2006, 2013}
+
+# Слушатели выполненных запросов: listener(name, seconds, failed) вызывается
+# после каждой попытки (так tracing считает запросы к базе на одно обновление)
+query_listeners = []
+
+# Слушатели изменений броней (так reminders узнаёт о новых и снятых бронях без запросов к базе):
+# listener(uid, booking) — сохранена бронь (queries.BookingRow);
+# listener(booking_ids, seats) — брони удалены или перенесены в историю,
+# seats — освободившиеся места [(номер слота, номер компьютера)]
+booking_saved_listeners = []
+booking_released_listeners = []
+
+# Проверки перед сохранением брони: guard(uid, slot, computers, minutes) возвращает
+# компьютеры, которые этому пользователю занимать нельзя (так waitlist
+# не отдаёт места, удержанные за другим ожидающим)
+reservation_guards = []
+
+class DatabaseError(Exception):
+    """Ошибка выполнения запроса к базе данных."""
+
+    def __init__(self, name, cause):
+        super().__init__(f"{name}: {cause}")
+        self.name = name
+        self.cause = cause
+
+class TransientDatabaseError(DatabaseError):
+    """Временная ошибка (нет соединения, deadlock, таймаут): запрос можно повторить."""
+
+class UncertainDatabaseError(DatabaseError):
+    """
+    Связь оборвалась после отправки записи или COMMIT: запись могла выполниться.
+    Не повторяется, чтобы не выполнить запись дважды.
+    """
+
+class PermanentDatabaseError(DatabaseError):
+    """Ошибка, которая не исчезнет при повторе (синтаксис, схема, ограничения)."""
+
+class IntegrityDatabaseError(PermanentDatabaseError):
+    """Нарушение уникального ключа или внешнего ключа."""
+
+def _classify_error(name, error):
+    if isinstance(error, DatabaseError):
+        return error
+    if isinstance(error, (aiomysql.IntegrityError, sqlite3.IntegrityError)):
+        return IntegrityDatabaseError(name, error)
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return TransientDatabaseError(name, error)
+    # SQLite: запись другого соединения не завершилась за busy_timeout
+    if isinstance(error, sqlite3.OperationalError) and "locked" in str(error):
+        return TransientDatabaseError(name, error)
+    if isinstance(error, (aiomysql.OperationalError, aiomysql.InternalError)):
+        if error.args and error.args[0] in TRANSIENT_ERROR_CODES:
+            return TransientDatabaseError(name, error)
+    return PermanentDatabaseError(name, error)
+
+def _is_connection_lost(error):
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return isinstance(error, aiomysql.OperationalError) and bool(error.args) and error.args[0] in CONNECTION_LOST_CODES
+
+def _retry_delay(attempt):
+    """Экспоненциальная пауза перед повтором с полным разбросом (full jitter)."""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+
 def set_db_pool(pool):
     global db_pool
     db_pool = pool
 
+async def create_db_pool():
+    """
+    Создаёт пул соединений по настройкам DB_CONFIG и передаёт его в модуль.
+    Любой бэкенд отдаёт пул с интерфейсом aiomysql.Pool (acquire/release,
+    соединения с cursor/begin/commit/rollback/ping), поэтому остальной
+    код модуля от бэкенда не зависит.
+    """
+    if DB_BACKEND == 'sqlite':
+        import sqlite_backend
+        pool = await sqlite_backend.create_pool(DB_CONFIG.get('path', 'diplom.sqlite3'), POOL_MAXSIZE)
+        set_db_pool(pool)
+        return pool
+    pool = await aiomysql.create_pool(
+        host=DB_CONFIG['host'],
+        user=DB_CONFIG['user'],
+        password=DB_CONFIG['password'],
+        db=DB_CONFIG['db'],
+        autocommit=True,
+        minsize=POOL_MINSIZE,
+        maxsize=POOL_MAXSIZE,
+        pool_recycle=POOL_RECYCLE
+    )
+    set_db_pool(pool)
+    return pool
+
+async def close_db_pool():
+    """Закрывает пул, дождавшись возврата всех соединений."""
+    if db_pool is not None:
+        db_pool.close()
+        await db_pool.wait_closed()
+        set_db_pool(None)
+
+@asynccontextmanager
+async def acquire_connection():
+    """
+    Выдаёт соединение из пула с ограничением времени ожидания.
+    Записывает время ожидания и число занятых соединений в metrics.
+    :raises asyncio.TimeoutError: если свободное соединение не появилось за ACQUIRE_TIMEOUT.
+    """
+    started = time.perf_counter()
+    try:
+        conn = await asyncio.wait_for(db_pool.acquire(), ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        metrics.db_pool_acquire_timeouts.inc()
+        logging.error(f"Нет свободных соединений в пуле за {ACQUIRE_TIMEOUT} с (занято {db_pool.size - db_pool.freesize})")
+        raise
+    metrics.db_pool_acquire_seconds.observe(time.perf_counter() - started)
+    metrics.db_pool_in_use.inc()
+    metrics.db_pool_size.set(db_pool.size)
+    try:
+        if PRE_PING_IDLE >= 0 and asyncio.get_running_loop().time() - conn.last_usage > PRE_PING_IDLE:
+            await conn.ping(reconnect=True)
+        yield conn
+    finally:
+        metrics.db_pool_in_use.dec()
+        await db_pool.release(conn)
+
 async def create_db_connection():
     """Создает асинхронное подключение к базе данных."""
     try:
@@ -25,111 +181,372 @@ async def create_db_connection():
         logging.error(f"Ошибка подключения к базе данных: {e}")
         raise
 
-async def execute_query(query, params=None, fetch=False):
-    async with db_pool.acquire() as conn:
+async def _with_retries(name, operation):
+    """
+    Выполняет operation(conn) на соединении из пула, повторяя временные ошибки
+    не более QUERY_ATTEMPTS раз с растущей паузой. Ошибки при выдаче соединения
+    повторяются всегда; запись, при которой связь оборвалась после отправки,
+    operation сообщает как UncertainDatabaseError, и она не повторяется.
+    :raises DatabaseError: типизированная ошибка после последней попытки.
+    """
+    for attempt in range(QUERY_ATTEMPTS):
         try:
-            async with conn.cursor() as cursor:
+            async with acquire_connection() as conn:
+                started = time.perf_counter()
+                failed = True
+                try:
+                    result = await operation(conn)
+                    failed = False
+                    return result
+                finally:
+                    seconds = time.perf_counter() - started
+                    metrics.db_query_seconds.observe(seconds, name)
+                    for listener in query_listeners:
+                        listener(name, seconds, failed)
+        except Exception as e:
+            error = _classify_error(name, e)
+            metrics.db_query_errors.inc(name)
+            if isinstance(error, TransientDatabaseError) and attempt + 1 < QUERY_ATTEMPTS:
+                logging.warning(f"Временная ошибка запроса {name} (попытка {attempt + 1}): {error.cause}")
+                await asyncio.sleep(_retry_delay(attempt))
+                continue
+            # Нарушение уникального ключа — ожидаемый исход гонки за место, а не сбой
+            log = logging.warning if isinstance(error, IntegrityDatabaseError) else logging.error
+            log(f"Ошибка выполнения запроса {name}: {error.cause}")
+            raise error from e
+
+async def execute_query(query, params=None, fetch=False, name="other", idempotent=True):
+    """
+    Выполняет произвольный запрос на соединении из пула.
+    :param name: Имя запроса для метрик длительности и ошибок.
+    :param idempotent: False для записи, которую нельзя выполнить дважды
+        (INSERT, условный UPDATE): после обрыва связи она не повторяется.
+    :return: Строки результата (fetch=True) или число затронутых строк.
+    :raises DatabaseError: если запрос не выполнен.
+    :raises UncertainDatabaseError: если связь оборвалась во время
+        неидемпотентной записи и неизвестно, выполнена ли она.
+    """
+    async def operation(conn):
+        async with conn.cursor() as cursor:
+            if fetch:
+                await cursor.execute(query, params)
+                return await cursor.fetchall()
+            try:
                 await cursor.execute(query, params)
-                if fetch:
-                    return await cursor.fetchall()
                 await conn.commit()
-        except Exception as e:
-            logging.error(f"Ошибка выполнения запроса: {query} | Ошибка: {e}")
-            return None
+            except Exception as e:
+                if not idempotent and _is_connection_lost(e):
+                    raise UncertainDatabaseError(name, e) from e
+                raise
+            return cursor.rowcount
+
+    return await _with_retries(name, operation)
+
+async def fetch_rows(name, params=(), in_size=None):
+    """
+    Выполняет именованный запрос из queries.QUERIES и возвращает типизированные строки.
+    :param in_size: Длина списка IN (...) для запросов с {in_list}.
+    """
+    query = QUERIES[name]
+    rows = await execute_query(query.render(in_size), params, fetch=True, name=name)
+    return query.decode(rows)
+
+async def execute(name, params=(), idempotent=True):
+    """Выполняет именованный запрос без результата и возвращает число затронутых строк."""
+    return await execute_query(QUERIES[name].render(), params, name=name, idempotent=idempotent)
+
+async def run_transaction(name, work):
+    """
+    Выполняет work(cursor) в транзакции; при временной ошибке транзакция
+    откатывается и повторяется целиком. Обрыв связи до COMMIT безопасен
+    (сервер сам откатывает незавершённую транзакцию), а обрыв во время
+    COMMIT не повторяется: транзакция могла уже зафиксироваться.
+    :return: Значение, возвращённое work.
+    :raises UncertainDatabaseError: если связь оборвалась во время COMMIT.
+    """
+    async def operation(conn):
+        await conn.begin()
+        try:
+            async with conn.cursor() as cursor:
+                result = await work(cursor)
+            try:
+                await conn.commit()
+            except Exception as e:
+                if _is_connection_lost(e):
+                    raise UncertainDatabaseError(name, e) from e
+                raise
+            return result
+        except BaseException:
+            try:
+                await conn.rollback()
+            except Exception as e:
+                logging.warning(f"Не удалось откатить транзакцию {name}: {e}")
+            raise
+
+    return await _with_retries(name, operation)
 
 async def delete_booking(booking_id):
-    query = "DELETE FROM UserInfo WHERE id = %s"
-    await execute_query(query, (booking_id,))
+    await _delete_bookings("booking_id", (booking_id,))
 
 async def delete_all_user_bookings(phone_number, nickname):
-    query = "DELETE FROM UserInfo WHERE phone = %s AND nickname = %s"
-    await execute_query(query, (phone_number, nickname))
+    await _delete_bookings("contact", (phone_number, nickname))
 
 async def fetch_user_bookings(phone_number, nickname):
-    query = """
-        SELECT id, booking_date, booking_time, zone, computers 
-        FROM UserInfo 
-        WHERE phone = %s AND nickname = %s
-    """
-    return await execute_query(query, (phone_number, nickname), fetch=True)
-
-async def format_date(date_str):
-    try:
-        return datetime.strptime(date_str, "%d.%m.%Y").strftime("%Y-%m-%d")
-    except ValueError as e:
-        logging.error(f"Ошибка преобразования даты: {date_str} | {e}")
-        return None
+    """:return: Список queries.BookingRow."""
+    return await fetch_rows("fetch_user_bookings", (phone_number, nickname))
 
-async def check_availability(computer_ids, booking_date, booking_time):
+async def check_availability(computer_ids, slot, minutes=occupancy.SLOT_MINUTES):
     """
-    Проверяет доступность компьютеров на определенную дату и время.
+    Проверяет доступность компьютеров на интервал [slot, slot + minutes).
+    Проверка выполняется по индексу занятости в памяти, без запроса к базе.
+    :param slot: Номер слота начала (occupancy.slot_at).
     """
     if not computer_ids:
         return True
-    
-    formatted_date = await format_date(booking_date)
+    return occupancy.is_free(slot, computer_ids, minutes)
 
-    if not formatted_date:
-        logging.error("Некорректная дата, не удалось проверить доступность.")
-        return False
+async def load_occupancy_index():
+    """
+    Заполняет индекс занятости предстоящими бронями из booking_seats.
+    Вызывается один раз при запуске бота.
+    """
+    seats = await fetch_rows("load_occupancy_index")
+    occupancy.clear()
+    for seat in seats:
+        occupancy.occupy(occupancy.slot_at(seat.slot_start), [seat.computer_id])
+    logging.info(f"Индекс занятости загружен: {len(seats)} мест")
 
-    placeholders = ','.join(['%s'] * len(computer_ids))
-    query = f"""
-        SELECT COUNT(*)
-        FROM UserInfo
-        WHERE computers IN ({placeholders}) AND booking_date = %s AND booking_time = %s
+async def _delete_bookings(selector, params):
     """
-    params = (*computer_ids, formatted_date, booking_time)
-    result = await execute_query(query, params, fetch=True)
+    Удаляет брони вместе с их местами в booking_seats одним запросом
+    и снимает эти места из индекса занятости. Места читаются с блокировкой
+    в той же транзакции, что и удаление, поэтому освобождаются только
+    удалённые места, а не занятые тем временем другой бронью.
+    :param selector: booking_id, uid или contact — какие брони удалять.
+    :return: Число удалённых броней.
+    """
+    seats_query = QUERIES[f"seats_by_{selector}"]
+    delete_query = QUERIES[{"booking_id": "delete_booking_by_id",
+                            "uid": "delete_bookings_by_uid",
+                            "contact": "delete_bookings_by_contact"}[selector]]
+
+    async def delete(cursor):
+        await cursor.execute(seats_query.sql, params)
+        seats = seats_query.decode(await cursor.fetchall())
+        await cursor.execute(delete_query.sql, params)
+        return seats
+
+    seats = await run_transaction(delete_query.name, delete)
+    _release_seats(seats)
+    return len({seat.booking_id for seat in seats})
+
+def _release_seats(seats):
+    """Снимает места (queries.BookedSeatRow) из индекса занятости и сообщает слушателям."""
+    freed = [(occupancy.slot_at(seat.slot_start), seat.computer_id) for seat in seats]
+    for slot, computer_id in freed:
+        occupancy.release(slot, [computer_id])
+    _notify_released({seat.booking_id for seat in seats}, freed)
+
+def _notify_released(booking_ids, seats):
+    if booking_ids:
+        for listener in booking_released_listeners:
+            listener(booking_ids, seats)
 
-    if result:
-        (count,) = result[0]
-        return count == 0
-    return False
+async def _fetch_busy_computers(start, end, computers):
+    """Номера компьютеров из computers, занятых в интервале [start, end) (диапазон по индексу)."""
+    rows = await fetch_rows("busy_computers", (start, end, *computers), in_size=len(computers))
+    return sorted(row.computer_id for row in rows)
 
-async def format_date(date_str):
+class ReservationStatus(Enum):
+    SUCCESS = "success"
+    CONFLICT = "conflict"
+    ERROR = "error"
+
+@dataclass
+class ReservationResult:
     """
-    Преобразует строку даты из формата 'DD.MM.YYYY' в 'YYYY-MM-DD'
+    Результат reserve_booking.
+    :param status: Итог попытки бронирования.
+    :param booking_id: ID созданной брони (только для SUCCESS).
+    :param conflicts: Номера уже занятых компьютеров (только для CONFLICT).
     """
-    try:
-        return datetime.strptime(date_str, "%d.%m.%Y").strftime("%Y-%m-%d")
-    except ValueError:
-        logging.error(f"Ошибка преобразования даты: {date_str}")
-        return None
+    status: ReservationStatus
+    booking_id: Optional[int] = None
+    conflicts: List[int] = field(default_factory=list)
 
-async def save_user_info(uid, data):
+    @property
+    def ok(self):
+        return self.status is ReservationStatus.SUCCESS
+
+async def reserve_booking(uid, data):
     """
-    Сохраняет информацию о бронировании в базу данных.
+    Атомарно проверяет доступность компьютеров и сохраняет бронь.
+    Бронь и её места вставляются в одной транзакции: для каждого компьютера
+    по строке на каждый слот интервала [начало, начало + duration_minutes).
+    Уникальный ключ (slot_start, computer_id) в booking_seats отклоняет вставку
+    уже занятого места, поэтому пересекающиеся брони не сохраняются, а из двух
+    одновременных подтверждений проходит только одно.
     :param uid: ID пользователя в Telegram.
     :param data: Словарь с данными пользователя.
+    :return: ReservationResult.
     """
+    result = await _reserve_booking(uid, data)
+    metrics.bookings_reserved.inc(result.status.value)
+    return result
 
-    formatted_date = await format_date(data['booking_date'])
-
-    if not formatted_date:
-        logging.error("Некорректная дата бронирования.")
-        return
+async def _reserve_booking(uid, data):
+    slot = int(data['booking_slot'])
+    minutes = int(data.get('duration_minutes') or occupancy.SLOT_MINUTES)
+    starts = occupancy.slot_starts(slot, minutes)
+    start, end = starts[0], starts[-1] + timedelta(minutes=occupancy.SLOT_MINUTES)
+    # booking_date и booking_time заполняются для отчётов; бот работает с start_slot
+    booking_date, booking_time = start.date(), start.strftime("%H:%M")
 
     if data['selected_zone'] in ['ps4', 'ps5']:
-        query = """
-            INSERT INTO UserInfo (user_id, nickname, phone, zone, booking_date, booking_time)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
+        insert = QUERIES["insert_console_booking"].sql
+        computers_column = None
         params = (
             uid, data['nikname'], data['telefhone'], data['selected_zone'],
-            formatted_date, data['selected_time']
+            booking_date, booking_time, minutes, slot
         )
     else:
-        query = """
-            INSERT INTO UserInfo (user_id, nickname, phone, zone, computer_count, booking_date, booking_time, computers)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """
+        insert = QUERIES["insert_computer_booking"].sql
+        computers_column = ','.join(map(str, data['selected_computers']))
         params = (
             uid, data['nikname'], data['telefhone'], data['selected_zone'],
-            data['number_of_computers'], formatted_date, data['selected_time'],
-            ','.join(map(str, data['selected_computers']))
+            data['number_of_computers'], booking_date, booking_time,
+            computers_column, minutes, slot
         )
-    await execute_query(query, params)
+
+    computers = booking_computers(data['selected_zone'], data.get('selected_computers'))
+
+    # Быстрый отказ по индексу в памяти, без обращения к базе
+    busy = occupancy.occupied_computers(slot, computers, minutes)
+    if not busy:
+        busy = sorted({num for guard in reservation_guards for num in guard(uid, slot, computers, minutes)})
+    if busy:
+        return ReservationResult(ReservationStatus.CONFLICT, conflicts=busy)
+
+    async def insert_booking(cursor):
+        await cursor.execute(insert, params)
+        booking_id = cursor.lastrowid
+        await cursor.executemany(
+            QUERIES["insert_booking_seats"].sql,
+            [(booking_id, num, slot) for slot in starts for num in computers]
+        )
+        return booking_id
+
+    try:
+        booking_id = await run_transaction("reserve_booking", insert_booking)
+    except UncertainDatabaseError:
+        # COMMIT мог пройти до обрыва связи: ищем бронь по её первому месту,
+        # иначе повтор пользователя упрётся в его же места
+        booking_id = await _find_reserved_booking(uid, slot, start, computers)
+        if booking_id is None:
+            logging.error(f"Не удалось сохранить бронь пользователя {uid}: связь оборвалась при COMMIT")
+            return ReservationResult(ReservationStatus.ERROR)
+    except IntegrityDatabaseError:
+        try:
+            busy = await _fetch_busy_computers(start, end, computers)
+        except DatabaseError:
+            busy = []
+        logging.warning(f"Компьютеры {busy} уже заняты в интервале {start} - {end}")
+        return ReservationResult(ReservationStatus.CONFLICT, conflicts=busy or computers)
+    except DatabaseError as e:
+        logging.error(f"Ошибка сохранения брони пользователя {uid}: {e}")
+        return ReservationResult(ReservationStatus.ERROR)
+
+    occupancy.occupy(slot, computers, minutes)
+    occupancy.prune()
+    booking = BookingRow(booking_id, slot, data['selected_zone'], computers_column, minutes)
+    for listener in booking_saved_listeners:
+        listener(uid, booking)
+    return ReservationResult(ReservationStatus.SUCCESS, booking_id=booking_id)
+
+async def _find_reserved_booking(uid, slot, start, computers):
+    """:return: id брони пользователя uid со слота slot, занявшей место (start, computers[0]), или None."""
+    try:
+        rows = await fetch_rows("user_booking_at_seat", (start, computers[0], uid, slot))
+    except DatabaseError as e:
+        logging.error(f"Не удалось проверить бронь пользователя {uid} после обрыва связи: {e}")
+        return None
+    return rows[0].id if rows else None
+
+async def save_user_info(uid, data):
+    """
+    Сохраняет информацию о бронировании в базу данных.
+    :param uid: ID пользователя в Telegram.
+    :param data: Словарь с данными пользователя.
+    :return: True, если бронь сохранена, иначе False.
+    """
+    result = await reserve_booking(uid, data)
+    return result.ok
+
+class AsyncTTLCache:
+    """
+    LRU-кэш с ограниченным временем жизни записей для асинхронного кода.
+    Одновременные промахи по одному ключу объединяются: загрузчик
+    выполняется один раз, остальные запросы ждут его результата.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    async def get(self, key, loader):
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        task = self._pending.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._pending[key] = task
+        else:
+            self.hits += 1
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader):
+        try:
+            value = await loader()
+            # Если ключ инвалидировали во время загрузки, результат не кэшируем
+            if self._pending.get(key) is asyncio.current_task():
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            return value
+        finally:
+            if self._pending.get(key) is asyncio.current_task():
+                del self._pending[key]
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+        self._pending.pop(key, None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+user_cache = AsyncTTLCache(
+    maxsize=getattr(config, "USER_CACHE_SIZE", 10000),
+    ttl=getattr(config, "USER_CACHE_TTL", 300)
+)
+
+async def _load_user(uid):
+    # Ошибка базы (DatabaseError) пробрасывается и не кэшируется,
+    # чтобы не запомнить пользователя как несуществующего
+    rows = await fetch_rows("load_user", (uid,))
+    return rows[0] if rows else None
 
 async def check_user_in_db(uid):
     """
@@ -137,12 +554,7 @@ async def check_user_in_db(uid):
     :param uid: ID пользователя в Telegram.
     :return: True, если пользователь существует, иначе False.
     """
-    query = "SELECT COUNT(*) FROM Users WHERE user_id = %s"
-    result = await execute_query(query, (uid,), fetch=True)
-    if result:
-        (count,) = result[0]
-        return count > 0
-    return False
+    return await get_user_from_db(uid) is not None
 
 async def register_user(uid, phone_number, nickname):
     """
@@ -151,36 +563,108 @@ async def register_user(uid, phone_number, nickname):
     :param phone_number: Номер телефона пользователя.
     :param nickname: Никнейм пользователя.
     """
-    query = """
-        INSERT INTO Users (user_id, phone, nickname, registration_date)
-        VALUES (%s, %s, %s, NOW())
-    """
-    await execute_query(query, (uid, phone_number, nickname))
+    try:
+        await execute("register_user", (uid, phone_number, nickname), idempotent=False)
+    except UncertainDatabaseError:
+        # INSERT мог пройти до обрыва связи: повтор нарушил бы первичный ключ,
+        # поэтому проверяем, появился ли пользователь
+        if await _load_user(uid) is None:
+            raise
+    user_cache.invalidate(uid)
 
 async def get_user_from_db(uid):
     """
-    Загружает данные пользователя из базы данных.
+    Загружает данные пользователя из базы данных (через кэш user_cache).
     :param uid: ID пользователя в Telegram.
-    :return: Словарь с данными пользователя или None, если не найден.
+    :return: queries.UserRow или None, если пользователь не найден.
+    :raises DatabaseError: если база недоступна.
     """
-    query = "SELECT nickname, phone FROM Users WHERE user_id = %s"
-    result = await execute_query(query, (uid,), fetch=True)
-    if result:
-        return {"nickname": result[0][0], "phone": result[0][1]}
-    return None
+    return await user_cache.get(uid, lambda: _load_user(uid))
+
+def get_user_cache_stats():
+    """Счётчики попаданий и промахов кэша пользователей."""
+    return user_cache.stats()
 
 async def fetch_user_bookings_by_uid(uid):
-    query = """
-        SELECT id, booking_date, booking_time, zone, computers
-        FROM UserInfo
-        WHERE user_id = %s
-    """
-    return await execute_query(query, (uid,), fetch=True)
+    """:return: Список queries.BookingRow."""
+    return await fetch_rows("fetch_user_bookings_by_uid", (uid,))
 
 async def delete_booking_by_id(booking_id):
-    query = "DELETE FROM UserInfo WHERE id = %s"
-    await execute_query(query, (booking_id,))
+    await _delete_bookings("booking_id", (booking_id,))
 
 async def delete_all_bookings_by_uid(uid):
-    query = "DELETE FROM UserInfo WHERE user_id = %s"
-    await execute_query(query, (uid,))
+    await _delete_bookings("uid", (uid,))
+
+async def cancel_user_bookings(uid, bookings):
+    """
+    Удаляет выбранные брони пользователя одним запросом DELETE ... WHERE id IN (...)
+    AND user_id = ... и снимает их места из индекса занятости.
+    Список броней берётся из FSM и мог устареть (бронь уже отменена или
+    перенесена в историю), поэтому места читаются с блокировкой в той же
+    транзакции, что и удаление, и освобождаются только удалённые.
+    :param bookings: Брони из списка, показанного пользователю (queries.BookingRow).
+    :return: Число удалённых броней.
+    """
+    if not bookings:
+        return 0
+    ids = [booking.id for booking in bookings]
+
+    async def delete(cursor):
+        await cursor.execute(QUERIES["seats_by_user_booking_ids"].render(len(ids)), (*ids, uid))
+        seats = QUERIES["seats_by_user_booking_ids"].decode(await cursor.fetchall())
+        await cursor.execute(QUERIES["delete_user_bookings_by_ids"].render(len(ids)), (*ids, uid))
+        return seats
+
+    seats = await run_transaction("delete_user_bookings_by_ids", delete)
+    _release_seats(seats)
+    return len({seat.booking_id for seat in seats})
+
+async def fetch_upcoming_reminders(after_slot):
+    """:return: Брони, начинающиеся после слота after_slot, без отправленного напоминания (queries.ReminderRow)."""
+    return await fetch_rows("upcoming_reminders", (after_slot,))
+
+async def claim_reminder(booking_id):
+    """
+    Отмечает, что напоминание о брони отправлено.
+    :return: False, если бронь удалена или напоминание уже отмечено раньше.
+    """
+    return await execute("claim_reminder", (booking_id,), idempotent=False) > 0
+
+async def mark_checked_in(booking_id):
+    """
+    Отмечает, что клиент пришёл по брони; такая бронь не снимается как неявка.
+    :return: False, если брони с таким id нет.
+    """
+    return await execute("mark_checked_in", (booking_id,)) > 0
+
+async def archive_bookings(selector, cutoff, limit):
+    """
+    Переносит до limit броней, отобранных selector по времени cutoff, в UserInfo_history
+    и удаляет их вместе с местами. Перенос и удаление выполняются одной
+    короткой транзакцией по первичным ключам, поэтому блокируются только
+    переносимые строки.
+    :param selector: finished (закончившиеся к cutoff) или no_show (начавшиеся
+        до cutoff без отметки о приходе).
+    :return: Число перенесённых броней.
+    """
+    # Отсечка в слотах с дробной частью: окончание сравнивается с точностью до секунды
+    position = (cutoff - occupancy.EPOCH).total_seconds() / (occupancy.SLOT_MINUTES * 60)
+    bounds = (position, position) if selector == "finished" else (position,)
+    ids = [row.id for row in await fetch_rows(f"{selector}_booking_ids", (*bounds, limit))]
+    if not ids:
+        return 0
+
+    async def move(cursor):
+        # Бронь могли отменить после выборки ids: места читаются с блокировкой
+        # в транзакции, и освобождаются только перенесённые
+        await cursor.execute(QUERIES["seats_by_booking_ids"].render(len(ids)), ids)
+        seats = QUERIES["seats_by_booking_ids"].decode(await cursor.fetchall())
+        await cursor.execute(QUERIES["archive_bookings"].render(len(ids)), (selector, *ids))
+        moved = cursor.rowcount
+        await cursor.execute(QUERIES["delete_bookings_by_ids"].render(len(ids)), ids)
+        return seats, moved
+
+    seats, moved = await run_transaction(f"archive_{selector}", move)
+    _release_seats(seats)
+    metrics.bookings_archived.inc(selector, amount=moved)
+    return moved
@@ -0,0 +1,192 @@
+"""
+Фабрика inline-клавиатур бота.
+
+Статические меню создаются один раз при импорте модуля. Календарь,
+сетка времени и выбор компьютеров запоминаются через lru_cache по
+аргументам, от которых зависят: при смене дня или часа меняется ключ,
+и клавиатура строится заново. Возвращаемые объекты общие для всех
+пользователей, поэтому изменять их нельзя.
+"""
+from datetime import datetime
+from functools import lru_cache
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from occupancy import SLOTS_PER_DAY, slot_at
+from utils import format_duration, format_slot
+from zones import zone_computer_mapping, console_zones
+
+# callback_data кнопок занятых слотов и компьютеров
+BUSY_CALLBACK = "busy"
+
+# Варианты длительности брони (минуты)
+DURATION_OPTIONS = (30, 60, 90, 120, 180, 240, 360, 480)
+# Сколько дней, начиная с сегодняшнего, показывает календарь
+CALENDAR_DAYS = 7
+
+
+def _column(*buttons):
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text=text, callback_data=data)] for text, data in buttons]
+    )
+
+
+main_menu_keyboard = _column(
+    ("Забронировать", "book"),
+    ("Отменить бронь", "cancel_booking"),
+    ("Оплатить", "pay"),
+    ("Правила", "rules"),
+)
+
+account_keyboard = _column(
+    ("Да", "yes"),
+    ("Нет", "no"),
+)
+
+zone_keyboard = _column(
+    ("Изи-Лайн", "izi"),
+    ("Про-Лайн", "pro"),
+    ("Буткемп", "bootkemp"),
+    ("PS4", "ps4"),
+    ("PS5", "ps5"),
+)
+
+confirm_keyboard = _column(
+    ("Подтвердить бронь", "confirm_booking"),
+    ("Отменить бронь", "cancel_booking"),
+)
+
+back_to_zone_keyboard = _column(("⬅ Назад", "back_to_zone"))
+
+rules_back_keyboard = _column(("⬅ Назад в меню", "back_to_menu"))
+
+waitlist_join_keyboard = _column(("🔔 Сообщить, когда освободится", "waitlist_join"))
+
+
+@lru_cache(maxsize=32)
+def _week_calendar(today, with_back):
+    days = [today + i * SLOTS_PER_DAY for i in range(CALENDAR_DAYS)]
+    keyboard = [
+        [InlineKeyboardButton(text=format_slot(day, "%d.%m.%Y"), callback_data=f"date:{day}")] for day in days
+    ]
+    if with_back:
+        keyboard.append([InlineKeyboardButton(text="⬅ Назад", callback_data="back_to_computers")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def week_calendar(zone):
+    """
+    Даты на ближайшую неделю (callback data — первый слот суток);
+    для зон с ПК добавляется кнопка возврата к выбору компьютеров.
+    """
+    return _week_calendar(slot_at(datetime.now().date()), zone not in console_zones)
+
+
+def calendar_days():
+    """Первые слоты суток, которые сейчас показывает week_calendar."""
+    today = slot_at(datetime.now().date())
+    return range(today, today + CALENDAR_DAYS * SLOTS_PER_DAY, SLOTS_PER_DAY)
+
+
+def _start_hour(day):
+    now = datetime.now()
+    return now.hour + 1 if day == slot_at(now.date()) else 0
+
+
+def first_time_slot(day):
+    """Первый слот, который time_grid показывает для суток day."""
+    return day + _start_hour(day) * 2
+
+
+@lru_cache(maxsize=256)
+def _time_grid(day, start_hour, with_back, busy_slots):
+    times_list = []
+    for i in range(start_hour * 2, SLOTS_PER_DAY):
+        time_string = f"{i // 2:02}:{i % 2 * 30:02}"
+        if busy_slots >> i & 1:
+            times_list.append(InlineKeyboardButton(text=f"✖ {time_string}", callback_data=BUSY_CALLBACK))
+            continue
+        times_list.append(InlineKeyboardButton(text=time_string, callback_data=f"time:{day + i}"))
+
+    keyboard = [times_list[i:i + 6] for i in range(0, len(times_list), 6)]
+    if with_back:
+        keyboard.append([InlineKeyboardButton(text="Назад к выбору даты", callback_data="back_to_date")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def time_grid(day, zone, busy_slots=0):
+    """
+    Сетка получасовых слотов на сутки, начинающиеся слотом day
+    (callback data — номер слота). Для сегодняшней даты сетка начинается
+    со следующего часа. Слоты из маски busy_slots (см. occupancy.busy_slots)
+    показываются занятыми.
+    """
+    return _time_grid(day, _start_hour(day), zone not in console_zones, busy_slots)
+
+
+@lru_cache(maxsize=16)
+def duration_picker(max_minutes):
+    """Варианты длительности не длиннее max_minutes (свободного интервала после выбранного времени)."""
+    keyboard = []
+    row = []
+    for minutes in DURATION_OPTIONS:
+        if minutes > max_minutes:
+            break
+        row.append(InlineKeyboardButton(text=format_duration(minutes), callback_data=f"duration:{minutes}"))
+        if len(row) == 4:
+            keyboard.append(row)
+            row = []
+    if row:
+        keyboard.append(row)
+    keyboard.append([InlineKeyboardButton(text="Назад к выбору даты", callback_data="back_to_date")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def cancel_picker(bookings, selected):
+    """
+    Список броней для отмены с отметками выбранных.
+    :param bookings: Пары (id брони, подпись кнопки).
+    :param selected: id отмеченных броней.
+    """
+    keyboard = [
+        [InlineKeyboardButton(text=f"{'☑' if booking_id in selected else '☐'} {label}",
+                              callback_data=f"cancel:{booking_id}")]
+        for booking_id, label in bookings
+    ]
+    if selected:
+        keyboard.append([InlineKeyboardButton(text=f"Отменить выбранные ({len(selected)})",
+                                              callback_data="cancel_selected")])
+    keyboard.append([InlineKeyboardButton(text="Отменить все бронирования", callback_data="cancel_all")])
+    keyboard.append([InlineKeyboardButton(text="Назад", callback_data="back_to_menu")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def found_slots_picker(labels):
+    """Найденные варианты брони (callback data — номер варианта) и возврат в меню."""
+    keyboard = [[InlineKeyboardButton(text=label, callback_data=f"found:{i}")] for i, label in enumerate(labels)]
+    keyboard.append([InlineKeyboardButton(text="Назад", callback_data="back_to_menu")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def waitlist_offer_keyboard(waiter_id):
+    """Кнопки предложения из листа ожидания."""
+    return _column(
+        ("Забронировать", f"waitlist:{waiter_id}"),
+        ("Отказаться", f"waitlist_leave:{waiter_id}"),
+    )
+
+
+@lru_cache(maxsize=256)
+def computer_picker(zone, back_callback, busy_mask=0):
+    """
+    Кнопки компьютеров зоны и кнопка возврата на предыдущий шаг.
+    Компьютеры из busy_mask (бит n - 1 для компьютера n) показываются занятыми.
+    """
+    keyboard = []
+    for num in zone_computer_mapping[zone]:
+        if busy_mask >> (num - 1) & 1:
+            keyboard.append([InlineKeyboardButton(text=f"✖ {num}", callback_data=BUSY_CALLBACK)])
+        else:
+            keyboard.append([InlineKeyboardButton(text=str(num), callback_data=f"computer:{num}")])
+    keyboard.append([InlineKeyboardButton(text="⬅ Назад", callback_data=back_callback)])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -1,37 +1,118 @@
 import logging
 from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 import asyncio
-from bot_handlers_FIXED import router  # Импортируйте роутер
-from config import TOKEN, DB_CONFIG
-from aiomysql import create_pool
-from database import set_db_pool  # эту функцию мы создадим в database.py
+from bot_handlers import router  # Импортируйте роутер
+import config
+from config import TOKEN
+from database import create_db_pool, close_db_pool, load_occupancy_index
+from migrations import apply_migrations
+from reminders import load_reminders, start_reminders, stop_reminders
+from middlewares import setup_middlewares
+from storage import create_storage
+from sweeper import start_sweeper, stop_sweeper
+from waitlist import setup_waitlist
+from tracing import setup_logging, start_metrics_server, stop_metrics_server
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Настройка логирования (LOG_FORMAT = "json" — строки JSON с trace_id обновления)
+setup_logging(logging.INFO)
+
+# Режим работы: "polling" (по умолчанию) или "webhook"
+BOT_MODE = getattr(config, "BOT_MODE", "polling")
+
+# Настройки webhook-сервера
+WEBHOOK_HOST = getattr(config, "WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = getattr(config, "WEBHOOK_PORT", 8080)
+WEBHOOK_PATH = getattr(config, "WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = getattr(config, "WEBHOOK_SECRET", None)
+# Публичный адрес (https://example.com); если не задан, webhook в Telegram не регистрируется,
+# и сервер можно проверять локально, отправляя POST с JSON обновлений на WEBHOOK_PATH
+WEBHOOK_BASE_URL = getattr(config, "WEBHOOK_BASE_URL", None)
+# Сколько секунд ждать завершения обрабатываемых обновлений при остановке
+WEBHOOK_SHUTDOWN_TIMEOUT = getattr(config, "WEBHOOK_SHUTDOWN_TIMEOUT", 30)
 
 # Инициализация бота и диспетчера
 bot = Bot(token=TOKEN)
-dp = Dispatcher()
+dp = Dispatcher(storage=create_storage())
+# Очередь исходящих запросов, ограничение частоты, трассировка и очередь пользователя
+setup_middlewares(dp, bot)
 
 # Включение роутера в диспетчер
 dp.include_router(router)
 
+async def init_database():
+    await create_db_pool()  # настройки пула задаются в DB_CONFIG
+    await apply_migrations()
+    await load_occupancy_index()
+    await load_reminders()
+    start_reminders(bot)
+    setup_waitlist(bot)
+    start_sweeper()
+    await start_metrics_server()
+
+async def close_database():
+    await stop_metrics_server()
+    await stop_reminders()
+    await stop_sweeper()
+    await close_db_pool()
+
 async def main():
     print("Starting the bot...")
     try:
-        pool = await create_pool(
-            host=DB_CONFIG['host'],
-            user=DB_CONFIG['user'],
-            password=DB_CONFIG['password'],
-            db=DB_CONFIG['db'],
-            autocommit=True,
-            minsize=1,  # минимальное количество соединений
-            maxsize=5   # максимальное количество соединений
-        )
-        set_db_pool(pool)  # передаём пул в database.py
+        await init_database()
         await dp.start_polling(bot)
     except Exception as e:
         logging.error(f"An error occurred: {e}")
+    finally:
+        await close_database()
+        await dp.storage.close()
+
+async def on_webhook_startup(bot: Bot):
+    await init_database()
+    if WEBHOOK_BASE_URL:
+        await bot.set_webhook(
+            f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+
+async def on_webhook_cleanup(app: web.Application):
+    # on_cleanup вызывается aiohttp уже после того, как завершились все
+    # обрабатываемые запросы, поэтому пул закрывается только после них
+    await close_database()
+    await dp.storage.close()
+    await bot.session.close()
+
+def create_webhook_app():
+    """
+    Создаёт aiohttp-приложение, принимающее обновления на WEBHOOK_PATH.
+    Обновление обрабатывается внутри запроса (handle_in_background=False),
+    поэтому при остановке сервер дожидается завершения обработчиков.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        handle_in_background=False
+    ).register(app, path=WEBHOOK_PATH)
+    dp.startup.register(on_webhook_startup)
+    setup_application(app, dp, bot=bot)
+    app.on_cleanup.append(on_webhook_cleanup)
+    return app
+
+def run_webhook():
+    print(f"Starting the bot webhook on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}...")
+    web.run_app(
+        create_webhook_app(),
+        host=WEBHOOK_HOST,
+        port=WEBHOOK_PORT,
+        shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT
+    )
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if BOT_MODE == "webhook":
+        run_webhook()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,158 @@
+"""
+Простые метрики процесса: счётчики, текущие значения и гистограммы
+с метками. Значения хранятся в памяти и читаются через snapshot()
+или в текстовом формате Prometheus через render_prometheus().
+"""
+import bisect
+from collections import defaultdict
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = defaultdict(float)
+        REGISTRY.append(self)
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] += amount
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = defaultdict(float)
+        REGISTRY.append(self)
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] += amount
+
+    def dec(self, *label_values, amount=1):
+        self.values[label_values] -= amount
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин (в секундах)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики корзин..., +Inf], сумма, количество
+        self.values = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def summary(self, *label_values):
+        series = self.values.get(label_values)
+        if series is None:
+            return {"count": 0, "sum": 0.0, "avg": 0.0}
+        _, total, count = series
+        return {"count": count, "sum": total, "avg": total / count}
+
+
+def snapshot():
+    """Текущие значения всех метрик в виде словаря (для логов и отладки)."""
+    result = {}
+    for metric in REGISTRY:
+        if isinstance(metric, Histogram):
+            result[metric.name] = {labels: metric.summary(*labels) for labels in metric.values}
+        else:
+            result[metric.name] = dict(metric.values)
+    return result
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in pairs
+    )
+    return "{" + body + "}"
+
+
+def render_prometheus():
+    """Все метрики в текстовом формате Prometheus (для /metrics)."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for label_values, value in list(metric.values.items()):
+            if not isinstance(metric, Histogram):
+                lines.append(f"{metric.name}{_labels(metric.labels, label_values)} {value}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket in zip(metric.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                le = _labels(metric.labels, label_values, [("le", bound)])
+                lines.append(f"{metric.name}_bucket{le} {cumulative}")
+            lines.append(f"{metric.name}_sum{_labels(metric.labels, label_values)} {total}")
+            lines.append(f"{metric.name}_count{_labels(metric.labels, label_values)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# Пул соединений с базой данных
+db_pool_acquire_seconds = Histogram("db_pool_acquire_seconds", "Ожидание свободного соединения в пуле")
+db_pool_acquire_timeouts = Counter("db_pool_acquire_timeouts_total", "Истечения таймаута ожидания соединения")
+db_pool_in_use = Gauge("db_pool_in_use", "Занятые соединения пула")
+db_pool_size = Gauge("db_pool_size", "Открытые соединения пула")
+db_query_seconds = Histogram("db_query_seconds", "Длительность запросов к базе", labels=("query",))
+db_query_errors = Counter("db_query_errors_total", "Ошибки запросов к базе", labels=("query",))
+
+# Фоновая очистка броней
+bookings_archived = Counter("bookings_archived_total", "Брони, перенесённые в историю", labels=("outcome",))
+
+# Входящие обновления
+updates_dropped = Counter("updates_dropped_total", "Отброшенные обновления", labels=("reason",))
+
+# Исходящие запросы к Bot API
+send_queue_wait_seconds = Histogram("send_queue_wait_seconds", "Ожидание общего лимита отправки")
+send_retry_after = Counter("send_retry_after_total", "Повторы после ответа 429")
+send_merged = Counter("send_merged_total", "Сообщения, склеенные с предыдущим")
+
+# Бронирование
+bookings_reserved = Counter("bookings_total", "Попытки бронирования по исходу", labels=("status",))
+
+# Обработка обновлений
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+handler_seconds = Histogram("handler_seconds", "Длительность обработки обновления", labels=("handler",))
+updates_total = Counter("updates_total", "Обработанные обновления", labels=("handler", "status"))
+update_db_queries = Histogram(
+    "update_db_queries", "Запросы к базе на одно обновление", labels=("handler",), buckets=QUERY_COUNT_BUCKETS
+)
+update_db_seconds = Histogram("update_db_seconds", "Время запросов к базе на одно обновление", labels=("handler",))
+
+# Напоминания о начале брони
+reminders_sent = Counter("reminders_total", "Напоминания о начале брони по исходу", labels=("status",))
+reminders_pending = Gauge("reminders_pending", "Запланированные напоминания")
+
+# Лист ожидания
+waitlist_waiting = Gauge("waitlist_waiting", "Заявки в листе ожидания")
+waitlist_offers = Counter("waitlist_offers_total", "Предложения из листа ожидания по исходу", labels=("outcome",))
@@ -0,0 +1,187 @@
+"""
+Middleware диспетчера бота.
+
+ThrottlingMiddleware ограничивает частоту обновлений от одного пользователя
+(token bucket) и отбрасывает повторные нажатия одной и той же кнопки,
+кроме кнопок-переключателей (DEDUP_EXEMPT_PREFIXES): повторное нажатие
+на бронь в списке отмены снимает с неё отметку. Повтор получает пустой
+answerCallbackQuery, чтобы у пользователя пропали «часики»; при превышении
+частоты пользователь получает подсказку подождать. До обработчиков и базы
+такие обновления не доходят.
+
+UserOrderingMiddleware выполняет обновления одного пользователя строго
+по очереди, а обновления разных пользователей — параллельно.
+
+ThrottlingMiddleware регистрируется первым внешним middleware update, до
+очереди: повтор и превышение частоты определяются по времени прихода
+обновления, а не по времени, когда до него дошла очередь пользователя.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+import config
+import metrics
+from send_queue import SendQueueMiddleware
+from tracing import setup_tracing
+
+# Сколько обновлений в секунду разрешено одному пользователю и размер пачки
+# (пачки хватает, чтобы подряд выбрать все 13 компьютеров Про-Лайна)
+THROTTLE_RATE = getattr(config, "THROTTLE_RATE", 3.0)
+THROTTLE_BURST = getattr(config, "THROTTLE_BURST", 15)
+# Повторное нажатие той же кнопки в течение стольких секунд игнорируется
+DEDUP_WINDOW = getattr(config, "DEDUP_WINDOW", 1.0)
+# Кнопки-переключатели: повторное нажатие снимает отметку, поэтому не подавляется.
+# Выбор компьютера (computer:) не переключается, и его повтор подавляется
+DEDUP_EXEMPT_PREFIXES = ("cancel:",)
+THROTTLED_TEXT = "Слишком много действий подряд, подождите пару секунд."
+# Сколько обновлений одного пользователя может ждать своей очереди
+USER_QUEUE_SIZE = getattr(config, "USER_QUEUE_SIZE", 8)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для update; ограничивает message и callback_query.
+    :param rate: Пополнение корзины токенов в секунду.
+    :param burst: Ёмкость корзины.
+    :param dedup_window: Окно подавления повторов (uid, callback data, message id).
+    """
+
+    def __init__(self, rate=THROTTLE_RATE, burst=THROTTLE_BURST, dedup_window=DEDUP_WINDOW):
+        self.rate = rate
+        self.burst = burst
+        self.dedup_window = dedup_window
+        # uid -> (токены, время обновления, предупреждён ли); в порядке последнего обращения
+        self._buckets = OrderedDict()
+        # (uid, data, message_id) -> время истечения; в порядке добавления
+        self._recent = OrderedDict()
+
+    def _evict(self, now):
+        # Корзина, простоявшая burst / rate секунд, снова полна — хранить её незачем
+        idle = self.burst / self.rate
+        while self._buckets:
+            uid, (_, updated, _) = next(iter(self._buckets.items()))
+            if now - updated < idle:
+                break
+            del self._buckets[uid]
+        while self._recent:
+            key, expires_at = next(iter(self._recent.items()))
+            if expires_at > now:
+                break
+            del self._recent[key]
+
+    def _take_token(self, uid, now):
+        """
+        :return: (разрешено ли обновление, нужно ли предупредить пользователя) —
+            предупреждение отправляется один раз за серию отброшенных обновлений.
+        """
+        tokens, updated, warned = self._buckets.pop(uid, (self.burst, now, False))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            self._buckets[uid] = (tokens - 1, now, False)
+            return True, False
+        self._buckets[uid] = (tokens, now, True)
+        return False, not warned
+
+    def _is_duplicate(self, event, now):
+        if not isinstance(event, CallbackQuery) or (event.data or "").startswith(DEDUP_EXEMPT_PREFIXES):
+            return False
+        message_id = event.message.message_id if event.message else event.inline_message_id
+        key = (event.from_user.id, event.data, message_id)
+        if key in self._recent:
+            return True
+        self._recent[key] = now + self.dedup_window
+        return False
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        inner = event.message or event.callback_query
+        if user is None or inner is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        self._evict(now)
+        if self._is_duplicate(inner, now):
+            metrics.updates_dropped.inc("duplicate")
+            if isinstance(inner, CallbackQuery):
+                await inner.answer()
+            return None
+
+        allowed, warn = self._take_token(user.id, now)
+        if allowed:
+            return await handler(event, data)
+        metrics.updates_dropped.inc("rate_limit")
+        if isinstance(inner, CallbackQuery):
+            await inner.answer(THROTTLED_TEXT if warn else None)
+        elif warn:
+            await inner.answer(THROTTLED_TEXT)
+        return None
+
+
+class _UserQueue:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        # asyncio.Lock будит ожидающих в порядке очереди
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class UserOrderingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware для update: обновления одного uid выполняются по одному
+    в порядке поступления, поэтому обработчики не гоняются за данные FSM
+    одного пользователя. Разные пользователи друг друга не ждут.
+    Если у пользователя уже max_pending обновлений в работе и в очереди,
+    новое отбрасывается (нажатие получает пустой answerCallbackQuery).
+    :param max_pending: Предел очереди одного пользователя.
+    """
+
+    def __init__(self, max_pending=USER_QUEUE_SIZE):
+        self.max_pending = max_pending
+        # uid -> очередь; запись удаляется, когда очередь пустеет
+        self._queues = {}
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        queue = self._queues.get(user.id)
+        if queue is None:
+            queue = self._queues[user.id] = _UserQueue()
+        if queue.pending >= self.max_pending:
+            metrics.updates_dropped.inc("queue_full")
+            if event.callback_query is not None:
+                await event.callback_query.answer()
+            return None
+
+        queue.pending += 1
+        try:
+            async with queue.lock:
+                return await handler(event, data)
+        finally:
+            queue.pending -= 1
+            if not queue.pending:
+                del self._queues[user.id]
+
+
+def setup_middlewares(dp, bot, send_queue=True):
+    """
+    Подключает middleware в рабочем порядке; вызывается из main.py
+    и benchmarks.load_test, чтобы нагрузочный тест мерил тот же стек.
+    :param send_queue: Подключать ли к сессии бота очередь исходящих запросов.
+    """
+    # Исходящие запросы идут через очередь с лимитами Telegram
+    if send_queue:
+        bot.session.middleware(SendQueueMiddleware())
+    # Ограничение частоты и повторных нажатий — первым, до очереди пользователя,
+    # чтобы повторное нажатие отсекалось по времени прихода
+    dp.update.outer_middleware(ThrottlingMiddleware())
+    # Время обработчиков и запросы к базе на каждое обновление
+    setup_tracing(dp)
+    # Обновления одного пользователя по очереди, разных — параллельно
+    dp.update.outer_middleware(UserOrderingMiddleware())
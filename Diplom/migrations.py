@@ -0,0 +1,240 @@
+"""
+Миграции схемы базы данных.
+
+Каждая миграция применяется один раз; номера применённых миграций
+хранятся в таблице schema_migrations. Миграции запускаются из main.main()
+до загрузки индекса занятости. Если текст миграции для MySQL и SQLite
+различается, statements — словарь {бэкенд: список запросов}.
+
+В MySQL каждый DDL-запрос фиксируется сам (неявный COMMIT), поэтому
+транзакция вокруг миграции атомарна только в SQLite. Чтобы упавшая
+на середине миграция MySQL применялась повторно, каждый её шаг
+идемпотентен: таблицы создаются с IF NOT EXISTS, а столбцы и индексы
+добавляются шагами _add_column и _create_index, только если их ещё нет.
+"""
+import logging
+
+import database
+import occupancy
+from zones import booking_computers
+
+
+# Проверки существования столбца и индекса: (таблица, имя) -> есть ли строка
+_COLUMN_EXISTS = {
+    "mysql": """
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """,
+    "sqlite": "SELECT 1 FROM pragma_table_info(%s) WHERE name = %s",
+}
+_INDEX_EXISTS = {
+    "mysql": """
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """,
+    "sqlite": "SELECT 1 FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s",
+}
+
+
+async def _exists(cursor, checks, table, name):
+    await cursor.execute(checks[database.DB_BACKEND], (table, name))
+    return bool(await cursor.fetchall())
+
+
+def _add_column(table, column, definition):
+    """Шаг миграции: ALTER TABLE table ADD COLUMN, если такого столбца ещё нет."""
+    async def step(cursor):
+        if not await _exists(cursor, _COLUMN_EXISTS, table, column):
+            await cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+def _create_index(name, table, columns):
+    """Шаг миграции: CREATE INDEX, если индекса с таким именем ещё нет."""
+    async def step(cursor):
+        if not await _exists(cursor, _INDEX_EXISTS, table, name):
+            await cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+    return step
+
+
+async def _backfill_booking_seats(cursor):
+    """Переносит номера машин из строк UserInfo.computers в booking_seats."""
+    await cursor.execute("SELECT id, booking_date, booking_time, zone, computers FROM UserInfo")
+    seats = []
+    for booking_id, booking_date, booking_time, zone, computers in await cursor.fetchall():
+        start = occupancy.slot_datetime(occupancy.slot_at(booking_date, booking_time))
+        seats.extend((booking_id, num, start) for num in booking_computers(zone, computers))
+    if seats:
+        # INSERT IGNORE: старые двойные брони одного ПК в одном слоте переносятся один раз
+        await cursor.executemany(
+            "INSERT IGNORE INTO booking_seats (booking_id, computer_id, slot_start) VALUES (%s, %s, %s)",
+            seats
+        )
+    logging.info(f"booking_seats: перенесено {len(seats)} мест")
+
+
+async def _backfill_start_slot(cursor):
+    """Заполняет UserInfo.start_slot по booking_date и booking_time."""
+    await cursor.execute("SELECT id, booking_date, booking_time FROM UserInfo")
+    rows = [
+        (occupancy.slot_at(booking_date, booking_time), booking_id)
+        for booking_id, booking_date, booking_time in await cursor.fetchall()
+    ]
+    if rows:
+        await cursor.executemany("UPDATE UserInfo SET start_slot = %s WHERE id = %s", rows)
+    logging.info(f"UserInfo.start_slot: заполнено {len(rows)} броней")
+
+
+MIGRATIONS = [
+    (
+        1,
+        "booking_seats",
+        {
+            "mysql": [
+                """
+                CREATE TABLE IF NOT EXISTS booking_seats (
+                    booking_id INT NOT NULL,
+                    computer_id TINYINT UNSIGNED NOT NULL,
+                    slot_start DATETIME NOT NULL,
+                    PRIMARY KEY (booking_id, computer_id, slot_start),
+                    UNIQUE KEY uq_booking_seats_slot (slot_start, computer_id)
+                )
+                """,
+            ],
+            "sqlite": [
+                """
+                CREATE TABLE IF NOT EXISTS booking_seats (
+                    booking_id INTEGER NOT NULL REFERENCES UserInfo (id) ON DELETE CASCADE,
+                    computer_id TINYINT UNSIGNED NOT NULL,
+                    slot_start DATETIME NOT NULL,
+                    PRIMARY KEY (booking_id, computer_id, slot_start),
+                    CONSTRAINT uq_booking_seats_slot UNIQUE (slot_start, computer_id)
+                )
+                """,
+            ],
+        },
+        _backfill_booking_seats,
+    ),
+    (
+        2,
+        "booking_history",
+        {
+            "mysql": [
+                _add_column("UserInfo", "checked_in_at", "DATETIME NULL"),
+                _create_index("idx_userinfo_booking_date", "UserInfo", "booking_date, booking_time"),
+                "CREATE TABLE IF NOT EXISTS UserInfo_history LIKE UserInfo",
+                _add_column("UserInfo_history", "outcome", "VARCHAR(16) NOT NULL DEFAULT 'finished'"),
+                _add_column("UserInfo_history", "archived_at", "DATETIME NULL"),
+            ],
+            # В SQLite нет CREATE TABLE ... LIKE и нескольких ADD COLUMN в одном ALTER
+            "sqlite": [
+                _add_column("UserInfo", "checked_in_at", "DATETIME NULL"),
+                _create_index("idx_userinfo_booking_date", "UserInfo", "booking_date, booking_time"),
+                """
+                CREATE TABLE IF NOT EXISTS UserInfo_history (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    nickname VARCHAR(64),
+                    phone VARCHAR(20),
+                    zone VARCHAR(16) NOT NULL,
+                    computer_count TINYINT UNSIGNED,
+                    booking_date DATE NOT NULL,
+                    booking_time TIME NOT NULL,
+                    computers VARCHAR(255),
+                    checked_in_at DATETIME NULL,
+                    outcome VARCHAR(16) NOT NULL DEFAULT 'finished',
+                    archived_at DATETIME NULL
+                )
+                """,
+            ],
+        },
+        None,
+    ),
+    (
+        3,
+        "booking_duration",
+        [
+            _add_column("UserInfo", "duration_minutes", "SMALLINT UNSIGNED NOT NULL DEFAULT 30"),
+            _add_column("UserInfo_history", "duration_minutes", "SMALLINT UNSIGNED NOT NULL DEFAULT 30"),
+        ],
+        None,
+    ),
+    (
+        4,
+        "booking_user_index",
+        [
+            # Список и отмена броней пользователя (WHERE user_id = ... ORDER BY booking_date)
+            _create_index("idx_userinfo_user_date", "UserInfo", "user_id, booking_date"),
+        ],
+        None,
+    ),
+    (
+        5,
+        "booking_start_slot",
+        [
+            # Начало брони — номер получасового слота от 1970-01-01 (occupancy.slot_at)
+            _add_column("UserInfo", "start_slot", "INT NULL"),
+            _add_column("UserInfo_history", "start_slot", "INT NULL"),
+            # Диапазоны по start_slot: upcoming_reminders, finished_booking_ids, no_show_booking_ids.
+            # booking_seats.slot_start остаётся DATETIME: по ключу (slot_start, computer_id)
+            # идут диапазонные busy_computers и load_occupancy_index, и он же не даёт двойных броней
+            _create_index("idx_userinfo_start_slot", "UserInfo", "start_slot"),
+        ],
+        _backfill_start_slot,
+    ),
+    (
+        6,
+        "booking_reminders",
+        [
+            # Когда отправлено напоминание о начале брони (reminders)
+            _add_column("UserInfo", "reminder_sent_at", "DATETIME NULL"),
+            _add_column("UserInfo_history", "reminder_sent_at", "DATETIME NULL"),
+        ],
+        None,
+    ),
+]
+
+
+async def apply_migrations():
+    """
+    Применяет все ещё не применённые миграции по порядку. Запросы миграции
+    выполняются в транзакции, но в MySQL она охватывает только заполнение
+    данных и запись в schema_migrations: DDL фиксируется сразу, и при
+    повторном запуске уже выполненные шаги пропускаются проверками.
+    """
+    async with database.acquire_connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    name VARCHAR(64) NOT NULL,
+                    applied_at DATETIME NOT NULL
+                )
+            """)
+            await cursor.execute("SELECT version FROM schema_migrations")
+            applied = {version for (version,) in await cursor.fetchall()}
+
+            for version, name, statements, backfill in MIGRATIONS:
+                if version in applied:
+                    continue
+                if isinstance(statements, dict):
+                    statements = statements[database.DB_BACKEND]
+                logging.info(f"Применение миграции {version}: {name}")
+                await conn.begin()
+                try:
+                    for statement in statements:
+                        if callable(statement):
+                            await statement(cursor)
+                        else:
+                            await cursor.execute(statement)
+                    if backfill:
+                        await backfill(cursor)
+                    await cursor.execute(
+                        "INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, NOW())",
+                        (version, name)
+                    )
+                    await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    logging.exception(f"Ошибка применения миграции {version}: {name}")
+                    raise
@@ -0,0 +1,228 @@
+"""
+Индекс занятости машин в памяти.
+
+Время во всём боте представлено номером слота: целым числом получасовых
+слотов от 1970-01-01 00:00 (местное время без часового пояса). Номер
+слота передаётся в callback data, хранится в FSM и в колонке
+UserInfo.start_slot; в дату и время он переводится только для показа
+пользователю (utils.format_slot) и для колонок DATETIME.
+
+Индекс — словарь {номер слота: битовая маска}. Бит (n - 1) выставлен,
+если компьютер n занят в этом слоте. Индекс строится из booking_seats
+при запуске и обновляется при сохранении и удалении броней, поэтому
+проверка доступности не обращается к базе.
+
+Бронь длительностью minutes занимает слоты [slot, slot + slot_count(minutes)),
+полночь для номера слота ничем не отличается от других границ.
+Проверка пересечения стоит O(число слотов интервала) и не зависит от
+количества броней. Поиск свободного времени (find_slots) работает с
+масками целиком: свободные машины слота — одна операция над целым, серия
+соседних машин — сдвиги и AND.
+"""
+from datetime import date, datetime, time, timedelta
+
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+EPOCH = datetime(1970, 1, 1)
+_SLOT = timedelta(minutes=SLOT_MINUTES)
+
+_index = {}
+
+
+def to_date(value):
+    """Приводит дату из 'DD.MM.YYYY', 'YYYY-MM-DD' или date к объекту date."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    for fmt in ("%d.%m.%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Некорректная дата: {value}")
+
+
+def _minutes_of_day(value):
+    """Минуты от начала суток для 'HH:MM', time или timedelta (так aiomysql отдаёт TIME)."""
+    if isinstance(value, timedelta):
+        return int(value.total_seconds()) // 60
+    if isinstance(value, time):
+        return value.hour * 60 + value.minute
+    hours, minutes = str(value).split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def slot_at(moment, booking_time=None):
+    """
+    Номер слота, в который попадает момент времени.
+    :param moment: datetime или дата (date, 'DD.MM.YYYY', 'YYYY-MM-DD').
+    :param booking_time: Время суток для даты ('HH:MM', time, timedelta);
+        без него — начало суток.
+    """
+    if isinstance(moment, datetime):
+        return (moment - EPOCH) // _SLOT
+    day = (to_date(moment) - EPOCH.date()).days * SLOTS_PER_DAY
+    if booking_time is None:
+        return day
+    return day + _minutes_of_day(booking_time) // SLOT_MINUTES
+
+
+def day_slot(slot):
+    """Первый слот суток, в которые попадает slot."""
+    return slot - slot % SLOTS_PER_DAY
+
+
+def slot_datetime(slot):
+    """Начало слота как datetime (значение колонки booking_seats.slot_start)."""
+    return EPOCH + slot * _SLOT
+
+
+def slot_count(minutes):
+    """Сколько слотов покрывает интервал длиной minutes."""
+    return max(1, -(-int(minutes) // SLOT_MINUTES))
+
+
+def slot_starts(slot, minutes=SLOT_MINUTES):
+    """Начала всех слотов интервала брони (строки booking_seats)."""
+    start = slot_datetime(slot)
+    return [start + _SLOT * i for i in range(slot_count(minutes))]
+
+
+def computer_mask(computer_ids):
+    mask = 0
+    for num in computer_ids:
+        mask |= 1 << (int(num) - 1)
+    return mask
+
+
+def occupy(slot, computer_ids, minutes=SLOT_MINUTES):
+    mask = computer_mask(computer_ids)
+    for current in range(slot, slot + slot_count(minutes)):
+        _index[current] = _index.get(current, 0) | mask
+
+
+def release(slot, computer_ids, minutes=SLOT_MINUTES):
+    mask = computer_mask(computer_ids)
+    for current in range(slot, slot + slot_count(minutes)):
+        left = _index.get(current, 0) & ~mask
+        if left:
+            _index[current] = left
+        else:
+            _index.pop(current, None)
+
+
+def occupied_mask(slot, minutes=SLOT_MINUTES):
+    """Компьютеры, занятые хотя бы в одном слоте интервала."""
+    mask = 0
+    for current in range(slot, slot + slot_count(minutes)):
+        mask |= _index.get(current, 0)
+    return mask
+
+
+def occupied_computers(slot, computer_ids, minutes=SLOT_MINUTES):
+    """Номера компьютеров из computer_ids, уже занятых в интервале."""
+    mask = occupied_mask(slot, minutes)
+    return sorted(int(num) for num in computer_ids if mask >> (int(num) - 1) & 1)
+
+
+def is_free(slot, computer_ids, minutes=SLOT_MINUTES):
+    return occupied_mask(slot, minutes) & computer_mask(computer_ids) == 0
+
+
+def free_slots_from(slot, computer_ids, limit):
+    """Сколько слотов подряд, начиная со slot, свободны все computer_ids (не больше limit)."""
+    mask = computer_mask(computer_ids)
+    for count in range(limit):
+        if _index.get(slot + count, 0) & mask:
+            return count
+    return limit
+
+
+def busy_slots(first_slot, computer_ids):
+    """
+    Битовая маска слотов суток, начинающихся с first_slot, в которых занят
+    хотя бы один из computer_ids. Бит i соответствует слоту first_slot + i.
+    """
+    mask = computer_mask(computer_ids)
+    busy = 0
+    for i in range(SLOTS_PER_DAY):
+        if _index.get(first_slot + i, 0) & mask:
+            busy |= 1 << i
+    return busy
+
+
+def _window_masks(first_slot, last_slot, slots):
+    """
+    Для каждого старта в [first_slot, last_slot) — маска машин, занятых хотя
+    бы в одном из slots слотов начиная с него. Окна собираются удвоением:
+    OR соседних масок покрывает вдвое больше слотов, поэтому на длинное
+    окно уходит O(log slots) проходов по списку, а не slots.
+    """
+    masks = [_index.get(slot, 0) for slot in range(first_slot, last_slot + slots - 1)]
+    span = 1
+    while span < slots:
+        step = min(span, slots - span)
+        masks = [a | b for a, b in zip(masks, masks[step:])]
+        span += step
+    return masks
+
+
+def _zone_bits(mask, computer_ids):
+    """Биты mask в порядке computer_ids: бит i — компьютер computer_ids[i]."""
+    if isinstance(computer_ids, range) and computer_ids.step == 1:
+        return mask >> (computer_ids.start - 1) & ((1 << len(computer_ids)) - 1)
+    bits = 0
+    for i, num in enumerate(computer_ids):
+        bits |= (mask >> (num - 1) & 1) << i
+    return bits
+
+
+def _first_run(bits, count):
+    """Младший бит первой серии из count единиц подряд или -1."""
+    runs = bits
+    for shift in range(1, count):
+        runs &= bits >> shift
+    return (runs & -runs).bit_length() - 1
+
+
+def find_slots(computer_ids, count, minutes, first_slot, last_slot, adjacent=False, limit=5):
+    """
+    Самые ранние старты в [first_slot, last_slot), когда свободны count машин
+    из computer_ids на minutes минут.
+    :param computer_ids: Компьютеры зоны в порядке zone_computer_mapping.
+    :param adjacent: Машины должны идти подряд в порядке computer_ids.
+    :return: Список (номер слота, номера компьютеров), не длиннее limit.
+    """
+    if last_slot <= first_slot or count > len(computer_ids):
+        return []
+    found = []
+    for offset, busy in enumerate(_window_masks(first_slot, last_slot, slot_count(minutes))):
+        free = ~_zone_bits(busy, computer_ids) & ((1 << len(computer_ids)) - 1)
+        if adjacent:
+            start = _first_run(free, count)
+            if start < 0:
+                continue
+            positions = range(start, start + count)
+        else:
+            if free.bit_count() < count:
+                continue
+            positions = []
+            while len(positions) < count:
+                positions.append((free & -free).bit_length() - 1)
+                free &= free - 1
+        found.append((first_slot + offset, [computer_ids[i] for i in positions]))
+        if len(found) >= limit:
+            break
+    return found
+
+
+def prune(before=None):
+    """Удаляет из индекса прошедшие сутки, чтобы он не рос бесконечно."""
+    before = slot_at(date.today()) if before is None else before
+    for slot in [slot for slot in _index if slot < before]:
+        del _index[slot]
+
+
+def clear():
+    _index.clear()
@@ -0,0 +1,216 @@
+"""
+Реестр именованных SQL-запросов и типы строк результата.
+
+Текст каждого запроса нормализуется один раз при импорте, а варианты
+со списком IN (...) разной длины собираются один раз и кэшируются.
+aiomysql не поддерживает серверные prepared statements, поэтому запросы
+подготавливаются на стороне клиента. Строки результата превращаются в
+dataclass-объекты со __slots__ вместо кортежей.
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+IN_LIST = "{in_list}"
+
+
+@dataclass(frozen=True, slots=True)
+class BookingRow:
+    id: int
+    start_slot: int
+    zone: str
+    computers: Optional[str]
+    duration_minutes: int
+
+
+@dataclass(frozen=True, slots=True)
+class UserRow:
+    nickname: str
+    phone: str
+
+
+@dataclass(frozen=True, slots=True)
+class SeatRow:
+    slot_start: datetime
+    computer_id: int
+
+
+@dataclass(frozen=True, slots=True)
+class BookedSeatRow:
+    booking_id: int
+    slot_start: datetime
+    computer_id: int
+
+
+@dataclass(frozen=True, slots=True)
+class ReminderRow:
+    id: int
+    user_id: int
+    start_slot: int
+    zone: str
+    computers: Optional[str]
+
+
+@dataclass(frozen=True, slots=True)
+class IdRow:
+    id: int
+
+
+@dataclass(frozen=True, slots=True)
+class ComputerRow:
+    computer_id: int
+
+
+class Query:
+    """
+    Именованный запрос.
+    :param name: Имя для метрик и логов.
+    :param sql: Текст запроса; {in_list} заменяется на нужное число плейсхолдеров.
+    :param row_type: Тип строки результата (None для запросов без результата).
+    """
+
+    __slots__ = ("name", "sql", "row_type")
+
+    def __init__(self, name, sql, row_type=None):
+        self.name = name
+        self.sql = re.sub(r"\s+", " ", sql).strip()
+        self.row_type = row_type
+
+    def render(self, in_size=None):
+        if in_size is None:
+            return self.sql
+        return _render_in_list(self.sql, in_size)
+
+    def decode(self, rows):
+        return [self.row_type(*row) for row in rows]
+
+
+@lru_cache(maxsize=256)
+def _render_in_list(sql, size):
+    return sql.replace(IN_LIST, ",".join(["%s"] * size))
+
+
+def _seats_of_bookings(where, lock=False):
+    """
+    Места броней по условию where.
+    :param lock: FOR UPDATE — внутри транзакции удаления строки блокируются,
+        и освобождаются ровно те места, которые транзакция удалила.
+    """
+    return f"""
+        SELECT booking_seats.booking_id, booking_seats.slot_start, booking_seats.computer_id
+        FROM UserInfo
+        JOIN booking_seats ON booking_seats.booking_id = UserInfo.id
+        WHERE {where}
+        {"FOR UPDATE" if lock else ""}
+    """
+
+
+def _delete_bookings(where):
+    return f"""
+        DELETE UserInfo, booking_seats
+        FROM UserInfo
+        LEFT JOIN booking_seats ON booking_seats.booking_id = UserInfo.id
+        WHERE {where}
+    """
+
+
+_BOOKING_COLUMNS = "SELECT id, start_slot, zone, computers, duration_minutes FROM UserInfo"
+_ARCHIVE_COLUMNS = (
+    "id, user_id, nickname, phone, zone, computer_count, booking_date, booking_time, computers, checked_in_at,"
+    " duration_minutes, start_slot, reminder_sent_at"
+)
+
+QUERIES = {query.name: query for query in [
+    Query("fetch_user_bookings", f"{_BOOKING_COLUMNS} WHERE phone = %s AND nickname = %s", BookingRow),
+    # По индексу idx_userinfo_user_date
+    Query("fetch_user_bookings_by_uid", f"""
+        {_BOOKING_COLUMNS} WHERE user_id = %s
+        ORDER BY booking_date, booking_time
+    """, BookingRow),
+    Query("load_user", "SELECT nickname, phone FROM Users WHERE user_id = %s", UserRow),
+    Query("register_user", """
+        INSERT INTO Users (user_id, phone, nickname, registration_date)
+        VALUES (%s, %s, %s, NOW())
+    """),
+    Query("load_occupancy_index", """
+        SELECT slot_start, computer_id
+        FROM booking_seats
+        WHERE slot_start >= CURDATE()
+    """, SeatRow),
+    Query("seats_by_booking_id", _seats_of_bookings("UserInfo.id = %s", lock=True), BookedSeatRow),
+    Query("seats_by_uid", _seats_of_bookings("UserInfo.user_id = %s", lock=True), BookedSeatRow),
+    Query("seats_by_contact", _seats_of_bookings(
+        "UserInfo.phone = %s AND UserInfo.nickname = %s", lock=True
+    ), BookedSeatRow),
+    Query("delete_booking_by_id", _delete_bookings("UserInfo.id = %s")),
+    Query("delete_bookings_by_uid", _delete_bookings("UserInfo.user_id = %s")),
+    Query("delete_bookings_by_contact", _delete_bookings("UserInfo.phone = %s AND UserInfo.nickname = %s")),
+    # user_id в условии не даёт удалить чужую бронь по подменённому id
+    Query("seats_by_user_booking_ids", _seats_of_bookings(
+        "UserInfo.id IN ({in_list}) AND UserInfo.user_id = %s", lock=True
+    ), BookedSeatRow),
+    Query("delete_user_bookings_by_ids", _delete_bookings("UserInfo.id IN ({in_list}) AND UserInfo.user_id = %s")),
+    Query("insert_console_booking", """
+        INSERT INTO UserInfo (
+            user_id, nickname, phone, zone, booking_date, booking_time, duration_minutes, start_slot
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """),
+    Query("insert_computer_booking", """
+        INSERT INTO UserInfo (
+            user_id, nickname, phone, zone, computer_count, booking_date, booking_time, computers,
+            duration_minutes, start_slot
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """),
+    Query("insert_booking_seats", """
+        INSERT INTO booking_seats (booking_id, computer_id, slot_start)
+        VALUES (%s, %s, %s)
+    """),
+    Query("mark_checked_in", "UPDATE UserInfo SET checked_in_at = NOW() WHERE id = %s"),
+    # Брони, которые ещё не начались и о которых не напоминали (по idx_userinfo_start_slot)
+    Query("upcoming_reminders", """
+        SELECT id, user_id, start_slot, zone, computers FROM UserInfo
+        WHERE start_slot > %s AND reminder_sent_at IS NULL
+        ORDER BY start_slot
+    """, ReminderRow),
+    # Условие на reminder_sent_at: напоминание отправляет только тот, кто его отметил
+    Query("claim_reminder", "UPDATE UserInfo SET reminder_sent_at = NOW() WHERE id = %s AND reminder_sent_at IS NULL"),
+    # Параметр — момент отсечки в слотах (дробное число). Диапазон по индексу
+    # idx_userinfo_start_slot, затем точное сравнение окончания внутри него
+    Query("finished_booking_ids", """
+        SELECT id FROM UserInfo
+        WHERE start_slot < %s AND start_slot + duration_minutes / 30.0 <= %s
+        ORDER BY start_slot
+        LIMIT %s
+    """, IdRow),
+    Query("no_show_booking_ids", """
+        SELECT id FROM UserInfo
+        WHERE start_slot < %s AND checked_in_at IS NULL
+        ORDER BY start_slot
+        LIMIT %s
+    """, IdRow),
+    Query("archive_bookings", f"""
+        INSERT INTO UserInfo_history ({_ARCHIVE_COLUMNS}, outcome, archived_at)
+        SELECT {_ARCHIVE_COLUMNS}, %s, NOW() FROM UserInfo
+        WHERE id IN ({{in_list}})
+    """),
+    Query("seats_by_booking_ids", _seats_of_bookings("UserInfo.id IN ({in_list})", lock=True), BookedSeatRow),
+    Query("delete_bookings_by_ids", _delete_bookings("UserInfo.id IN ({in_list})")),
+    # Бронь пользователя, занявшая место (по уникальному ключу (slot_start, computer_id)):
+    # сверка после обрыва связи во время COMMIT в reserve_booking
+    Query("user_booking_at_seat", """
+        SELECT UserInfo.id, UserInfo.start_slot, UserInfo.zone, UserInfo.computers, UserInfo.duration_minutes
+        FROM UserInfo
+        JOIN booking_seats ON booking_seats.booking_id = UserInfo.id
+        WHERE booking_seats.slot_start = %s AND booking_seats.computer_id = %s
+          AND UserInfo.user_id = %s AND UserInfo.start_slot = %s
+    """, BookingRow),
+    # Диапазон по уникальному ключу (slot_start, computer_id)
+    Query("busy_computers", """
+        SELECT DISTINCT computer_id FROM booking_seats
+        WHERE slot_start >= %s AND slot_start < %s AND computer_id IN ({in_list})
+    """, ComputerRow),
+]}
@@ -0,0 +1,176 @@
+"""
+Напоминания о начале брони.
+
+Предстоящие брони без отправленного напоминания читаются из базы один раз
+при запуске (load_reminders) и складываются в min-кучу по сроку
+напоминания — за REMINDER_MINUTES до начала. Фоновая задача спит до
+ближайшего срока и между сроками не обращается ни к базе, ни к куче.
+Новые и снятые брони приходят из database через booking_saved_listeners
+и booking_released_listeners; снятая бронь только вычёркивается из
+словаря запланированных, а её запись в куче пропускается, когда до неё
+дойдёт очередь.
+
+Перед отправкой бронь отмечается в UserInfo.reminder_sent_at условным
+UPDATE (database.claim_reminder): после перезапуска отмеченные брони не
+загружаются, а если бронь успели удалить или напоминание уже отправил
+другой экземпляр бота, отметка не проходит и сообщение не уходит.
+"""
+import asyncio
+import heapq
+import logging
+from contextlib import suppress
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramAPIError
+
+import config
+import database
+import metrics
+import occupancy
+from send_queue import post
+from utils import format_slot
+from zones import booking_computers, console_zones, full_zone_names
+
+# За сколько минут до начала брони напоминать (None — не напоминать)
+REMINDER_MINUTES = getattr(config, "REMINDER_MINUTES", 30)
+# Через сколько секунд повторить напоминание, если база была недоступна
+REMINDER_RETRY_SECONDS = getattr(config, "REMINDER_RETRY_SECONDS", 60)
+
+# Куча (срок, id брони) и запланированные напоминания {id брони: (срок, uid, бронь)}.
+# Запись кучи действительна, пока её срок совпадает со сроком в _pending
+_heap = []
+_pending = {}
+_wakeup = asyncio.Event()
+_task = None
+
+
+def _schedule(booking_id, due, uid, booking):
+    _pending[booking_id] = (due, uid, booking)
+    heapq.heappush(_heap, (due, booking_id))
+    metrics.reminders_pending.set(len(_pending))
+    if _heap[0][1] == booking_id:
+        # Новый срок раньше того, до которого спит задача
+        _wakeup.set()
+
+
+def schedule(uid, booking):
+    """
+    Планирует напоминание о брони (queries.BookingRow или ReminderRow).
+    Брони, которые уже начались, пропускаются.
+    """
+    if REMINDER_MINUTES is None:
+        return
+    start = occupancy.slot_datetime(booking.start_slot)
+    if start <= datetime.now():
+        return
+    _schedule(booking.id, start - timedelta(minutes=REMINDER_MINUTES), uid, booking)
+
+
+def unschedule(booking_ids, seats=()):
+    """Снимает напоминания об удалённых бронях."""
+    for booking_id in booking_ids:
+        _pending.pop(booking_id, None)
+    metrics.reminders_pending.set(len(_pending))
+    # Снятые записи остаются в куче до своего срока; если их накопилось
+    # больше, чем действующих, куча пересобирается
+    if len(_heap) > 2 * len(_pending) + 64:
+        _heap[:] = [(due, booking_id) for booking_id, (due, _, _) in _pending.items()]
+        heapq.heapify(_heap)
+
+
+database.booking_saved_listeners.append(schedule)
+database.booking_released_listeners.append(unschedule)
+
+
+async def load_reminders():
+    """Загружает из базы брони, о которых ещё предстоит напомнить. Вызывается при запуске."""
+    if REMINDER_MINUTES is None:
+        return
+    rows = await database.fetch_upcoming_reminders(occupancy.slot_at(datetime.now()))
+    for row in rows:
+        schedule(row.user_id, row)
+    logging.info(f"Напоминания загружены: {len(_pending)}")
+
+
+def _pop_due(now):
+    """Снимает с кучи наступившие напоминания; возвращает их и срок следующего."""
+    due_now = []
+    while _heap:
+        due, booking_id = _heap[0]
+        entry = _pending.get(booking_id)
+        if entry is None or entry[0] != due:
+            heapq.heappop(_heap)
+            continue
+        if due > now:
+            return due_now, due
+        heapq.heappop(_heap)
+        del _pending[booking_id]
+        due_now.append((booking_id, entry))
+    return due_now, None
+
+
+def _reminder_text(booking, minutes_left):
+    text = (
+        f"⏰ Ваша бронь №{booking.id} начнётся через {minutes_left} мин: "
+        f"{format_slot(booking.start_slot, '%H:%M %d.%m.%Y')}, {full_zone_names.get(booking.zone, booking.zone)}"
+    )
+    if booking.zone not in console_zones:
+        text += f", ПК: {', '.join(map(str, booking_computers(booking.zone, booking.computers)))}"
+    # По номеру брони администратор отмечает приход (/checkin)
+    return text + ".\nНазовите номер брони администратору, когда придёте."
+
+
+async def _remind(bot, booking_id, uid, booking):
+    start = occupancy.slot_datetime(booking.start_slot)
+    try:
+        claimed = await database.claim_reminder(booking_id)
+    except database.DatabaseError as e:
+        logging.error(f"Не удалось отметить напоминание о брони {booking_id}: {e}")
+        retry_at = datetime.now() + timedelta(seconds=REMINDER_RETRY_SECONDS)
+        if retry_at < start:
+            _schedule(booking_id, retry_at, uid, booking)
+        metrics.reminders_sent.inc("retry")
+        return
+    if not claimed:
+        metrics.reminders_sent.inc("skipped")
+        return
+
+    minutes_left = max(1, round((start - datetime.now()).total_seconds() / 60))
+    try:
+        await bot.send_message(uid, _reminder_text(booking, minutes_left))
+    except TelegramAPIError as e:
+        logging.warning(f"Не удалось отправить напоминание пользователю {uid}: {e}")
+        metrics.reminders_sent.inc("failed")
+        return
+    metrics.reminders_sent.inc("sent")
+
+
+async def _run(bot):
+    while True:
+        now = datetime.now()
+        due_now, next_due = _pop_due(now)
+        metrics.reminders_pending.set(len(_pending))
+        for booking_id, (_, uid, booking) in due_now:
+            # Отправка идёт через очередь send_queue и не задерживает следующие сроки
+            post(_remind(bot, booking_id, uid, booking))
+        _wakeup.clear()
+        timeout = None if next_due is None else (next_due - now).total_seconds()
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(_wakeup.wait(), timeout)
+
+
+def start_reminders(bot):
+    """Запускает отправку напоминаний в текущем цикле событий."""
+    global _task
+    if _task is None and REMINDER_MINUTES is not None:
+        _task = asyncio.create_task(_run(bot), name="booking-reminders")
+    return _task
+
+
+async def stop_reminders():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        with suppress(asyncio.CancelledError):
+            await _task
+        _task = None
@@ -0,0 +1,292 @@
+"""
+Очередь исходящих запросов к Bot API с учётом лимитов Telegram.
+
+SendQueueMiddleware подключается к сессии бота (bot.session.middleware)
+и пропускает через себя все запросы с chat_id:
+
+* запросы в один чат уходят по одному и в порядке вызова, не чаще
+  SEND_PER_CHAT_RATE в секунду (с запасом SEND_PER_CHAT_BURST);
+* все чаты вместе ограничены SEND_GLOBAL_RATE в секунду; при нехватке
+  лимита первыми уходят запросы с более высоким приоритетом (send_priority);
+* на 429 (TelegramRetryAfter) чат ставится на паузу на retry_after секунд
+  и запрос повторяется до SEND_RETRIES раз;
+* идущие подряд текстовые сообщения в один чат, которые ещё ждут отправки,
+  склеиваются в одно (сообщение с клавиатурой может быть только последним).
+
+Запросы без chat_id (answerCallbackQuery, setWebhook и т.п.) идут сразу.
+Для сообщений, результат которых не нужен, есть post(): он ставит запрос
+в очередь и не ждёт отправки.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+import config
+import metrics
+
+# Лимиты Telegram: около 30 сообщений в секунду всего и 1 в секунду в один чат
+SEND_GLOBAL_RATE = getattr(config, "SEND_GLOBAL_RATE", 30)
+SEND_PER_CHAT_RATE = getattr(config, "SEND_PER_CHAT_RATE", 1)
+SEND_PER_CHAT_BURST = getattr(config, "SEND_PER_CHAT_BURST", 3)
+# Сколько раз повторять запрос после 429
+SEND_RETRIES = getattr(config, "SEND_RETRIES", 3)
+# Склеивать ли ожидающие сообщения в один чат
+SEND_MERGE_MESSAGES = getattr(config, "SEND_MERGE_MESSAGES", True)
+
+MESSAGE_LIMIT = 4096
+MERGE_SEPARATOR = "\n\n"
+
+# Приоритеты: меньше — важнее
+HIGH, NORMAL, LOW = 0, 1, 2
+
+send_priority = ContextVar("send_priority", default=NORMAL)
+
+_seq = itertools.count()
+_background = set()
+
+
+@contextmanager
+def priority(level):
+    """Задаёт приоритет запросов к Bot API внутри блока with."""
+    token = send_priority.set(level)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+def post(request):
+    """
+    Отправляет запрос (например, message.answer(...)) без ожидания результата.
+    Ошибка отправки только пишется в лог.
+    """
+    task = asyncio.ensure_future(request)
+    _background.add(task)
+    task.add_done_callback(_on_posted)
+    return task
+
+
+def _on_posted(task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Ошибка фоновой отправки: {task.exception()}")
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше burst."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Через сколько секунд появится токен (0 — уже есть)."""
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.paused_until
+
+
+class PriorityLimiter:
+    """Общий лимит: ожидающие получают токены в порядке (приоритет, очередь)."""
+
+    def __init__(self, rate, burst=None):
+        self.bucket = TokenBucket(rate, burst or rate)
+        self._waiters = []
+        self._dispatcher = None
+
+    async def acquire(self, level):
+        if not self._waiters and self.bucket.delay(time.monotonic()) == 0:
+            self.bucket.take()
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (level, next(_seq), waiter))
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await waiter
+
+    async def _dispatch(self):
+        try:
+            while self._waiters:
+                wait = self.bucket.delay(time.monotonic())
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                _, _, waiter = heapq.heappop(self._waiters)
+                if waiter.done():  # ожидающий отменён
+                    continue
+                self.bucket.take()
+                waiter.set_result(None)
+        finally:
+            self._dispatcher = None
+
+
+class _Job:
+    __slots__ = ("method", "waiter", "merged", "result", "error")
+
+    def __init__(self, method):
+        self.method = method
+        self.waiter = asyncio.get_running_loop().create_future()
+        self.merged = False
+        self.result = None
+        self.error = None
+
+
+def _mergeable(first, second):
+    if type(first) is not SendMessage or type(second) is not SendMessage:
+        return False
+    if first.reply_markup is not None or first.entities or second.entities:
+        return False
+    if len(first.text) + len(MERGE_SEPARATOR) + len(second.text) > MESSAGE_LIMIT:
+        return False
+    exclude = {"text", "reply_markup"}
+    return first.model_dump(exclude=exclude) == second.model_dump(exclude=exclude)
+
+
+class SendQueueMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота, выстраивающий запросы в очередь по чатам."""
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, per_chat_rate=SEND_PER_CHAT_RATE,
+                 per_chat_burst=SEND_PER_CHAT_BURST, retries=SEND_RETRIES, merge=SEND_MERGE_MESSAGES):
+        self.limiter = PriorityLimiter(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.retries = retries
+        self.merge = merge
+        # chat_id -> очередь ожидающих запросов
+        self._queues = {}
+        # chat_id -> корзина токенов; в порядке последнего обращения
+        self._buckets = OrderedDict()
+
+    def _bucket(self, chat_id):
+        now = time.monotonic()
+        while self._buckets:
+            oldest, bucket = next(iter(self._buckets.items()))
+            if oldest in self._queues or not bucket.idle(now):
+                break
+            del self._buckets[oldest]
+        bucket = self._buckets.pop(chat_id, None) or TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        self._buckets[chat_id] = bucket
+        return bucket
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        queue = self._queues.setdefault(chat_id, deque())
+        job = _Job(method)
+        queue.append(job)
+        if len(queue) > 1:
+            try:
+                await job.waiter
+            except asyncio.CancelledError:
+                self._leave(chat_id, job)
+                raise
+            if job.merged:
+                if job.error is not None:
+                    raise job.error
+                return job.result
+
+        merged = []
+        try:
+            response = await self._send(make_request, bot, queue, merged, chat_id)
+        except Exception as e:
+            for other in merged:
+                other.error = e
+            raise
+        else:
+            for other in merged:
+                other.result = response
+            return response
+        finally:
+            for other in merged:
+                if not other.waiter.done():
+                    other.waiter.set_result(None)
+            self._leave(chat_id, job)
+
+    def _absorb(self, queue, merged):
+        """Склеивает с головой очереди идущие за ней текстовые сообщения."""
+        head = queue[0]
+        count = len(merged)
+        while len(queue) > 1 and _mergeable(head.method, queue[1].method):
+            other = queue[1]
+            del queue[1]
+            head.method = head.method.model_copy(update={
+                "text": head.method.text + MERGE_SEPARATOR + other.method.text,
+                "reply_markup": other.method.reply_markup,
+            })
+            other.merged = True
+            merged.append(other)
+        if len(merged) > count:
+            metrics.send_merged.inc(amount=len(merged) - count)
+
+    def _leave(self, chat_id, job):
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            return
+        was_head = queue[0] is job
+        try:
+            queue.remove(job)
+        except ValueError:
+            return
+        if not queue:
+            del self._queues[chat_id]
+        elif was_head and not queue[0].waiter.done():
+            # Если следующий запрос уже отменён, он сам передаст очередь дальше
+            queue[0].waiter.set_result(None)
+
+    async def _send(self, make_request, bot, queue, merged, chat_id):
+        job = queue[0]
+        bucket = self._bucket(chat_id)
+        level = send_priority.get()
+        for attempt in range(self.retries + 1):
+            wait = bucket.delay(time.monotonic())
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = bucket.delay(time.monotonic())
+            bucket.take()
+            started = time.monotonic()
+            await self.limiter.acquire(level)
+            metrics.send_queue_wait_seconds.observe(time.monotonic() - started)
+            # Склеиваем непосредственно перед отправкой: за время ожидания
+            # лимита в очереди могли накопиться следующие сообщения
+            if self.merge:
+                self._absorb(queue, merged)
+            try:
+                return await make_request(bot, job.method)
+            except TelegramRetryAfter as e:
+                if attempt == self.retries:
+                    raise
+                metrics.send_retry_after.inc()
+                logging.warning(f"Flood control для чата {chat_id}: пауза {e.retry_after} с")
+                bucket.pause(e.retry_after)
@@ -0,0 +1,244 @@
+"""
+Встраиваемый бэкенд базы данных на SQLite (aiosqlite).
+
+SqlitePool повторяет ту часть интерфейса aiomysql.Pool, которой пользуется
+database: acquire/release, size/freesize, соединения с cursor/begin/commit/
+rollback/ping и курсоры с execute/executemany/fetchall/rowcount/lastrowid.
+Запросы из queries.QUERIES и миграций написаны для MySQL; курсор один раз
+переводит текст каждого запроса в диалект SQLite (плейсхолдеры, NOW(),
+TIMESTAMP(...) + INTERVAL, удаление с JOIN, FOR UPDATE) и кэширует результат.
+
+База работает в режиме WAL: читатели не ждут писателя, а запись
+сериализуется блокировкой файла (BEGIN IMMEDIATE в транзакциях,
+busy_timeout вместо мгновенной ошибки). Даты и время хранятся текстом
+ISO 8601 и читаются обратно как date, timedelta и datetime — так же,
+как их возвращает aiomysql.
+
+Выбирается в config: DB_CONFIG = {"backend": "sqlite", "path": "diplom.sqlite3"}.
+"""
+import asyncio
+import re
+import sqlite3
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+import aiosqlite
+
+# Таблицы, которые в MySQL создаются вручную до первой миграции
+BASE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS Users (
+        user_id INTEGER PRIMARY KEY,
+        phone VARCHAR(20) NOT NULL,
+        nickname VARCHAR(64) NOT NULL,
+        registration_date DATETIME NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS UserInfo (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        nickname VARCHAR(64),
+        phone VARCHAR(20),
+        zone VARCHAR(16) NOT NULL,
+        computer_count TINYINT UNSIGNED,
+        booking_date DATE NOT NULL,
+        booking_time TIME NOT NULL,
+        computers VARCHAR(255)
+    )
+    """,
+]
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    # В WAL fsync при каждом коммите не нужен для целостности, только для устойчивости
+    "PRAGMA synchronous = NORMAL",
+    # Каскадное удаление мест booking_seats вместе с бронью
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+]
+
+# Переписывание конструкций MySQL, которые встречаются в запросах бота
+_REWRITES = [
+    (re.compile(r"TIMESTAMP\((\w+), (\w+)\) \+ INTERVAL (\w+) MINUTE"),
+     r"datetime(\1 || ' ' || \2, '+' || \3 || ' minutes')"),
+    (re.compile(r"TIMESTAMP\((\w+), (\w+)\)"), r"datetime(\1 || ' ' || \2)"),
+    (re.compile(r"NOW\(\)"), "datetime('now', 'localtime')"),
+    (re.compile(r"CURDATE\(\)"), "date('now', 'localtime')"),
+    # Места в booking_seats удаляются каскадом по внешнему ключу
+    (re.compile(r"DELETE (\w+), \w+\s+FROM \1\s+LEFT JOIN .+?\s+WHERE", re.S), r"DELETE FROM \1 WHERE"),
+    (re.compile(r"INSERT IGNORE"), "INSERT OR IGNORE"),
+    # Транзакция и так держит блокировку записи (BEGIN IMMEDIATE)
+    (re.compile(r"\s+FOR UPDATE\b"), ""),
+    (re.compile(r"%s"), "?"),
+]
+
+
+@lru_cache(maxsize=512)
+def translate(sql):
+    """Переводит текст запроса MySQL в диалект SQLite."""
+    for pattern, replacement in _REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def _adapt_time(value):
+    seconds = int(value.total_seconds())
+    return f"{seconds // 3600:02}:{seconds % 3600 // 60:02}:{seconds % 60:02}"
+
+
+def _convert_time(value):
+    hours, minutes, *seconds = value.decode().split(":")
+    return timedelta(hours=int(hours), minutes=int(minutes), seconds=int(float(seconds[0])) if seconds else 0)
+
+
+def _convert_datetime(value):
+    return datetime.fromisoformat(value.decode())
+
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" ", "seconds"))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(timedelta, _adapt_time)
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter("TIME", _convert_time)
+sqlite3.register_converter("DATETIME", _convert_datetime)
+
+
+class SqliteCursor:
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._cursor is not None:
+            await self._cursor.close()
+        return False
+
+    async def _replace(self, cursor):
+        if self._cursor is not None:
+            await self._cursor.close()
+        self._cursor = cursor
+
+    async def execute(self, sql, params=None):
+        await self._replace(await self._conn.execute(translate(sql), tuple(params or ())))
+
+    async def executemany(self, sql, rows):
+        await self._replace(await self._conn.executemany(translate(sql), list(rows)))
+
+    async def fetchall(self):
+        return await self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+
+class SqliteConnection:
+    def __init__(self, conn):
+        self._conn = conn
+        self.last_usage = asyncio.get_running_loop().time()
+
+    def cursor(self):
+        return SqliteCursor(self._conn)
+
+    async def begin(self):
+        # IMMEDIATE берёт блокировку записи сразу, а не при первой вставке:
+        # две транзакции не упираются друг в друга посередине
+        await self._conn.execute("BEGIN IMMEDIATE")
+
+    async def commit(self):
+        await self._conn.commit()
+
+    async def rollback(self):
+        await self._conn.rollback()
+
+    async def ping(self, reconnect=True):
+        pass
+
+    async def close(self):
+        await self._conn.close()
+
+
+class SqlitePool:
+    """Пул до maxsize соединений с одним файлом базы."""
+
+    def __init__(self, path, maxsize=5):
+        self.path = path
+        # У каждого соединения с ":memory:" своя база, поэтому оно одно
+        self.maxsize = 1 if path == ":memory:" else maxsize
+        self._free = []
+        self._all = []
+        self._cond = asyncio.Condition()
+
+    @property
+    def size(self):
+        return len(self._all)
+
+    @property
+    def freesize(self):
+        return len(self._free)
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.path, isolation_level=None, detect_types=sqlite3.PARSE_DECLTYPES)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        return SqliteConnection(conn)
+
+    async def acquire(self):
+        async with self._cond:
+            while not self._free and len(self._all) >= self.maxsize:
+                await self._cond.wait()
+            if self._free:
+                return self._free.pop()
+            # Место занимается до подключения, чтобы не открыть лишнее соединение
+            self._all.append(None)
+        try:
+            conn = await self._connect()
+        except BaseException:
+            async with self._cond:
+                self._all.remove(None)
+                self._cond.notify()
+            raise
+        self._all[self._all.index(None)] = conn
+        return conn
+
+    async def release(self, conn):
+        conn.last_usage = asyncio.get_running_loop().time()
+        async with self._cond:
+            self._free.append(conn)
+            self._cond.notify()
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        async with self._cond:
+            while len(self._free) < len(self._all):
+                await self._cond.wait()
+            for conn in self._all:
+                await conn.close()
+            self._all.clear()
+            self._free.clear()
+
+
+async def create_pool(path, maxsize=5):
+    """Открывает базу, создаёт базовые таблицы и возвращает пул."""
+    pool = SqlitePool(path, maxsize)
+    conn = await pool.acquire()
+    try:
+        async with conn.cursor() as cursor:
+            for statement in BASE_SCHEMA:
+                await cursor.execute(statement)
+    finally:
+        await pool.release(conn)
+    return pool
@@ -0,0 +1,18 @@
+from aiogram.fsm.state import State, StatesGroup
+
+
+class BookingStates(StatesGroup):
+    awaiting_account = State()
+    awaiting_nickname = State()
+    awaiting_phone = State()
+    awaiting_new_phone = State()
+    awaiting_new_nickname = State()
+    awaiting_zone = State()
+    awaiting_number_of_computers = State()
+    awaiting_computer_selection = State()
+    awaiting_date = State()
+    awaiting_time = State()
+    awaiting_duration = State()
+    awaiting_confirmation = State()
+    choosing_found_slot = State()
+    cancelling = State()
@@ -0,0 +1,185 @@
+"""
+Хранилища состояния диалога (FSM) для aiogram.
+
+TTLMemoryStorage держит сессии в памяти процесса и удаляет простаивающие,
+SQLiteStorage сохраняет незавершённые брони между перезапусками и может
+использоваться несколькими процессами бота на одной машине.
+Нужное хранилище выбирается в config.py (FSM_STORAGE = "memory" | "sqlite").
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+import config
+
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def _state_name(state):
+    return state.state if isinstance(state, State) else state
+
+
+class TTLMemoryStorage(BaseStorage):
+    """
+    Хранилище в памяти с вытеснением простаивающих сессий.
+    Записи лежат в OrderedDict в порядке последней записи, и срок жизни
+    отсчитывается от неё же (чтение его не продлевает), поэтому чтение,
+    запись и удаление просроченных записей выполняются за O(1).
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._records = OrderedDict()
+
+    def _evict(self, now):
+        while self._records:
+            key, (expires_at, _, _) = next(iter(self._records.items()))
+            if expires_at > now:
+                break
+            del self._records[key]
+
+    def _get(self, key):
+        now = time.monotonic()
+        self._evict(now)
+        record = self._records.get(key)
+        if record is None:
+            return None, {}
+        return record[1], record[2]
+
+    def _put(self, key, state, data):
+        now = time.monotonic()
+        self._evict(now)
+        self._records.pop(key, None)
+        if state is not None or data:
+            self._records[key] = (now + self.ttl, state, data)
+
+    async def set_state(self, key, state=None):
+        _, data = self._get(key)
+        self._put(key, _state_name(state), data)
+
+    async def get_state(self, key):
+        state, _ = self._get(key)
+        return state
+
+    async def set_data(self, key, data):
+        state, _ = self._get(key)
+        self._put(key, state, dict(data))
+
+    async def get_data(self, key):
+        _, data = self._get(key)
+        return dict(data)
+
+    async def close(self):
+        self._records.clear()
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Постоянное хранилище на SQLite (режим WAL).
+    Запросы выполняются через aiosqlite, как и в sqlite_backend, поэтому
+    цикл событий не блокируется. Соединение открывается при первом запросе;
+    чтение и запись одной операции идут подряд под блокировкой.
+    Просроченные сессии не возвращаются и периодически удаляются из файла.
+    """
+
+    CLEANUP_INTERVAL = 60
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._conn = None
+        self._lock = asyncio.Lock()
+        self._next_cleanup = 0
+
+    @staticmethod
+    def _key(key):
+        return (
+            f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:"
+            f"{key.business_connection_id or ''}:{key.destiny}"
+        )
+
+    async def _connection(self):
+        if self._conn is None:
+            conn = await aiosqlite.connect(self.path, isolation_level=None)
+            await conn.execute("PRAGMA journal_mode=WAL")
+            await conn.execute("PRAGMA synchronous=NORMAL")
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS fsm_sessions (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            await conn.execute("CREATE INDEX IF NOT EXISTS ix_fsm_sessions_expires ON fsm_sessions (expires_at)")
+            self._conn = conn
+        return self._conn
+
+    async def _load(self, key):
+        conn = await self._connection()
+        async with conn.execute(
+            "SELECT state, data FROM fsm_sessions WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    async def _store(self, key, state, data):
+        conn = await self._connection()
+        now = time.time()
+        if state is None and not data:
+            await conn.execute("DELETE FROM fsm_sessions WHERE key = ?", (key,))
+        else:
+            await conn.execute(
+                "INSERT OR REPLACE INTO fsm_sessions (key, state, data, expires_at) VALUES (?, ?, ?, ?)",
+                (key, state, json.dumps(data, ensure_ascii=False), now + self.ttl)
+            )
+        if now >= self._next_cleanup:
+            await conn.execute("DELETE FROM fsm_sessions WHERE expires_at <= ?", (now,))
+            self._next_cleanup = now + self.CLEANUP_INTERVAL
+
+    async def set_state(self, key, state=None):
+        key = self._key(key)
+        async with self._lock:
+            _, data = await self._load(key)
+            await self._store(key, _state_name(state), data)
+
+    async def get_state(self, key):
+        async with self._lock:
+            state, _ = await self._load(self._key(key))
+        return state
+
+    async def set_data(self, key, data):
+        key = self._key(key)
+        async with self._lock:
+            state, _ = await self._load(key)
+            await self._store(key, state, dict(data))
+
+    async def get_data(self, key):
+        async with self._lock:
+            _, data = await self._load(self._key(key))
+        return data
+
+    async def close(self):
+        async with self._lock:
+            if self._conn is not None:
+                await self._conn.close()
+                self._conn = None
+
+
+def create_storage():
+    """Создаёт хранилище FSM по настройкам из config.py."""
+    ttl = getattr(config, "FSM_TTL", DEFAULT_TTL)
+    backend = getattr(config, "FSM_STORAGE", "memory")
+    if backend == "sqlite":
+        return SQLiteStorage(getattr(config, "FSM_SQLITE_PATH", "fsm.sqlite3"), ttl=ttl)
+    if backend == "memory":
+        return TTLMemoryStorage(ttl=ttl)
+    raise ValueError(f"Неизвестное хранилище FSM: {backend}")
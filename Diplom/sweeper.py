@@ -0,0 +1,81 @@
+"""
+Фоновая очистка таблицы броней.
+
+Закончившиеся (начало + длительность уже прошли) брони периодически переносятся из UserInfo в UserInfo_history
+пачками по SWEEP_BATCH_SIZE, между пачками цикл событий свободен для
+обработчиков. Если задан NO_SHOW_GRACE_MINUTES, брони без отметки о приходе
+(database.mark_checked_in, команда администратора /checkin) снимаются через
+столько минут после начала, и их места освобождаются.
+"""
+import asyncio
+import logging
+from contextlib import suppress
+from datetime import datetime, timedelta
+
+import config
+import database
+import occupancy
+
+# Период запуска очистки (с)
+SWEEP_INTERVAL = getattr(config, "SWEEP_INTERVAL", 300)
+# Сколько броней переносится одной транзакцией
+SWEEP_BATCH_SIZE = getattr(config, "SWEEP_BATCH_SIZE", 500)
+# Пауза между пачками (с)
+SWEEP_BATCH_PAUSE = getattr(config, "SWEEP_BATCH_PAUSE", 0.1)
+# Через сколько минут после начала снимать бронь без отметки о приходе (None — не снимать)
+NO_SHOW_GRACE_MINUTES = getattr(config, "NO_SHOW_GRACE_MINUTES", None)
+
+_task = None
+
+
+async def _drain(selector, cutoff):
+    total = 0
+    while True:
+        count = await database.archive_bookings(selector, cutoff, SWEEP_BATCH_SIZE)
+        total += count
+        if count < SWEEP_BATCH_SIZE:
+            return total
+        await asyncio.sleep(SWEEP_BATCH_PAUSE)
+
+
+async def sweep_once(now=None):
+    """
+    Один проход очистки.
+    :return: Словарь {причина: число перенесённых броней}.
+    """
+    now = now or datetime.now()
+    moved = {}
+    if NO_SHOW_GRACE_MINUTES is not None:
+        moved["no_show"] = await _drain("no_show", now - timedelta(minutes=NO_SHOW_GRACE_MINUTES))
+    moved["finished"] = await _drain("finished", now)
+    occupancy.prune()
+    return moved
+
+
+async def _run():
+    while True:
+        try:
+            moved = await sweep_once()
+            if any(moved.values()):
+                logging.info(f"Очистка броней: перенесено в историю {moved}")
+        except database.DatabaseError as e:
+            logging.error(f"Ошибка очистки броней: {e}")
+        await asyncio.sleep(SWEEP_INTERVAL)
+
+
+def start_sweeper():
+    """Запускает фоновую очистку в текущем цикле событий."""
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_run(), name="booking-sweeper")
+    return _task
+
+
+async def stop_sweeper():
+    """Останавливает очистку; незавершённая транзакция пачки откатывается."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        with suppress(asyncio.CancelledError):
+            await _task
+        _task = None
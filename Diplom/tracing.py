@@ -0,0 +1,194 @@
+"""
+Трассировка обработки обновлений.
+
+TracingMiddleware (outer middleware на dp.update) заводит для каждого
+обновления Trace с trace_id, засекает время обработки и собирает число
+и длительность запросов к базе (через database.query_listeners). По итогам
+обновления пишутся метрики handler_seconds, updates_total, update_db_queries
+и update_db_seconds с меткой обработчика; медленные обновления попадают
+в лог предупреждением.
+
+HandlerNameMiddleware (inner middleware на типы событий) записывает в Trace
+имя сработавшего обработчика. Метрики отдаются в формате Prometheus
+локальным HTTP-сервером (start_metrics_server), логи при LOG_FORMAT = "json"
+пишутся строками JSON с trace_id обновления.
+"""
+import json
+import logging
+import time
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiohttp import web
+
+import config
+import database
+import metrics
+
+# Формат логов: "text" (как раньше) или "json"
+LOG_FORMAT = getattr(config, "LOG_FORMAT", "text")
+# Обновления дольше этого (в секундах) пишутся в лог предупреждением
+SLOW_UPDATE_SECONDS = getattr(config, "SLOW_UPDATE_SECONDS", 1.0)
+# Адрес сервера /metrics; METRICS_PORT = None отключает сервер
+METRICS_HOST = getattr(config, "METRICS_HOST", "127.0.0.1")
+METRICS_PORT = getattr(config, "METRICS_PORT", 9090)
+
+
+@dataclass(slots=True)
+class Trace:
+    trace_id: str
+    update_id: int
+    handler: str = "unhandled"
+    status: str = "ok"
+    queries: int = 0
+    db_seconds: float = 0.0
+
+
+current_trace = ContextVar("current_trace", default=None)
+
+
+def _on_query(name, seconds, failed):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.queries += 1
+        trace.db_seconds += seconds
+
+
+database.query_listeners.append(_on_query)
+
+
+def name_handler(callback):
+    """Уточняет имя обработчика, если событие передано дальше вручную."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.handler = callback.__name__
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Inner middleware: запоминает сработавший обработчик и его ошибку."""
+
+    async def __call__(self, handler, event, data):
+        trace = current_trace.get()
+        if trace is not None:
+            trace.handler = data["handler"].callback.__name__
+        try:
+            return await handler(event, data)
+        except Exception:
+            if trace is not None:
+                trace.status = "error"
+            raise
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Outer middleware на dp.update: время, запросы к базе и лог на обновление."""
+
+    def __init__(self, slow_seconds=SLOW_UPDATE_SECONDS):
+        self.slow_seconds = slow_seconds
+
+    async def __call__(self, handler, event, data):
+        trace = Trace(trace_id=uuid.uuid4().hex[:16], update_id=event.update_id)
+        token = current_trace.set(trace)
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+            if result is UNHANDLED:
+                trace.status = "unhandled"
+            return result
+        except Exception:
+            trace.status = "error"
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            current_trace.reset(token)
+            self._record(trace, elapsed)
+
+    def _record(self, trace, elapsed):
+        metrics.handler_seconds.observe(elapsed, trace.handler)
+        metrics.updates_total.inc(trace.handler, trace.status)
+        metrics.update_db_queries.observe(trace.queries, trace.handler)
+        metrics.update_db_seconds.observe(trace.db_seconds, trace.handler)
+        log = logging.warning if elapsed >= self.slow_seconds else logging.debug
+        log(
+            f"Обновление {trace.update_id} [{trace.trace_id}] {trace.handler}: {trace.status}, "
+            f"{elapsed * 1000:.1f} мс, запросов к базе {trace.queries} ({trace.db_seconds * 1000:.1f} мс)"
+        )
+
+
+class TraceIdFilter(logging.Filter):
+    """Добавляет к записям лога trace_id текущего обновления."""
+
+    def filter(self, record):
+        trace = current_trace.get()
+        record.trace_id = trace.trace_id if trace is not None else None
+        record.update_id = trace.update_id if trace is not None else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись лога — одна строка JSON."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "trace_id", None) is not None:
+            entry["trace_id"] = record.trace_id
+            entry["update_id"] = record.update_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(level=logging.INFO, log_format=LOG_FORMAT):
+    """Настраивает корневой логгер: текст как в basicConfig или JSON."""
+    handler = logging.StreamHandler()
+    handler.addFilter(TraceIdFilter())
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    # force: bot_handlers при импорте уже вызывает basicConfig
+    logging.basicConfig(level=level, handlers=[handler], force=True)
+
+
+def setup_tracing(dp):
+    """Подключает middleware трассировки к диспетчеру."""
+    dp.update.outer_middleware(TracingMiddleware())
+    name_middleware = HandlerNameMiddleware()
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(name_middleware)
+
+
+async def _handle_metrics(request):
+    return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+_runner = None
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Запускает HTTP-сервер с метриками на http://host:port/metrics."""
+    global _runner
+    if port is None or _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    _runner = runner
+    logging.info(f"Метрики доступны на http://{host}:{port}/metrics")
+
+
+async def stop_metrics_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -1,5 +1,7 @@
 from datetime import datetime, timedelta
 
+from occupancy import slot_datetime
+
 def validate_phone(phone):
     """Валидация номера телефона."""
     if phone.startswith('+7') and len(phone) == 12:
@@ -13,3 +15,17 @@ def get_min_max_dates():
     now = datetime.now()
     max_date = now + timedelta(days=7)
     return now, max_date
+
+def format_duration(minutes):
+    """Длительность брони в виде '1 ч 30 мин'."""
+    hours, minutes = divmod(int(minutes), 60)
+    parts = []
+    if hours:
+        parts.append(f"{hours} ч")
+    if minutes:
+        parts.append(f"{minutes} мин")
+    return " ".join(parts) or "0 мин"
+
+def format_slot(slot, fmt="%d.%m.%Y %H:%M"):
+    """Номер слота (occupancy.slot_at) в виде даты и времени для показа пользователю."""
+    return slot_datetime(slot).strftime(fmt)
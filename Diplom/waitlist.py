@@ -0,0 +1,217 @@
+"""
+Лист ожидания занятого времени.
+
+Если при подтверждении брони место оказалось занято, пользователь может
+встать в лист ожидания на те же компьютеры (или консоль), время и
+длительность. Ожидающие хранятся в памяти процесса в порядке записи
+и проиндексированы по местам (номер слота, номер компьютера), поэтому
+при освобождении мест кандидаты находятся поиском в словаре.
+
+Освобождение приходит событием database.booking_released_listeners
+(удаление, отмена, перенос в историю) — без опроса базы. Ожидающему,
+чья заявка теперь выполнима по индексу занятости, сразу приходит
+сообщение с кнопкой брони, и его места удерживаются WAITLIST_HOLD_SECONDS:
+пока удержание действует, остальным ожидающим эти места не предлагаются,
+и на одно освободившееся место не бросаются все сразу. Если за время
+удержания бронь не оформлена, заявка снимается, и места предлагаются
+следующему. Удержанные места не может занять и обычное бронирование
+другого пользователя: reserve_booking спрашивает их через
+database.reservation_guards.
+
+Лист ожидания не переживает перезапуск бота.
+"""
+import asyncio
+import itertools
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Tuple
+
+import config
+import database
+import metrics
+import occupancy
+from keyboards import waitlist_offer_keyboard
+from send_queue import HIGH, post, priority
+from utils import format_slot
+from zones import booking_computers, console_zones, full_zone_names
+
+# Сколько секунд места удерживаются за ожидающим, которому они предложены
+WAITLIST_HOLD_SECONDS = getattr(config, "WAITLIST_HOLD_SECONDS", 180)
+# Сколько заявок одновременно может быть у одного пользователя
+WAITLIST_PER_USER = getattr(config, "WAITLIST_PER_USER", 3)
+
+
+@dataclass(slots=True)
+class Waiter:
+    id: int
+    uid: int
+    zone: str
+    slot: int
+    minutes: int
+    computers: Tuple[int, ...]
+    held: Optional[asyncio.TimerHandle] = None
+
+    def seats(self):
+        return [
+            (slot, num)
+            for slot in range(self.slot, self.slot + occupancy.slot_count(self.minutes))
+            for num in self.computers
+        ]
+
+
+_ids = itertools.count(1)
+# Заявки в порядке записи и индекс {место: id заявок}
+_waiters = {}
+_by_seat = {}
+# Места, предложенные ожидающему: {место: id заявки}
+_held = {}
+_bot = None
+
+
+def setup_waitlist(bot):
+    """Запоминает бота, от имени которого отправляются предложения."""
+    global _bot
+    _bot = bot
+
+
+def get(waiter_id):
+    return _waiters.get(waiter_id)
+
+
+def offered(waiter_id, uid):
+    """:return: Заявка waiter_id пользователя uid, если предложение по ней ещё действует, иначе None."""
+    waiter = _waiters.get(waiter_id)
+    if waiter is None or waiter.uid != uid or waiter.held is None:
+        return None
+    if waiter.held.when() <= asyncio.get_running_loop().time():
+        return None
+    return waiter
+
+
+def join(uid, zone, slot, minutes, computers):
+    """
+    Записывает пользователя в лист ожидания. Если места уже свободны,
+    предложение приходит сразу.
+    :return: Waiter или None, если у пользователя уже WAITLIST_PER_USER заявок.
+    """
+    computers = tuple(sorted(int(num) for num in computers))
+    mine = [waiter for waiter in _waiters.values() if waiter.uid == uid]
+    for waiter in mine:
+        if (waiter.zone, waiter.slot, waiter.minutes, waiter.computers) == (zone, slot, minutes, computers):
+            return waiter
+    if len(mine) >= WAITLIST_PER_USER:
+        return None
+
+    waiter = Waiter(next(_ids), uid, zone, int(slot), int(minutes), computers)
+    _waiters[waiter.id] = waiter
+    for seat in waiter.seats():
+        _by_seat.setdefault(seat, set()).add(waiter.id)
+    metrics.waitlist_waiting.set(len(_waiters))
+    _offer([waiter.id])
+    return waiter
+
+
+def leave(waiter_id):
+    """Снимает заявку и её удержание; возвращает снятую заявку или None."""
+    waiter = _waiters.pop(waiter_id, None)
+    if waiter is None:
+        return None
+    if waiter.held is not None:
+        waiter.held.cancel()
+    for seat in waiter.seats():
+        ids = _by_seat.get(seat)
+        if ids is not None:
+            ids.discard(waiter_id)
+            if not ids:
+                del _by_seat[seat]
+        if _held.get(seat) == waiter_id:
+            del _held[seat]
+    metrics.waitlist_waiting.set(len(_waiters))
+    return waiter
+
+
+def _candidates(seats):
+    """Заявки на любые из мест seats в порядке записи."""
+    return sorted({waiter_id for seat in seats for waiter_id in _by_seat.get(seat, ())})
+
+
+def offer_seats(seats):
+    """Предлагает места seats [(номер слота, номер компьютера)] первым подходящим ожидающим."""
+    _offer(_candidates(seats))
+
+
+def _offer(waiter_ids):
+    """Предлагает места тем из waiter_ids, чьи заявки выполнимы и не пересекаются с удержанными."""
+    now = datetime.now()
+    for waiter_id in waiter_ids:
+        waiter = _waiters.get(waiter_id)
+        if waiter is None or waiter.held is not None:
+            continue
+        if occupancy.slot_datetime(waiter.slot) <= now:
+            leave(waiter_id)
+            continue
+        seats = waiter.seats()
+        if any(seat in _held for seat in seats) or not occupancy.is_free(waiter.slot, waiter.computers, waiter.minutes):
+            continue
+        for seat in seats:
+            _held[seat] = waiter_id
+        waiter.held = asyncio.get_running_loop().call_later(WAITLIST_HOLD_SECONDS, _expire, waiter_id)
+        metrics.waitlist_offers.inc("offered")
+        _notify(waiter)
+
+
+def _notify(waiter):
+    if _bot is None:
+        logging.warning(f"Лист ожидания: бот не задан, предложение {waiter.id} не отправлено")
+        return
+    place = full_zone_names.get(waiter.zone, waiter.zone)
+    if waiter.zone not in console_zones:
+        place += f", ПК: {', '.join(map(str, waiter.computers))}"
+    text = (
+        f"🔔 Освободилось время из листа ожидания: {format_slot(waiter.slot, '%H:%M %d.%m.%Y')}, {place}.\n"
+        f"Места удерживаются для вас {WAITLIST_HOLD_SECONDS // 60} мин."
+    )
+    with priority(HIGH):
+        post(_bot.send_message(waiter.uid, text, reply_markup=waitlist_offer_keyboard(waiter.id)))
+
+
+def _expire(waiter_id):
+    waiter = leave(waiter_id)
+    if waiter is not None:
+        metrics.waitlist_offers.inc("expired")
+        offer_seats(waiter.seats())
+
+
+def _held_for_others(uid, slot, computers, minutes):
+    """Компьютеры из запроса, места которых удержаны за заявкой другого пользователя."""
+    held = set()
+    for seat_slot in range(slot, slot + occupancy.slot_count(minutes)):
+        for num in computers:
+            waiter_id = _held.get((seat_slot, num))
+            if waiter_id is not None and _waiters[waiter_id].uid != uid:
+                held.add(num)
+    return held
+
+
+def _on_released(booking_ids, seats):
+    offer_seats(seats)
+
+
+def _on_saved(uid, booking):
+    """Бронь пользователя закрывает его заявки на те же места; оставшиеся места предлагаются другим."""
+    booked = {
+        (slot, num)
+        for slot in range(booking.start_slot, booking.start_slot + occupancy.slot_count(booking.duration_minutes))
+        for num in booking_computers(booking.zone, booking.computers)
+    }
+    for waiter in [waiter for waiter in _waiters.values() if waiter.uid == uid]:
+        if booked.intersection(waiter.seats()):
+            leave(waiter.id)
+            metrics.waitlist_offers.inc("booked")
+            offer_seats(set(waiter.seats()) - booked)
+
+
+database.booking_released_listeners.append(_on_released)
+database.booking_saved_listeners.append(_on_saved)
+database.reservation_guards.append(_held_for_others)
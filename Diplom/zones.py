@@ -0,0 +1,40 @@
+max_computers_per_zone = {
+    "izi": 8,
+    "pro": 13,
+    "bootkemp": 5,
+    "ps4": 1,
+    "ps5": 1,
+}
+
+full_zone_names = {
+    "izi": "Изи-Лайн",
+    "pro": "Про-Лайн",
+    "bootkemp": "Буткемп",
+    "ps4": "PlayStation 4 зона",
+    "ps5": "PlayStation 5 зона",
+}
+
+zone_computer_mapping = {
+    "izi": range(1, 9),
+    "pro": range(9, 22),
+    "bootkemp": range(22, 27),
+    "ps4": [27],
+    "ps5": [28],
+}
+
+console_zones = ("ps4", "ps5")
+
+
+def booking_computers(zone, computers):
+    """
+    Возвращает список номеров машин, занятых бронью.
+    Для консольных зон номер берётся из zone_computer_mapping,
+    для остальных разбирается строка вида "1,2,3" из колонки computers.
+    """
+    if zone in console_zones:
+        return list(zone_computer_mapping[zone])
+    if not computers:
+        return []
+    if isinstance(computers, str):
+        return [int(num) for num in computers.split(",") if num.strip()]
+    return [int(num) for num in computers]